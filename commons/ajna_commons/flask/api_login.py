@@ -3,10 +3,14 @@
 Funções e classes para gerenciar login e tokens (Flask jwt)
 
 """
+from ajna_commons.flask.auth import AuthBusyError
 from ajna_commons.flask.conf import SECRET
+from ajna_commons.flask.flask_log import log_access
 from ajna_commons.flask.log import logger
 from ajna_commons.flask.login import authenticate
+from ajna_commons.flask.revocation import MemoryRevocationStore
 from ajna_commons.flask.user import User
+from ajna_commons.utils import timing
 from ajna_commons.utils.sanitiza import mongo_sanitizar
 from flask import Blueprint, Flask, jsonify
 from flask import Flask, jsonify, request
@@ -16,24 +20,30 @@ from flask_jwt_extended import (
 )
 
 
-def configure(app: Flask):
+def configure(app: Flask, revocation_store=None):
     """Insere as views de login e logout na api.
 
     Para utilizar, importar modulo api_login e chamar configure(app)
     em uma aplicação Flask.
 
+    revocation_store guarda os tokens revogados no logout (ver
+    ajna_commons.flask.revocation). O padrão, MemoryRevocationStore, vale
+    somente para o processo; com vários workers usar, por exemplo,
+    RedisRevocationStore(conf.redisdb, bloom=True).
+
     """
     api = Blueprint('/api', __name__)
     app.config['JWT_SECRET_KEY'] = SECRET
     app.config['JWT_BLACKLIST_ENABLED'] = True
     jwt = JWTManager(app)
 
-    blacklist = set()
+    if revocation_store is None:
+        revocation_store = MemoryRevocationStore()
 
     @jwt.token_in_blacklist_loader
     def check_if_token_in_blacklist(decrypted_token):
         jti = decrypted_token['jti']
-        return jti in blacklist
+        return jti in revocation_store
 
     @api.route('/api/login', methods=['POST'])
     def login():
@@ -49,7 +59,7 @@ def configure(app: Flask):
         user = verify_password(username, password)
         if user is None:
             return jsonify({"msg": "username ou password invalidos"}), 401
-        logger.info('Entrando com usuário %s' % username)
+        logger.info('Entrando com usuário %s', username)
         access_token = create_access_token(identity=user.id)
         return jsonify(access_token=access_token), 200
 
@@ -57,14 +67,14 @@ def configure(app: Flask):
     def login_certificado():
         """View para efetuar login via certificado digital."""
         s_dn = request.environ.get('HTTP_SSL_CLIENT_S_DN')
-        logger.info('URL %s - s_dn %s' % (request.url, s_dn))
+        logger.info('URL %s - s_dn %s', request.url, s_dn)
         if s_dn:
             name = None
             names = dict([x.split('=') for x in s_dn.split(',')])
-            logger.info('name %s' % names)
+            logger.info('name %s', names)
             if names:
                 name = names.get('CN').split(':')[-1]
-            logger.info('%s ofereceu certificado digital' % name)
+            logger.info('%s ofereceu certificado digital', name)
             if name:
                 name = name.strip().lower()
                 user = User.get(name)
@@ -79,10 +89,10 @@ def configure(app: Flask):
     @api.route('/api/logout', methods=['DELETE'])
     @jwt_required
     def logout():
-        jti = get_raw_jwt()['jti']
-        blacklist.add(jti)
+        raw_jwt = get_raw_jwt()
+        revocation_store.add(raw_jwt['jti'], raw_jwt.get('exp'))
         current_user = get_jwt_identity()
-        logger.info('Usuário %s efetuou logout' % current_user)
+        logger.info('Usuário %s efetuou logout', current_user)
         return jsonify({"msg": "Logout efetuado"}), 200
 
     @api.route('/api/test')
@@ -91,43 +101,45 @@ def configure(app: Flask):
         current_user = get_jwt_identity()
         return jsonify({'user.id': current_user}), 200
 
-    def make_log():
-        path = None
-        method = None
-        ip = None
+    @api.errorhandler(AuthBusyError)
+    def auth_busy(err):
+        """Fila de verificação de senhas cheia: pedir nova tentativa."""
+        logger.warning('Login recusado: %s', err)
+        return jsonify({'msg': 'Autenticação ocupada, tente novamente'}), \
+            503, {'Retry-After': '5'}
+
+    def make_log(response):
+        """Grava registro de acesso em JSON (ver flask_log.log_access)."""
         try:
             current_user = get_jwt_identity()
         except Exception as err:
-            logger.info(str(err), exc_info=True)
-            current_user = 'no user' + str(err)
-        logger.info('Usuário %s' % current_user)
+            logger.debug(str(err), exc_info=True)
+            current_user = 'no user'
+        log_access(logger, response, current_user, api=True)
 
-        try:
-            path = request.path
-            method = request.method
-            ip = request.environ.get('HTTP_X_REAL_IP',
-                                     request.remote_addr)
-        finally:
-            logger.info('API LOG url: %s %s IP:%s User: %s' %
-                        (path, method, ip, current_user))
-
-    # @app.before_request
-    # def before_request_callback():
-    #    make_log()
+    @app.before_request
+    def before_request_callback():
+        # configure_applog pode já ter iniciado as métricas
+        if timing.current() is None:
+            timing.start()
 
     @app.after_request
     def after_request_callback(response):
-        make_log()
+        make_log(response)
         return response
 
+    @app.teardown_request
+    def teardown_request_callback(exc):
+        timing.finish()
+
     def verify_password(username, password):
         username = mongo_sanitizar(username)
         # Não aceitar senha vazia!!
         password = mongo_sanitizar(password)
         user = authenticate(username, password)
         if user is not None:
-            logger.info('Usuário %s %s autenticou via API' %
-                        (user.id, user.name))
+            logger.info('Usuário %s %s autenticou via API',
+                        user.id, user.name)
         return user
 
     app.register_blueprint(api)
@@ -0,0 +1,145 @@
+"""Verificação de senhas fora da thread da requisição.
+
+check_password_hash (PBKDF2) é lento de propósito. Em picos de login (ex:
+troca de turno) as verificações simultâneas disputam a CPU e as requisições
+se acumulam sem limite. Aqui elas são feitas em um pool limitado de threads
+(o hashlib libera o GIL durante o PBKDF2), com limite de pedidos na fila:
+acima dele, PasswordVerifier.check levanta AuthBusyError, que as views de
+login convertem em HTTP 503 em vez de acumular espera. A thread da
+requisição continua aguardando o resultado (até AUTH_TIMEOUT): o pool
+limita a concorrência das verificações, não libera workers.
+
+Verificações bem sucedidas ficam guardadas por AUTH_VERIFIED_TTL segundos,
+indexadas por HMAC (com chave aleatória do processo) do hash e da senha,
+de forma que a senha não fica em memória e uma troca de senha (novo hash)
+não aproveita verificações antigas.
+
+Se AUTH_HASH_METHOD for definido (ex: 'pbkdf2:sha256:600000'), hashes
+gravados com outro método são refeitos no próximo login bem sucedido
+(ver DBUser.get).
+
+"""
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from werkzeug.security import check_password_hash
+
+try:
+    from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS
+except ImportError:
+    DEFAULT_PBKDF2_ITERATIONS = None
+
+from ajna_commons.utils.cache import LRUCache
+
+AUTH_WORKERS = int(os.environ.get('AUTH_WORKERS', 4))
+AUTH_MAX_PENDING = int(os.environ.get('AUTH_MAX_PENDING', 32))
+AUTH_TIMEOUT = float(os.environ.get('AUTH_TIMEOUT', 10))
+AUTH_VERIFIED_TTL = int(os.environ.get('AUTH_VERIFIED_TTL', 60))
+AUTH_HASH_METHOD = os.environ.get('AUTH_HASH_METHOD')
+
+
+def hash_params(method: str) -> tuple:
+    """Parâmetros efetivos de um método de hash do werkzeug.
+
+    Completa os valores omitidos com os padrões do werkzeug, de forma que
+    'pbkdf2:sha256' e o prefixo 'pbkdf2:sha256:<padrão>' de um hash
+    gravado sejam iguais.
+    """
+    name, *args = method.split(':')
+    if name == 'pbkdf2':
+        hash_name = args[0] if args else 'sha256'
+        iterations = int(args[1]) if len(args) > 1 \
+            else DEFAULT_PBKDF2_ITERATIONS
+        return (name, hash_name, iterations)
+    if name == 'scrypt':
+        return (name, *(tuple(map(int, args)) if args else (2 ** 15, 8, 1)))
+    return (name, *args)
+
+
+class AuthBusyError(Exception):
+    """Fila de verificação de senhas cheia (mapear para HTTP 503)."""
+
+
+class PasswordVerifier():
+    """Verifica senhas em pool limitado de threads, com cache de acertos.
+
+    Args:
+        workers: threads de verificação
+        max_pending: pedidos aguardando além dos em execução
+        timeout: segundos máximos de espera por uma verificação
+        ttl: segundos que uma verificação bem sucedida fica em cache
+        method: método de hash desejado (None = não refaz hashes)
+
+    """
+
+    def __init__(self, workers=AUTH_WORKERS, max_pending=AUTH_MAX_PENDING,
+                 timeout=AUTH_TIMEOUT, ttl=AUTH_VERIFIED_TTL,
+                 method=AUTH_HASH_METHOD):
+        """Cria pool e cache."""
+        self.timeout = timeout
+        self.method = method
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix='auth')
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        self.verified = LRUCache(max_items=10000, ttl=ttl)
+        self._key = os.urandom(32)
+        self.busy = 0
+
+    def _digest(self, encripted, password):
+        message = '%s\0%s' % (encripted, password)
+        return hmac.new(self._key, message.encode('utf-8'),
+                        hashlib.sha256).digest()
+
+    def check(self, encripted, password) -> bool:
+        """Confere senha contra hash (como check_password_hash).
+
+        Raises:
+            AuthBusyError: fila cheia ou verificação além de timeout
+
+        """
+        if not encripted or password is None:
+            return False
+        digest = self._digest(encripted, password)
+        if self.verified.get(digest):
+            return True
+        if not self._slots.acquire(blocking=False):
+            self.busy += 1
+            raise AuthBusyError('Fila de autenticação cheia')
+        try:
+            future = self.executor.submit(check_password_hash,
+                                          encripted, password)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            result = future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            self.busy += 1
+            raise AuthBusyError('Tempo de autenticação esgotado')
+        if result:
+            self.verified.set(digest, True)
+        return result
+
+    def needs_rehash(self, encripted) -> bool:
+        """True se hash não foi gerado com o método configurado."""
+        if not self.method or not encripted:
+            return False
+        try:
+            return hash_params(encripted.split('$', 1)[0]) != \
+                hash_params(self.method)
+        except ValueError:
+            return True
+
+    def info(self):
+        """Acertos do cache de verificações e recusas por fila cheia."""
+        info = self.verified.stats.as_dict()
+        info['busy'] = self.busy
+        return info
+
+
+password_verifier = PasswordVerifier()
@@ -1,4 +1,21 @@
-"""Configura logs específicos para o Flask."""
+"""Configura logs específicos para o Flask.
+
+configure_applog grava, ao fim de cada requisição, um registro de acesso
+em JSON (uma linha) com método, url, status, tamanho da resposta, IP,
+usuário e as métricas de ajna_commons.utils.timing (duração, tempo e
+número de consultas ao BD, acertos e faltas de cache). Ex:
+
+    {"ts": "2019-05-02T13:04:10.123456", "method": "GET", "path": "/api/x",
+     "status": 200, "size": 1532, "ip": "10.0.0.1", "user": "ivan",
+     "duration_ms": 35.2, "db_ms": 30.1, "db_queries": 2,
+     "cache_hits": 0, "cache_misses": 1}
+
+Respostas em stream (ex: api_utils.stream_response) são registradas ao
+fechamento da resposta, com "streamed": true, size igual aos bytes
+efetivamente enviados e duration_ms até o fim do envio (ver log_access).
+
+"""
+import json
 import logging
 from _datetime import datetime
 from flask import request
@@ -6,6 +23,7 @@ from flask_login import current_user
 from flask.logging import default_handler
 
 import ajna_commons.flask.log as log
+from ajna_commons.utils import timing
 
 
 class ContextualFilter(logging.Filter):
@@ -25,6 +43,77 @@ class ContextualFilter(logging.Filter):
         return True
 
 
+class AccessRecord(log.LazyLogArg):
+    """Registro de acesso serializado em JSON somente ao ser formatado.
+
+    Com a fila de log (LOG_QUEUE) a serialização ocorre fora da thread
+    da requisição.
+    """
+
+    def __init__(self, fields: dict):
+        """Guarda campos do registro."""
+        self.fields = fields
+
+    def __str__(self):
+        return json.dumps(self.fields, default=str)
+
+
+def access_record(response, user_name, **extra) -> AccessRecord:
+    """Monta registro de acesso da requisição atual do Flask.
+
+    Args:
+        response: resposta do Flask (status e tamanho)
+        user_name: usuário a registrar
+        extra: campos adicionais
+
+    """
+    fields = {'ts': datetime.utcnow().isoformat(),
+              'method': request.method,
+              'path': request.path,
+              'status': response.status_code,
+              'size': response.content_length,
+              'ip': request.environ.get('HTTP_X_REAL_IP',
+                                        request.remote_addr),
+              'user': user_name}
+    metrics = timing.current()
+    if metrics is not None:
+        fields.update(metrics.as_dict())
+    fields.update(extra)
+    return AccessRecord(fields)
+
+
+def log_access(logger, response, user_name, **extra):
+    """Grava registro de acesso de response em logger.
+
+    Em respostas em stream, o registro é gravado somente quando o servidor
+    fecha a resposta, com os bytes enviados e a duração até aquele ponto.
+    """
+    record = access_record(response, user_name, **extra)
+    if not response.is_streamed:
+        logger.info('%s', record)
+        return
+    metrics = timing.current()
+    body = response.response
+    sent = [0]
+
+    def counting():
+        for chunk in body:
+            sent[0] += len(chunk.encode('utf-8') if isinstance(chunk, str)
+                           else chunk)
+            yield chunk
+
+    def on_close():
+        if hasattr(body, 'close'):
+            body.close()
+        record.fields.update({'streamed': True, 'size': sent[0]})
+        if metrics is not None:
+            record.fields.update(metrics.as_dict())
+        logger.info('%s', record)
+
+    response.response = counting()
+    response.call_on_close(on_close)
+
+
 def configure_applog(app):
     """Cria logger para o processo web (flask)."""
     # log_format = ('%(utcnow)s\tl=%(levelname)s\tu=%(user_id)s\tip=%(ip)s'
@@ -33,23 +122,27 @@ def configure_applog(app):
     app.logger.setLevel(logging.DEBUG)
     # app.logger.addFilter(ContextualFilter())
     app.logger.removeHandler(default_handler)
-    app.logger.addHandler(log.activity_handler)
-    app.logger.addHandler(log.error_handler)
+    for handler in log.app_handlers():
+        app.logger.addHandler(handler)
     app.logger.addHandler(log.out_handler)
     wsgi = logging.getLogger('werkzeug')
-    wsgi.addHandler(log.activity_handler)
+    wsgi.addHandler(log.app_handlers()[0])
     if log.sentry_handler:
         app.logger.addHandler(log.sentry_handler)
 
     @app.before_request
     def before_request_callback():
-        path = request.path
-        method = request.method
-        ip = request.environ.get('HTTP_X_REAL_IP',
-                                 request.remote_addr)
+        timing.start()
+
+    @app.after_request
+    def after_request_callback(response):
         try:
             user_name = current_user.name
-        except:
+        except Exception:
             user_name = 'no user'
-        app.logger.info('url: %s %s IP:%s User: %s' %
-                        (path, method, ip, user_name))
+        log_access(app.logger, response, user_name)
+        return response
+
+    @app.teardown_request
+    def teardown_request_callback(exc):
+        timing.finish()
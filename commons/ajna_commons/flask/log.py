@@ -6,17 +6,36 @@ comuns aos módulos do sistema AJNA.
 Todo módulo deve importar este arquivo e usar o objeto logger criado
 para gravar eventos importantes.
 
+Com LOG_QUEUE=1 (ou chamando start_queue_logging), a gravação em arquivo
+sai da thread da requisição: os handlers recebem somente os registros
+numa fila (sem formatar a mensagem) e uma thread (QueueListener) formata e
+grava em lotes de LOG_BATCH_SIZE linhas, ou a cada LOG_FLUSH_INTERVAL
+segundos, ou imediatamente em registros de nível ERROR ou maior.
+Aplicações Flask devem usar app_handlers() para obter os handlers.
+Em servidores que fazem fork após importar este módulo (ex: gunicorn
+--preload), cada processo filho recebe fila e QueueListener próprios
+(ver _restart_after_fork), já que a thread não é herdada no fork.
+
 """
+import atexit
+import copy
 import logging
 import os
+import queue
 import sys
+from logging.handlers import QueueHandler, QueueListener
 
 # from raven.handlers.logging import SentryHandler
 
 # from ajna_commons.flask.conf import SENTRY_DSN
 SENTRY_DSN = None
 FORMAT_STRING = '%(asctime)s %(name)-12s %(levelname)-8s %(message)s'
+LOG_QUEUE = os.environ.get('LOG_QUEUE', '0') == '1'
+LOG_BATCH_SIZE = int(os.environ.get('LOG_BATCH_SIZE', 100))
+LOG_FLUSH_INTERVAL = float(os.environ.get('LOG_FLUSH_INTERVAL', 1))
 sentry_handler = None
+queue_handler = None
+queue_listener = None
 
 
 class MyFilter(logging.Filter):
@@ -31,6 +50,96 @@ class MyFilter(logging.Filter):
         return log_record.levelno <= self.__level
 
 
+class BatchingFileHandler(logging.FileHandler):
+    """FileHandler que descarrega o arquivo a cada capacity registros.
+
+    Registros de nível flush_level ou maior são descarregados na hora.
+    Com capacity=1 equivale ao FileHandler.
+    """
+
+    def __init__(self, filename, capacity=1, flush_level=logging.ERROR):
+        """Configura tamanho do lote."""
+        super().__init__(filename)
+        self.capacity = capacity
+        self.flush_level = flush_level
+        self.pending = 0
+
+    def emit(self, record):
+        """Grava registro formatado, descarregando se lote completo."""
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+            self.pending += 1
+            if self.pending >= self.capacity or \
+                    record.levelno >= self.flush_level:
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        """Descarrega registros pendentes."""
+        super().flush()
+        self.pending = 0
+
+
+# Argumentos de log imutáveis, que podem ser formatados em outra thread
+LAZY_ARG_TYPES = (str, bytes, int, float, bool, type(None))
+
+
+class LazyLogArg():
+    """Base de argumentos de log formatados somente pelo QueueListener.
+
+    Subclasses não podem ser alteradas após o log (nem depender do
+    contexto da requisição ao serem formatadas).
+    Ex: flask_log.AccessRecord.
+    """
+
+
+def _lazy_arg(arg):
+    return isinstance(arg, LAZY_ARG_TYPES) or isinstance(arg, LazyLogArg)
+
+
+class LazyQueueHandler(QueueHandler):
+    """QueueHandler que adia a formatação da mensagem quando seguro.
+
+    O QueueHandler padrão monta msg % args em prepare, de forma que
+    argumentos mutáveis ou ligados ao contexto da requisição são
+    registrados com o valor do momento da chamada. Aqui o registro vai sem
+    formatar para a fila (e é formatado pelos handlers do QueueListener)
+    somente se todos os args forem escalares imutáveis ou LazyLogArg;
+    caso contrário a mensagem é montada em prepare, como no padrão.
+    """
+
+    def prepare(self, record):
+        """Repassa registro, montando msg % args se houver args mutáveis."""
+        args = record.args
+        lazy = isinstance(args, tuple) and all(map(_lazy_arg, args))
+        if args and not lazy:
+            record = copy.copy(record)
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+class BatchingQueueListener(QueueListener):
+    """QueueListener que descarrega os handlers quando a fila esvazia."""
+
+    def __init__(self, queue, *handlers, flush_interval=LOG_FLUSH_INTERVAL):
+        """Configura intervalo máximo entre descargas."""
+        super().__init__(queue, *handlers, respect_handler_level=True)
+        self.flush_interval = flush_interval
+
+    def dequeue(self, block):
+        """Aguarda registro, descarregando handlers a cada flush_interval."""
+        while True:
+            try:
+                return self.queue.get(block, timeout=self.flush_interval)
+            except queue.Empty:
+                for handler in self.handlers:
+                    handler.flush()
+
+
 logging.basicConfig(level=os.environ.get('LOGLEVEL', 'INFO'),
                     format=FORMAT_STRING)
 logger = logging.getLogger('ajna')
@@ -44,11 +153,11 @@ except AttributeError:
 
 log_file = os.path.join(root_path, 'error.log')
 print('Fazendo log de erros e alertas no arquivo ', log_file)
-error_handler = logging.FileHandler(log_file)
+error_handler = BatchingFileHandler(log_file)
 
 activity_file = os.path.join(root_path, 'access.log')
 print('Fazendo log de atividade no arquivo ', activity_file)
-activity_handler = logging.FileHandler(activity_file)
+activity_handler = BatchingFileHandler(activity_file)
 
 out_handler = logging.StreamHandler(sys.stdout)
 
@@ -80,6 +189,90 @@ else:
 # logger.addHandler(out_handler)
 
 activity_handler.addFilter(MyFilter(logging.INFO))
+
+
+def file_handlers():
+    """Handlers que gravam em arquivo."""
+    return [activity_handler, error_handler]
+
+
+def start_queue_logging(batch_size=LOG_BATCH_SIZE,
+                        flush_interval=LOG_FLUSH_INTERVAL):
+    """Passa a gravar os arquivos de log em thread própria, em lotes.
+
+    Retorna o handler (LazyQueueHandler) que substitui os de arquivo.
+    """
+    global queue_handler, queue_listener
+    if queue_listener is not None:
+        return queue_handler
+    log_queue = queue.Queue(-1)
+    queue_handler = LazyQueueHandler(log_queue)
+    handlers = file_handlers()
+    for handler in handlers:
+        if isinstance(handler, BatchingFileHandler):
+            handler.capacity = batch_size
+        logger.removeHandler(handler)
+    logger.addHandler(queue_handler)
+    queue_listener = BatchingQueueListener(log_queue, *handlers,
+                                           flush_interval=flush_interval)
+    queue_listener.start()
+    atexit.register(stop_queue_logging)
+    return queue_handler
+
+
+def stop_queue_logging():
+    """Grava registros pendentes, encerra a thread e volta ao modo direto."""
+    global queue_handler, queue_listener
+    if queue_listener is None:
+        return
+    queue_listener.stop()
+    logger.removeHandler(queue_handler)
+    for handler in file_handlers():
+        handler.flush()
+        handler.capacity = 1
+        logger.addHandler(handler)
+    queue_listener = None
+    queue_handler = None
+
+
+def _flush_before_fork():
+    """Descarrega arquivos para o filho não herdar (e repetir) o buffer."""
+    for handler in file_handlers():
+        handler.flush()
+
+
+def _restart_after_fork():
+    """No processo filho, recria fila e QueueListener do modo fila.
+
+    A thread do QueueListener não existe no filho; sem ela os registros
+    ficariam na fila. A fila herdada é trocada por uma nova, pois os
+    registros pendentes nela já são gravados pelo processo pai.
+    """
+    global queue_listener
+    if queue_listener is None:
+        return
+    log_queue = queue.Queue(-1)
+    queue_handler.queue = log_queue
+    queue_listener = BatchingQueueListener(
+        log_queue, *queue_listener.handlers,
+        flush_interval=queue_listener.flush_interval)
+    queue_listener.start()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(before=_flush_before_fork,
+                        after_in_child=_restart_after_fork)
+
+
+def app_handlers():
+    """Handlers a adicionar em outros loggers (ex: app.logger do Flask)."""
+    if queue_handler is not None:
+        return [queue_handler]
+    return [activity_handler, error_handler]
+
+
+if LOG_QUEUE:
+    start_queue_logging()
 logger.info('Configuração de log efetuada')
 
 if __name__ == '__main__':
@@ -12,6 +12,7 @@ from flask_login import (current_user, LoginManager, login_required,
                          login_user, logout_user)
 
 import ajna_commons.flask.custom_messages as custom_messages
+from ajna_commons.flask.auth import AuthBusyError
 from ajna_commons.flask.log import logger
 from ajna_commons.flask.user import User
 from ajna_commons.utils.sanitiza import mongo_sanitizar
@@ -31,7 +32,7 @@ def login_view(request):
         if registered_user is not None:
             flash('Usuário autenticado.')
             login_user(registered_user)
-            logger.info('Usuário %s autenticou' % current_user.name)
+            logger.info('Usuário %s autenticou', current_user.name)
             # g['username'] = current_user.name
             return redirect(url_for('index'))
         else:
@@ -69,7 +70,7 @@ def configure(app: Flask):
             if registered_user is not None:
                 flash('Usuário autenticado.')
                 login_user(registered_user)
-                logger.info('Usuário %s autenticou' % current_user.name)
+                logger.info('Usuário %s autenticou', current_user.name)
                 # g['username'] = current_user.name
                 return redirect(url_for('index'))
             else:
@@ -86,21 +87,21 @@ def configure(app: Flask):
     def login_certificado():
         """View para efetuar login via certificado digital."""
         s_dn = request.environ.get('HTTP_SSL_CLIENT_S_DN')
-        logger.info('URL %s - s_dn %s' % (request.url, s_dn))
+        logger.info('URL %s - s_dn %s', request.url, s_dn)
         if s_dn:
             name = None
             names = dict([x.split('=') for x in s_dn.split(',')])
-            logger.info('name %s' % names)
+            logger.info('name %s', names)
             if names:
                 name = names.get('CN').split(':')[-1]
-            logger.info('%s ofereceu certificado digital' % name)
+            logger.info('%s ofereceu certificado digital', name)
             if name:
                 name = name.strip().lower()
                 registered_user = User.get(name)
                 if registered_user is not None:
                     flash('Usuário autenticado.')
                     login_user(registered_user)
-                    logger.info('Usuário %s autenticou' % current_user.name)
+                    logger.info('Usuário %s autenticou', current_user.name)
                     return redirect(url_for('index'))
                 else:
                     flash('Usuário não encontrado %s' % name)
@@ -139,6 +140,13 @@ def configure(app: Flask):
                   'Efetue login novamente com usuário e senha válidos.'
         return redirect(get_next_url_login())
 
+    @app.errorhandler(AuthBusyError)
+    def auth_busy(err):
+        """Fila de verificação de senhas cheia: pedir nova tentativa."""
+        logger.warning('Login recusado: %s', err)
+        return 'Serviço de autenticação ocupado. Tente novamente.', 503, \
+            {'Retry-After': '5'}
+
     @login_manager.user_loader
     def load_user(userid):
         """Método padrão do flask-login. Repassa responsabilidade a User."""
@@ -0,0 +1,261 @@
+"""Amostragem de pilhas (profiling) de requisições em produção.
+
+Opcional: somente ativo em aplicações que chamarem configure(app).
+
+Uma thread amostra, a cada PROFILER_INTERVAL segundos, a pilha das
+threads que atendem requisições (sys._current_frames), sem instrumentar
+chamadas de função como o cProfile, de forma que o custo é baixo e não
+depende do tamanho do código executado. Enquanto nenhuma requisição em
+andamento precisa ser amostrada, a thread dorme até a primeira delas se
+tornar lenta (ou até uma requisição sorteada começar).
+
+São perfiladas desde o início uma fração PROFILER_RATE das requisições.
+As demais passam a ser amostradas quando ultrapassam PROFILER_SLOW
+segundos, de forma que requisições lentas são sempre capturadas (a partir
+do momento em que se tornaram lentas). Os últimos PROFILER_KEEP perfis
+ficam em memória e são servidos, no formato "collapsed stacks" (entrada
+do flamegraph.pl e speedscope), pelas views do blueprint, que exigem
+login (ver login.configure):
+
+    /_profiler/             lista de perfis em JSON
+    /_profiler/<id>         pilhas de um perfil
+    /_profiler/collapsed    pilhas de todos os perfis somadas
+
+"""
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+
+from flask import Blueprint, Flask, Response, abort, jsonify, request
+from flask_login import login_required
+
+PROFILER_RATE = float(os.environ.get('PROFILER_RATE', 0.01))
+PROFILER_SLOW = float(os.environ.get('PROFILER_SLOW', 1))
+PROFILER_KEEP = int(os.environ.get('PROFILER_KEEP', 50))
+PROFILER_INTERVAL = float(os.environ.get('PROFILER_INTERVAL', 0.005))
+
+
+def frame_label(frame) -> str:
+    """Nome do quadro da pilha no formato modulo:funcao."""
+    return '%s:%s' % (frame.f_globals.get('__name__', '?'),
+                      frame.f_code.co_name)
+
+
+def collapse(frame) -> str:
+    """Pilha a partir de frame, da raiz para o topo, separada por ';'."""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+def collapsed_text(stacks: Counter) -> str:
+    """Linhas 'pilha contagem' ordenadas pela contagem."""
+    return ''.join('%s %d\n' % (stack, count)
+                   for stack, count in stacks.most_common())
+
+
+class Profile():
+    """Amostras de pilha de uma requisição."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, label, sampled):
+        """Marca início da requisição."""
+        self.id = next(self._ids)
+        self.label = label
+        self.sampled = sampled
+        self.ts = datetime.utcnow()
+        self.start = time.perf_counter()
+        self.duration = None
+        self.stacks = Counter()
+
+    @property
+    def samples(self):
+        """Total de amostras."""
+        return sum(self.stacks.values())
+
+    def as_dict(self):
+        """Resumo do perfil (sem as pilhas)."""
+        return {'id': self.id,
+                'ts': self.ts.isoformat(),
+                'label': self.label,
+                'reason': 'sampled' if self.sampled else 'slow',
+                'duration_ms': round(self.duration * 1000, 2),
+                'samples': self.samples}
+
+
+class StackSampler():
+    """Amostrador de pilhas das threads com requisições em andamento.
+
+    Args:
+        rate: fração das requisições perfiladas desde o início
+        slow: segundos a partir dos quais a requisição é sempre perfilada
+        keep: número de perfis mantidos em memória
+        interval: segundos entre amostras
+
+    """
+
+    def __init__(self, rate=PROFILER_RATE, slow=PROFILER_SLOW,
+                 keep=PROFILER_KEEP, interval=PROFILER_INTERVAL):
+        """Configura amostrador. A thread é iniciada na primeira begin."""
+        self.rate = rate
+        self.slow = slow
+        self.interval = interval
+        self.profiles = deque(maxlen=keep)
+        self._active = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._stop.clear()
+                    self._thread = threading.Thread(
+                        target=self._run, name='ajna-profiler', daemon=True)
+                    self._thread.start()
+
+    def _next_wait(self):
+        """Segundos até a próxima amostra (None = até begin ou stop)."""
+        now = time.perf_counter()
+        with self._lock:
+            profiles = list(self._active.values())
+        if not profiles:
+            return None
+        if any(profile.sampled for profile in profiles):
+            return self.interval
+        deadline = min(profile.start for profile in profiles) + self.slow
+        return max(self.interval, deadline - now)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self._next_wait())
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            self.sample()
+
+    def sample(self):
+        """Registra uma amostra da pilha de cada requisição perfilada."""
+        now = time.perf_counter()
+        with self._lock:
+            profiles = [(ident, profile)
+                        for ident, profile in self._active.items()
+                        if profile.sampled or now - profile.start >= self.slow]
+        if not profiles:
+            return
+        frames = sys._current_frames()
+        with self._lock:
+            for ident, profile in profiles:
+                frame = frames.get(ident)
+                if frame is not None and self._active.get(ident) is profile:
+                    profile.stacks[collapse(frame)] += 1
+
+    def begin(self, label=''):
+        """Inicia acompanhamento da requisição da thread atual."""
+        self._ensure_thread()
+        profile = Profile(label, random.random() < self.rate)
+        with self._lock:
+            first = not self._active
+            self._active[threading.get_ident()] = profile
+        # Recalcula a espera da thread de amostragem se ela pode mudar (as
+        # demais requisições em andamento tornam-se lentas antes desta)
+        if profile.sampled or first:
+            self._wake.set()
+        return profile
+
+    def end(self):
+        """Encerra requisição da thread atual, guardando perfil se houver.
+
+        Guarda o perfil se a requisição foi sorteada ou se foi lenta, e se
+        houve ao menos uma amostra.
+        """
+        with self._lock:
+            profile = self._active.pop(threading.get_ident(), None)
+        if profile is None:
+            return None
+        profile.duration = time.perf_counter() - profile.start
+        if (profile.sampled or profile.duration >= self.slow) and \
+                profile.stacks:
+            self.profiles.append(profile)
+            return profile
+        return None
+
+    def get(self, profile_id):
+        """Perfil guardado pelo id, ou None."""
+        for profile in list(self.profiles):
+            if profile.id == profile_id:
+                return profile
+        return None
+
+    def collapsed(self):
+        """Pilhas de todos os perfis guardados somadas."""
+        stacks = Counter()
+        for profile in list(self.profiles):
+            stacks.update(profile.stacks)
+        return collapsed_text(stacks)
+
+    def stop(self):
+        """Encerra a thread de amostragem."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def configure(app: Flask, sampler: StackSampler = None):
+    """Ativa o profiler e insere suas views na app.
+
+    Para utilizar, importar modulo profiler e chamar configure(app)
+    em uma aplicação Flask (após login.configure, para as views exigirem
+    login). Retorna o StackSampler utilizado.
+
+    """
+    if sampler is None:
+        sampler = StackSampler()
+    profiler = Blueprint('profiler', __name__, url_prefix='/_profiler')
+
+    @app.before_request
+    def profiler_begin():
+        if request.blueprint != 'profiler':
+            sampler.begin('%s %s' % (request.method, request.path))
+
+    @app.teardown_request
+    def profiler_end(exc):
+        sampler.end()
+
+    @profiler.route('/')
+    @login_required
+    def profiles():
+        """Lista os perfis guardados, do mais recente ao mais antigo."""
+        return jsonify([profile.as_dict()
+                        for profile in reversed(sampler.profiles)])
+
+    @profiler.route('/collapsed')
+    @login_required
+    def collapsed():
+        """Pilhas de todos os perfis guardados somadas."""
+        return Response(sampler.collapsed(), mimetype='text/plain')
+
+    @profiler.route('/<int:profile_id>')
+    @login_required
+    def profile_stacks(profile_id):
+        """Pilhas de um perfil."""
+        profile = sampler.get(profile_id)
+        if profile is None:
+            abort(404)
+        return Response(collapsed_text(profile.stacks),
+                        mimetype='text/plain')
+
+    app.register_blueprint(profiler)
+    app.extensions['ajna_profiler'] = sampler
+    return sampler
@@ -0,0 +1,253 @@
+"""Armazenamento de tokens JWT revogados (logout) para api_login.
+
+MemoryRevocationStore: somente no processo, cada entrada expira junto com
+o token (não há despejo de entradas ainda válidas).
+
+RedisRevocationStore: compartilhado entre processos/workers, com chaves
+que expiram (SET EX) junto com o token. Opcionalmente mantém à frente um
+filtro de Bloom local: a verificação comum (token não revogado) é
+respondida sem acesso à rede. O filtro é atualizado por uma thread de
+segundo plano (nunca na thread da requisição): a cada refresh segundos
+acrescenta somente as revogações recentes (sorted set por horário da
+revogação) e a cada rebuild segundos é reconstruído com os tokens ainda
+não expirados. Revogações feitas em outros processos são vistas em até
+refresh segundos.
+
+Falhas de comunicação com o Redis não levantam exceção. Tokens revogados
+pelo próprio processo continuam recusados; para os demais, o padrão é
+aceitar o token (fail open: o Redis fora do ar não derruba a API) e, com
+fail_closed=True, recusá-lo (nenhum token revogado é aceito, mas nenhuma
+requisição autenticada é atendida enquanto o Redis estiver fora).
+
+Todos implementam add(jti, expires) e __contains__(jti), sendo expires o
+timestamp de expiração do token (campo 'exp').
+
+"""
+import hashlib
+import heapq
+import logging
+import math
+import threading
+import time
+
+# Logger de ajna_commons.flask.log, sem os efeitos da importação
+logger = logging.getLogger('ajna')
+
+try:
+    from redis.exceptions import RedisError
+except ImportError:
+    RedisError = OSError
+
+DEFAULT_TTL = 24 * 3600
+
+
+def _ttl(expires):
+    """Segundos até expires (ou DEFAULT_TTL se token não expira)."""
+    if expires is None:
+        return DEFAULT_TTL
+    return max(1, int(math.ceil(expires - time.time())))
+
+
+class MemoryRevocationStore():
+    """Tokens revogados em memória, expirando junto com o token."""
+
+    def __init__(self):
+        """Cria dicionário jti: expiração e heap para limpeza."""
+        self._revoked = {}
+        self._heap = []
+        self._lock = threading.Lock()
+
+    def _purge(self, now):
+        while self._heap and self._heap[0][0] <= now:
+            expires, jti = heapq.heappop(self._heap)
+            if self._revoked.get(jti) == expires:
+                del self._revoked[jti]
+
+    def add(self, jti, expires=None):
+        """Revoga jti até expires."""
+        now = time.time()
+        expires = now + _ttl(expires)
+        with self._lock:
+            self._purge(now)
+            self._revoked[jti] = expires
+            heapq.heappush(self._heap, (expires, jti))
+
+    def __contains__(self, jti):
+        expires = self._revoked.get(jti)
+        return expires is not None and expires > time.time()
+
+    def __len__(self):
+        with self._lock:
+            self._purge(time.time())
+            return len(self._revoked)
+
+
+class BloomFilter():
+    """Filtro de Bloom simples (falsos positivos, nunca falsos negativos).
+
+    Args:
+        capacity: número esperado de elementos
+        error_rate: taxa desejada de falsos positivos
+
+    """
+
+    def __init__(self, capacity=100000, error_rate=0.001):
+        """Dimensiona bits e número de funções de hash."""
+        bits = -capacity * math.log(error_rate) / math.log(2) ** 2
+        self.size = max(8, int(bits))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.sha256(item.encode('utf-8')).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:16], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item):
+        """Inclui item."""
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7))
+                   for pos in self._positions(item))
+
+
+class RedisRevocationStore():
+    """Tokens revogados no Redis, com filtro de Bloom local opcional.
+
+    Args:
+        redisdb: cliente redis.StrictRedis
+        prefix: prefixo das chaves
+        bloom: se True, consulta filtro de Bloom local antes do Redis
+        refresh: segundos entre atualizações incrementais do filtro
+        capacity: capacidade do filtro de Bloom
+        rebuild: segundos entre reconstruções completas do filtro
+        fail_closed: se True, considera revogado qualquer token quando o
+            Redis não responde
+
+    """
+
+    def __init__(self, redisdb, prefix='ajna:jwt:revoked:', bloom=False,
+                 refresh=5, capacity=100000, rebuild=600, fail_closed=False):
+        """Configura conexão e filtro."""
+        self.redisdb = redisdb
+        self.prefix = prefix
+        self.zset = prefix + 'index'  # score: expiração do token
+        self.recent = prefix + 'recent'  # score: horário da revogação
+        self.bloom = bloom
+        self.refresh = refresh
+        self.capacity = capacity
+        self.rebuild = rebuild
+        # Revogações recentes mantidas para as atualizações incrementais
+        self.window = max(60, 10 * refresh)
+        self.fail_closed = fail_closed
+        self.redis_errors = 0
+        self._local = MemoryRevocationStore()
+        self._filter = None
+        self._refreshed = 0
+        self._rebuilt = 0
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def add(self, jti, expires=None):
+        """Revoga jti no Redis até a expiração do token."""
+        self._local.add(jti, expires)
+        if self._filter is not None:
+            self._filter.add(jti)
+        now = time.time()
+        ttl = _ttl(expires)
+        try:
+            pipe = self.redisdb.pipeline()
+            pipe.set(self.prefix + jti, 1, ex=ttl)
+            if self.bloom:
+                pipe.zadd(self.zset, {jti: now + ttl})
+                pipe.zadd(self.recent, {jti: now})
+            pipe.execute()
+        except RedisError as err:
+            self.redis_errors += 1
+            logger.error('Revogação de token não gravada no Redis '
+                         '(vale somente neste processo): %s', err)
+
+    @staticmethod
+    def _decode(jtis):
+        return [jti.decode('utf-8') if isinstance(jti, bytes) else jti
+                for jti in jtis]
+
+    def rebuild_filter(self):
+        """Reconstrói filtro de Bloom com os tokens ainda não expirados."""
+        now = time.time()
+        pipe = self.redisdb.pipeline()
+        pipe.zremrangebyscore(self.zset, '-inf', now)
+        pipe.zremrangebyscore(self.recent, '-inf', now - self.window)
+        pipe.zrangebyscore(self.zset, now, '+inf')
+        _, _, jtis = pipe.execute()
+        jtis = self._decode(jtis)
+        new_filter = BloomFilter(max(self.capacity, len(jtis) * 2))
+        for jti in jtis:
+            new_filter.add(jti)
+        self._filter = new_filter
+        self._refreshed = self._rebuilt = now
+
+    def refresh_filter(self):
+        """Acrescenta ao filtro as revogações desde a última atualização.
+
+        Reconstrói o filtro se ainda não existir, se passou de rebuild
+        segundos ou se a última atualização saiu da janela de revogações
+        recentes.
+        """
+        now = time.time()
+        if self._filter is None or now - self._rebuilt > self.rebuild or \
+                now - self._refreshed > self.window - self.refresh:
+            self.rebuild_filter()
+            return
+        # Margem de refresh segundos para diferenças de relógio
+        jtis = self.redisdb.zrangebyscore(
+            self.recent, self._refreshed - self.refresh, '+inf')
+        for jti in self._decode(jtis):
+            self._filter.add(jti)
+        self._refreshed = now
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh_filter()
+            except RedisError as err:
+                self.redis_errors += 1
+                logger.warning('Filtro de tokens revogados não '
+                               'atualizado: %s', err)
+            if self._stop.wait(self.refresh):
+                break
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name='ajna-revocation',
+                        daemon=True)
+                    self._thread.start()
+
+    def stop(self):
+        """Encerra a thread de atualização do filtro."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __contains__(self, jti):
+        if jti in self._local:
+            return True
+        if self.bloom:
+            self._ensure_thread()
+            # Enquanto o filtro não é carregado, consulta direto o Redis
+            if self._filter is not None and jti not in self._filter:
+                return False
+        try:
+            return bool(self.redisdb.exists(self.prefix + jti))
+        except RedisError as err:
+            self.redis_errors += 1
+            logger.warning('Redis indisponível ao verificar token '
+                           '(fail_closed=%s): %s', self.fail_closed, err)
+            return self.fail_closed
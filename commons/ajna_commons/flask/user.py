@@ -3,16 +3,38 @@
 Classes para acessar os usuários das aplicações
 DBUser.dbsession deve receber a conexão com o BD.
 
+Os registros de usuários consultados ficam em user_cache por USER_CACHE_TTL
+segundos, evitando uma consulta ao BD a cada requisição autenticada.
+O cache guarda somente campos públicos (USER_CACHE_FIELDS): o hash da
+senha é lido do BD a cada verificação de senha, de forma que não circula
+pelo Redis e uma troca de senha vale imediatamente em todos os processos.
+Para compartilhar o cache entre processos, atribuir user_cache.redisdb
+(ex: ajna_commons.flask.conf.redisdb). As cópias locais expiram em
+USER_CACHE_LOCAL_TTL segundos, sem consulta ao Redis nos acertos locais.
+
 """
+import os
 from enum import Enum
 
 import pymongo
 from flask_login import UserMixin
-from werkzeug.security import check_password_hash, generate_password_hash
+from werkzeug.security import generate_password_hash
 
+from ajna_commons.flask.auth import password_verifier
 from ajna_commons.flask.log import logger
+from ajna_commons.utils import timing
+from ajna_commons.utils.cache import LRUCache, TwoLevelCache
 from ajna_commons.utils.sanitiza import mongo_sanitizar
 
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 300))
+USER_CACHE_LOCAL_TTL = int(os.environ.get('USER_CACHE_LOCAL_TTL', 30))
+USER_CACHE_ITEMS = int(os.environ.get('USER_CACHE_ITEMS', 10000))
+USER_CACHE_FIELDS = ('nome',)
+
+user_cache = TwoLevelCache(LRUCache(max_items=USER_CACHE_ITEMS,
+                                    ttl=USER_CACHE_LOCAL_TTL),
+                           prefix='ajna:user:', ttl=USER_CACHE_TTL)
+
 
 class DBType(Enum):
     mongo = 1
@@ -93,6 +115,9 @@ class DBUser():
 
     A classe DBUser é utilizada pela classe User, padrão do flask-login
 
+    Os registros lidos do BD são guardados em user_cache, sem a senha;
+    add e change_password invalidam a entrada do usuário (invalidate).
+
     """
 
     dbsession = None
@@ -118,6 +143,7 @@ class DBUser():
         encripted = cls.encript(password)
         dbcomunicator = UserDBComunication(cls.dbsession, cls.alchemy_class)
         dbcomunicator.insert(username, encripted, password)
+        cls.invalidate(username)
         return DBUser.get(username, password)
 
     @classmethod
@@ -129,20 +155,87 @@ class DBUser():
         encripted = cls.encript(password)
         dbcomunicator = UserDBComunication(cls.dbsession, cls.alchemy_class)
         dbcomunicator.insert(username, encripted, password)
+        cls.invalidate(username)
         return True
 
+    @classmethod
+    def cache_key(cls, username):
+        """Chave de user_cache: base de usuários + username sanitizado."""
+        return (getattr(cls.dbsession, 'name', None),
+                getattr(cls.alchemy_class, '__name__', None),
+                username)
+
+    @classmethod
+    def invalidate(cls, username):
+        """Remove usuário de user_cache (nos demais processos, se Redis)."""
+        user_cache.pop(cls.cache_key(username))
+
+    @classmethod
+    def load_record(cls, username):
+        """Registro completo do usuário (com 'password') lido do BD.
+
+        Atualiza a entrada de user_cache (somente campos públicos).
+        """
+        dbcomunicator = UserDBComunication(cls.dbsession, cls.alchemy_class)
+        with timing.db_timer():
+            user = dbcomunicator.get(username)
+        if user is None:
+            return None
+        user_cache.set(cls.cache_key(username),
+                       {campo: user[campo] for campo in USER_CACHE_FIELDS
+                        if campo in user})
+        return user
+
+    @classmethod
+    def get_record(cls, username):
+        """Campos públicos do usuário (sem 'password'), via user_cache."""
+        user = user_cache.get(cls.cache_key(username))
+        timing.add_cache(user is not None)
+        if user is None:
+            user = cls.load_record(username)
+            if user is None:
+                return None
+            user = {campo: user[campo] for campo in USER_CACHE_FIELDS
+                    if campo in user}
+        return user
+
+    @classmethod
+    def cache_info(cls):
+        """Acertos e faltas de user_cache."""
+        return user_cache.info()
+
     @classmethod
     def encript(cls, password):
         """Recebe senha plana, retorna versão criptografada."""
         if password is None:
             return ''
+        if password_verifier.method:
+            return generate_password_hash(password,
+                                          method=password_verifier.method)
         return generate_password_hash(password)
 
     def check(self, encripted):
-        """Verifica senha informada contra a versão criptograda do BD."""
+        """Verifica senha informada contra a versão criptograda do BD.
+
+        A verificação é feita em password_verifier (ver flask.auth), que
+        pode levantar AuthBusyError.
+        """
         if self._password is None or encripted is None:
             return False
-        return check_password_hash(encripted, self._password)
+        return password_verifier.check(encripted, self._password)
+
+    @classmethod
+    def rehash(cls, username, password):
+        """Grava novo hash da senha com o método configurado (só MongoDB).
+
+        Em SQLAlchemy o hash é gerado pela própria classe do modelo.
+        """
+        dbcomunicator = UserDBComunication(cls.dbsession, cls.alchemy_class)
+        if dbcomunicator.type != DBType.mongo:
+            return
+        dbcomunicator.update(username, cls.encript(password), password)
+        cls.invalidate(username)
+        logger.info('Hash de senha do usuário %s atualizado', username)
 
     @classmethod
     def get(cls, username, password=None):
@@ -152,20 +245,25 @@ class DBUser():
         Usuario não encontrado OU senha inválida.
 
         """
-        logger.debug('Getting user. dbsession= %s' % cls.dbsession)
+        logger.debug('Getting user. dbsession= %s', cls.dbsession)
         if cls.dbsession:
             username, password = cls.sanitize(username, password)
             # logger.debug('DBSEssion %s' % cls.dbsession)
             dbuser = DBUser(username, password)
-            dbcomunicator = UserDBComunication(cls.dbsession, cls.alchemy_class)
-            user = dbcomunicator.get(username)
+            if password is None:
+                user = cls.get_record(username)
+            else:
+                # Hash da senha sempre do BD (não fica em user_cache)
+                user = cls.load_record(username)
             if user is None:
                 return None
             if password is not None:
                 encripted = user['password']
-                logger.debug('encripted %s' % encripted)
+                logger.debug('encripted %s', encripted)
                 if not dbuser.check(encripted):
                     return None
+                if password_verifier.needs_rehash(encripted):
+                    cls.rehash(username, password)
             return DBUser(username, password)
         else:
             if username:
@@ -21,6 +21,10 @@ import bson
 from bson.codec_options import CodecOptions
 
 from ajna_commons.flask.log import logger
+from ajna_commons.utils.histogram import compute_histogram
+from ajna_commons.utils.images import save_histogram
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
 
 
 class BsonImage():
@@ -109,9 +113,38 @@ class BsonImage():
                           **data['metadata'])
         return result
 
-    def tomongo(self, fs):
+    @property
+    def is_image(self):
+        """Testa pelo contentType dos metadados ou extensão do arquivo."""
+        content_type = (self._metadata or {}).get('contentType') or ''
+        if content_type.startswith('image/'):
+            return True
+        return os.path.splitext(self._filename or '')[1].lower() \
+            in IMAGE_EXTENSIONS
+
+    def histogram(self):
+        """Histograma do conteúdo, se for imagem (senão None).
+
+        O histograma é gravado na ingestão para que os realces (equalize,
+        autocontrast) não precisem percorrer a imagem inteira a cada uso.
+        Ver :mod:`ajna_commons.utils.histogram`.
+        """
+        if not self.is_image:
+            return None
+        try:
+            return compute_histogram(self._content)
+        except OSError as err:
+            logger.info('%s: histograma não calculado (%s)',
+                        self._filename, err)
+            return None
+
+    def tomongo(self, fs, db=None):
         """Salva instância em GridFS MongoDB.
 
+        Se for imagem e db (o banco do fs) for passado, grava também o
+        histograma, ver utils.images.save_histogram. Sem db, o histograma
+        pode ser gravado depois por utils.images.precompute_histogram.
+
         Checa se arquivo existe antes de gravar.
         Se existir, retorna _id correspondente ao MD5 do conteúdo
 
@@ -140,8 +173,13 @@ class BsonImage():
                 # File exists, abort!
                 return grid_out._id
         # Insert File
-        return fs.put(self._content, filename=self._filename,
-                      metadata=self._metadata)
+        file_id = fs.put(self._content, filename=self._filename,
+                         metadata=self._metadata)
+        if db is not None:
+            histogram = self.histogram()
+            if histogram:
+                save_histogram(db, file_id, histogram)
+        return file_id
 
     @classmethod
     def frommongo(cls, file_id, fs):
@@ -226,11 +264,11 @@ class BsonImageList():
             bsonimagelist.addBsonImage(bsonimage)
         return bsonimagelist
 
-    def tomongo(self, fs):
+    def tomongo(self, fs, db=None):
         """Grava lista de BSON no BD."""
         files_ids = []
         for bsonimage in self._bsonimagelist:
-            file_id = bsonimage.tomongo(fs)
+            file_id = bsonimage.tomongo(fs, db)
             files_ids.append(file_id)
         return files_ids
 
@@ -0,0 +1,59 @@
+"""Script para gravar histogramas nas imagens já existentes no BD.
+
+Imagens novas já recebem o histograma na ingestão (BsonImage.tomongo).
+
+Uso:
+   python ajna_commons/scripts/precompute_histograms.py --limit=10000
+
+"""
+import time
+
+import click
+from pymongo import MongoClient
+
+from ajna_commons.flask.conf import DATABASE, MONGODB_URI
+from ajna_commons.utils.images import (HISTOGRAM_COLLECTION,
+                                       precompute_histogram)
+
+BATCH_SIZE = 1000
+
+
+def ids_sem_histograma(db):
+    """Gerador dos _id de imagens sem histograma em HISTOGRAM_COLLECTION."""
+    cursor = db['fs.files'].find({'metadata.contentType': 'image/jpeg'},
+                                 {'_id': 1}).batch_size(BATCH_SIZE)
+    lote = []
+    for row in cursor:
+        lote.append(row['_id'])
+        if len(lote) >= BATCH_SIZE:
+            yield from _sem_histograma(db, lote)
+            lote = []
+    yield from _sem_histograma(db, lote)
+
+
+def _sem_histograma(db, ids):
+    if not ids:
+        return []
+    existentes = set(row['_id'] for row in db[HISTOGRAM_COLLECTION].find(
+        {'_id': {'$in': ids}}, {'_id': 1}))
+    return [_id for _id in ids if _id not in existentes]
+
+
+@click.command()
+@click.option('--limit', default=1000, help='Número máximo de imagens')
+def precompute(limit):
+    """Calcula histograma das imagens que ainda não o possuem."""
+    db = MongoClient(host=MONGODB_URI)[DATABASE]
+    s0 = time.time()
+    total = 0
+    for _id in ids_sem_histograma(db):
+        if total >= limit:
+            break
+        if precompute_histogram(db, _id):
+            total += 1
+    print('%d histogramas gravados em %.1f segundos' %
+          (total, time.time() - s0))
+
+
+if __name__ == '__main__':
+    precompute()
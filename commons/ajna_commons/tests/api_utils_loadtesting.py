@@ -0,0 +1,119 @@
+"""Medição de desempenho de api_utils (serialização e custo por pedido).
+
+Compara dump_rowproxy original (uma linha por vez, com startswith e
+exclude a cada linha) com dump_rowproxy e dump_rows atuais, em tabela
+SQLite em memória. Compara também o custo por pedido de select_one_from_class
+original (select montado e compilado a cada pedido, em transação) com o
+atual (statement e compilação em cache, sem transação explícita).
+
+Uso:
+   python ajna_commons/tests/api_utils_loadtesting.py [número de linhas]
+
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+from flask import Flask, current_app, jsonify
+from sqlalchemy import (Column, DateTime, Integer, MetaData, Numeric, String,
+                        Table, create_engine, select)
+
+from ajna_commons.utils import api_utils
+
+LINHAS = 100000
+PEDIDOS = 10000
+
+metadata = MetaData()
+tabela = Table('conhecimento', metadata,
+               Column('id', Integer, primary_key=True),
+               Column('numeroCEmercante', String(15)),
+               Column('tipoBLConhecimento', String(2)),
+               Column('descricao', String(200)),
+               Column('valorFrete', Numeric(10, 2)),
+               Column('create_date', DateTime),
+               Column('last_modified', DateTime))
+
+
+def exclude_from_dict_legacy(dict, exclude: list = None):
+    if exclude:
+        for key in exclude:
+            if dict.get(key):
+                dict.pop(key)
+
+
+def dump_rowproxy_legacy(rowproxy, exclude: list = None):
+    dump = dict([(k, v) for k, v in rowproxy.items()
+                 if not k.startswith('_')])
+    exclude_from_dict_legacy(dump, exclude)
+    return dump
+
+
+def select_one_from_class_legacy(table, campo, valor):
+    engine = current_app.config['sql']
+    with engine.begin() as conn:
+        s = select([table]).where(
+            campo == valor)
+        result = conn.execute(s).fetchone()
+    return jsonify(dump_rowproxy_legacy(result)), 200
+
+
+def mede(funcao, *args):
+    s0 = time.time()
+    funcao(*args)
+    return time.time() - s0
+
+
+if __name__ == '__main__':
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else LINHAS
+    print(os.uname())
+    print(time.strftime('%Y-%m-%d %H:%M'))
+    engine = create_engine('sqlite://')
+    metadata.create_all(engine)
+    agora = datetime(2019, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(tabela.insert(), [
+            {'id': i, 'numeroCEmercante': '%015d' % i,
+             'tipoBLConhecimento': '12',
+             'descricao': 'CARGA CONSOLIDADA %d' % i,
+             'valorFrete': i / 100,
+             'create_date': agora,
+             'last_modified': agora + timedelta(seconds=i)}
+            for i in range(total)])
+    with engine.connect() as conn:
+        rows = conn.execute(tabela.select()).fetchall()
+    print('%d linhas' % len(rows))
+    exclude = ['create_date']
+    legado = mede(lambda: [dump_rowproxy_legacy(row, exclude)
+                           for row in rows])
+    por_linha = mede(lambda: [api_utils.dump_rowproxy(row, exclude)
+                              for row in rows])
+    dicts = mede(lambda: list(api_utils.dump_rows(rows, exclude)))
+    tuplas = mede(lambda: list(api_utils.dump_rows(rows, exclude,
+                                                   as_tuple=True)))
+    print('original: %.2fs' % legado)
+    for nome, tempo in (('dump_rowproxy', por_linha),
+                        ('dump_rows', dicts),
+                        ('dump_rows tuplas', tuplas)):
+        print('%-17s %.2fs  (%.1fx)' % (nome, tempo, legado / tempo))
+    app = Flask(__name__)
+    resultados = list(api_utils.dump_rows(rows, exclude))
+    with app.app_context():
+        print('json_dumps flask.json: %.2fs' %
+              mede(api_utils.json_dumps, resultados))
+        if api_utils.orjson is not None:
+            app.config['API_ORJSON'] = True
+            print('json_dumps orjson:     %.2fs' %
+                  mede(api_utils.json_dumps, resultados))
+            app.config['API_ORJSON'] = False
+    app.config['sql'] = engine
+    ids = [i % total for i in range(PEDIDOS)]
+    with app.app_context():
+        legado = mede(lambda: [select_one_from_class_legacy(
+            tabela, tabela.c.id, i) for i in ids])
+        atual = mede(lambda: [api_utils.select_one_from_class(
+            tabela, tabela.c.id, i) for i in ids])
+    print('select_one_from_class original: %.0f us/pedido  atual: %.0f '
+          'us/pedido  (%.1fx)' % (legado / PEDIDOS * 1e6,
+                                  atual / PEDIDOS * 1e6, legado / atual))
+    print('compiled_cache', api_utils.compiled_cache.info())
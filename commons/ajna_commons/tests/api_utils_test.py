@@ -0,0 +1,312 @@
+import base64
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from flask import Flask, request
+from sqlalchemy import (Column, DateTime, Integer, MetaData, String, Table,
+                        create_engine)
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import scoped_session, sessionmaker, synonym
+
+from ajna_commons.utils import api_utils
+
+metadata = MetaData()
+tabela = Table('tabela', metadata,
+               Column('id', Integer, primary_key=True),
+               Column('nome', String(20)),
+               Column('last_modified', DateTime))
+
+INICIO = datetime(2019, 1, 1)
+
+Base = declarative_base()
+
+
+class Conhecimento(Base):
+    __tablename__ = 'conhecimento'
+    id = Column(Integer, primary_key=True)
+    numero = Column(String(15), index=True)
+    descricao = Column(String(50))
+    last_modified = Column(DateTime)
+
+    def dump(self, explode=True):
+        return api_utils.dump_model(self)
+
+
+class Manifesto(Base):
+    """Atributos Python com nome diferente do da coluna."""
+    __tablename__ = 'manifesto'
+    id = Column(Integer, primary_key=True)
+    numero_manifesto = Column('numero', String(15), index=True)
+    tipo_manifesto = Column('tipo', String(2))
+    numero = synonym('numero_manifesto')
+
+
+class TestApiUtils(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.engine = create_engine(
+            'sqlite:///' + os.path.join(self.tmpdir.name, 'teste.db'))
+        metadata.create_all(self.engine)
+        with self.engine.begin() as conn:
+            conn.execute(tabela.insert(), [
+                {'id': i, 'nome': 'nome%d' % i,
+                 'last_modified': INICIO + timedelta(minutes=i)}
+                for i in range(1, 26)])
+        self.app = Flask(__name__)
+        self.app.config['sql'] = self.engine
+
+        @self.app.route('/datamodificacao/<data>')
+        def datamodificacao(data):
+            return api_utils.get_datamodificacao_gt(tabela, data, stream=True)
+
+        @self.app.route('/pagina/<data>')
+        def pagina(data):
+            _, page_size, cursor = api_utils.page_args(request.args)
+            return api_utils.get_datamodificacao_gt(
+                tabela, data, page_size=page_size,
+                cursor=request.args.get('cursor'))
+
+        @self.app.route('/filtro')
+        def filtro():
+            return api_utils.get_filtro(tabela, request.args)
+
+        self.client = self.app.test_client()
+        self.chunk_rows = api_utils.STREAM_CHUNK_ROWS
+        api_utils.STREAM_CHUNK_ROWS = 10
+
+    def tearDown(self):
+        api_utils.STREAM_CHUNK_ROWS = self.chunk_rows
+        self.engine.dispose()
+        self.tmpdir.cleanup()
+
+    def test_dump_rows(self):
+        with self.engine.connect() as conn:
+            rows = conn.execute(tabela.select().order_by(tabela.c.id)
+                                ).fetchall()
+        esperado = [dict(row) for row in rows]
+        assert [api_utils.dump_rowproxy(row) for row in rows] == esperado
+        assert list(api_utils.dump_rows(rows)) == esperado
+        sem_nome = list(api_utils.dump_rows(rows, exclude=['nome']))
+        primeiro = INICIO + timedelta(minutes=1)
+        assert sem_nome[0] == {'id': 1, 'last_modified': primeiro}
+        tuplas = list(api_utils.dump_rows(rows, exclude=['nome'],
+                                          as_tuple=True))
+        assert api_utils.dump_columns(rows[0].keys(), ['nome']) == \
+            ['id', 'last_modified']
+        assert tuplas[0] == (1, INICIO + timedelta(minutes=1))
+        todas = ['id', 'nome', 'last_modified']
+        assert list(api_utils.dump_rows(rows[:2], exclude=todas)) == \
+            [{}, {}] == [api_utils.dump_rowproxy(row, todas)
+                         for row in rows[:2]]
+        assert list(api_utils.dump_rows(rows[:2], exclude=todas,
+                                        as_tuple=True)) == [(), ()]
+
+    def test_dump_model(self):
+        class Modelo():
+            def __init__(self):
+                self._sa_instance_state = None
+                self.id = 1
+                self.nome = ''
+        assert api_utils.dump_model(Modelo()) == {'id': 1, 'nome': ''}
+        assert api_utils.dump_model(Modelo(), exclude=['nome']) == {'id': 1}
+
+    def test_stream_json(self):
+        r = self.client.get('/datamodificacao/2019-01-01 00:05')
+        assert r.status_code == 200
+        assert r.mimetype == 'application/json'
+        resultado = json.loads(r.data)
+        assert [linha['id'] for linha in resultado] == list(range(5, 26))
+
+    def test_stream_ndjson(self):
+        r = self.client.get('/datamodificacao/2019-01-01 00:05',
+                            headers={'Accept': api_utils.NDJSON_MIMETYPE})
+        assert r.mimetype == api_utils.NDJSON_MIMETYPE
+        linhas = r.data.decode('utf-8').splitlines()
+        assert len(linhas) == 21
+        assert json.loads(linhas[0])['nome'] == 'nome5'
+
+    def test_stream_fecha_sem_percorrer(self):
+        fechamentos = []
+        with self.app.test_request_context('/'):
+            response, _ = api_utils.stream_response(
+                {'id': 1}, iter([]), api_utils._identity, False,
+                close=lambda: fechamentos.append(1))
+        # Cliente desconectou antes do primeiro lote
+        response.close()
+        assert fechamentos == [1]
+        with self.app.test_request_context('/'):
+            response, _ = api_utils.stream_response(
+                {'id': 1}, iter([]), api_utils._identity, False,
+                close=lambda: fechamentos.append(2))
+            assert b''.join(response.iter_encoded()) == b'[{"id": 1}]'
+        response.close()
+        assert fechamentos == [1, 2]
+
+    def test_stream_vazio(self):
+        r = self.client.get('/datamodificacao/2020-01-01')
+        assert r.status_code == 404
+
+    def paginas(self, url):
+        ids = []
+        cursor = None
+        while True:
+            query = '&cursor=' + cursor if cursor else ''
+            r = self.client.get(url + query)
+            if r.status_code == 404:
+                break
+            ids.append([linha['id'] for linha in json.loads(r.data)])
+            cursor = r.headers.get(api_utils.NEXT_CURSOR_HEADER)
+            if not cursor:
+                break
+        return ids
+
+    def test_keyset_pagination(self):
+        # Duas linhas com mesmo last_modified: desempate por id
+        with self.engine.begin() as conn:
+            conn.execute(tabela.update().where(tabela.c.id == 11).values(
+                last_modified=INICIO + timedelta(minutes=10)))
+        paginas = self.paginas('/pagina/2019-01-01?page_size=10')
+        assert [len(pagina) for pagina in paginas] == [10, 10, 5]
+        assert sum(paginas, []) == list(range(1, 26))
+
+    def test_keyset_pagination_null(self):
+        # Linhas sem last_modified vêm primeiro, sem truncar as páginas
+        with self.engine.begin() as conn:
+            conn.execute(tabela.update().where(tabela.c.id > 12).values(
+                last_modified=None))
+        paginas = self.paginas('/filtro?page_size=5')
+        assert sum(paginas, []) == list(range(13, 26)) + list(range(1, 13))
+
+    def test_pagination_filtro(self):
+        paginas = self.paginas('/filtro?nome=nome7&page_size=10')
+        assert paginas == [[7]]
+        r = self.client.get('/filtro?nome=nome7')
+        assert api_utils.NEXT_CURSOR_HEADER not in r.headers
+
+    def test_cursor_invalido(self):
+        r = self.client.get('/filtro?cursor=xyz')
+        assert r.status_code == 400
+        sem_id = base64.urlsafe_b64encode(b'{"last_modified": null}')
+        for cursor in (sem_id.decode(), api_utils.encode_cursor(
+                type('Row', (), {'id': [1], 'last_modified': None}))):
+            r = self.client.get('/filtro?page_size=5&cursor=' + cursor)
+            assert r.status_code == 400
+            assert 'Cursor inválido' in json.loads(r.data)['msg']
+
+    def test_result_cache(self):
+        self.app.config['API_RESULT_CACHE'] = True
+        ttl = api_utils.RESULT_VERSION_TTL
+        api_utils.RESULT_VERSION_TTL = 0
+        hits = api_utils.result_cache.local.stats.hits
+        try:
+            r1 = self.client.get('/filtro?nome=nome7')
+            r2 = self.client.get('/filtro?nome=nome7')
+            assert r1.data == r2.data
+            assert api_utils.result_cache.local.stats.hits == hits + 1
+            # Alteração muda max(last_modified) e invalida o cache
+            with self.engine.begin() as conn:
+                conn.execute(tabela.update().where(tabela.c.id == 7).values(
+                    nome='outro', last_modified=datetime(2020, 1, 1)))
+            assert self.client.get('/filtro?nome=nome7').status_code == 404
+            assert api_utils.result_cache.local.stats.hits == hits + 1
+        finally:
+            api_utils.RESULT_VERSION_TTL = ttl
+        info = api_utils.result_cache_info()
+        assert info['versions']['misses'] >= 3
+
+
+class TestFiltro(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        self.session = scoped_session(sessionmaker(bind=engine))
+        for i in range(1, 21):
+            self.session.add(Conhecimento(
+                id=i, numero='%03d' % i, descricao='carga %d' % i,
+                last_modified=INICIO + timedelta(minutes=i)))
+        self.session.commit()
+        self.app = Flask(__name__)
+        self.app.config['db_session'] = self.session
+
+        @self.app.route('/filtro')
+        def filtro():
+            return api_utils.get_filtro_alchemy(Conhecimento,
+                                                request.args.to_dict())
+
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.session.remove()
+
+    def ids(self, url):
+        r = self.client.get(url)
+        if r.status_code != 200:
+            return r.status_code
+        return [linha['id'] for linha in json.loads(r.data)]
+
+    def test_indexed_columns(self):
+        assert api_utils.indexed_columns(Conhecimento.__table__) == \
+            frozenset(['id', 'numero'])
+
+    def test_plan_filtro(self):
+        condicoes, plano = api_utils.plan_filtro(
+            Conhecimento, {'numero': '01', 'id__gte': 5, 'id__lt': 12,
+                           'descricao': 'carga 1'})
+        assert len(condicoes) == 4
+        assert plano == [('numero', 'prefix', True), ('id', 'range', True),
+                         ('id', 'range', True),
+                         ('descricao', 'prefix', False)]
+        with self.assertRaises(KeyError):
+            api_utils.plan_filtro(Conhecimento, {'inexistente': 1})
+
+    def test_plan_filtro_atributo_orm(self):
+        condicoes, plano = api_utils.plan_filtro(
+            Manifesto, {'numero_manifesto': '01', 'tipo_manifesto': 'A',
+                        'numero': '02'})
+        assert plano == [('numero_manifesto', 'prefix', True),
+                         ('tipo_manifesto', 'prefix', False),
+                         ('numero', 'prefix', True)]
+        assert [str(condicao).split(' :')[0] for condicao in condicoes] == \
+            ['manifesto.numero LIKE', 'manifesto.tipo LIKE',
+             'manifesto.numero LIKE']
+        # Nome da coluna não é atributo do modelo
+        with self.assertRaises(KeyError):
+            api_utils.plan_filtro(Manifesto, {'tipo': 'A'})
+
+    def test_get_filtro_alchemy(self):
+        assert self.ids('/filtro?numero=01') == list(range(10, 20))
+        assert self.ids('/filtro?numero=01&id__gte=12&id__lt=15') == \
+            [12, 13, 14]
+        # Igualdade (e não LIKE) em coluna inteira
+        assert self.ids('/filtro?id=1') == [1]
+
+    def test_schema_registry(self):
+        registry = api_utils.SchemaRegistry()
+        registry.register(Conhecimento)
+        assert list(registry.properties(Conhecimento).items()) == [
+            ('descricao', {'type': 'string'}),
+            ('id', {'type': 'integer'}),
+            ('last_modified', {'type': 'string'}),
+            ('numero', {'type': 'string'})]
+        schema = registry.specs()['Conhecimento']
+        assert schema['title'] == 'Conhecimento'
+        assert schema['type'] == 'object'
+        assert registry.json_schema(Conhecimento) is schema
+
+    def test_fullscan_policy(self):
+        assert self.ids('/filtro?descricao=carga 2') == [2, 20]
+        self.app.config['API_FULLSCAN'] = 'refuse'
+        assert self.ids('/filtro?descricao=carga 2') == 400
+        assert self.ids('/filtro?numero=002') == [2]
+        self.app.config['API_EXPLAIN'] = True
+        assert self.ids('/filtro?descricao=carga 2') == 400
+        assert self.ids('/filtro?id__gte=19') == [19, 20]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import threading
+import unittest
+
+from werkzeug.security import generate_password_hash
+
+from ajna_commons.flask.auth import AuthBusyError, PasswordVerifier
+
+
+class TestPasswordVerifier(unittest.TestCase):
+
+    def setUp(self):
+        self.encripted = generate_password_hash('senha')
+
+    def test_check(self):
+        verifier = PasswordVerifier(workers=2, max_pending=2)
+        assert verifier.check(self.encripted, 'senha')
+        assert not verifier.check(self.encripted, 'errada')
+        assert not verifier.check(None, 'senha')
+        assert not verifier.check(self.encripted, None)
+
+    def test_cache_verificacoes(self):
+        verifier = PasswordVerifier(workers=1, max_pending=0)
+        assert verifier.check(self.encripted, 'senha')
+        assert verifier.check(self.encripted, 'senha')
+        assert verifier.info()['hits'] == 1
+        # Senha errada nunca é guardada
+        assert not verifier.check(self.encripted, 'errada')
+        assert not verifier.check(self.encripted, 'errada')
+        assert verifier.info()['hits'] == 1
+
+    def test_fila_cheia(self):
+        verifier = PasswordVerifier(workers=1, max_pending=0)
+        liberar = threading.Event()
+        verifier._slots.acquire()
+        verifier.executor.submit(liberar.wait)
+        try:
+            with self.assertRaises(AuthBusyError):
+                verifier.check(self.encripted, 'senha')
+            assert verifier.info()['busy'] == 1
+        finally:
+            liberar.set()
+            verifier._slots.release()
+        assert verifier.check(self.encripted, 'senha')
+
+    def test_needs_rehash(self):
+        verifier = PasswordVerifier(method='pbkdf2:sha256:1000')
+        assert verifier.needs_rehash(self.encripted)
+        novo = generate_password_hash('senha', method='pbkdf2:sha256:1000')
+        assert not verifier.needs_rehash(novo)
+        assert not PasswordVerifier().needs_rehash(self.encripted)
+        # Método sem iterações explícitas: vale o padrão do werkzeug
+        padrao = generate_password_hash('senha', method='pbkdf2:sha256')
+        assert not PasswordVerifier(
+            method='pbkdf2:sha256').needs_rehash(padrao)
+        assert not PasswordVerifier(method='pbkdf2').needs_rehash(padrao)
+        assert PasswordVerifier(method='pbkdf2:sha512').needs_rehash(padrao)
+        assert PasswordVerifier(method='scrypt').needs_rehash(padrao)
+
+
+if __name__ == '__main__':
+    unittest.main()
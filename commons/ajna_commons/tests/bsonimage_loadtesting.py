@@ -91,7 +91,7 @@ class TestModel(ParametrizedTestCase):
 
     def test_5savemongolist(self):
         global files_ids
-        files_ids = self._bsonimagelist.tomongo(self._fs)
+        files_ids = self._bsonimagelist.tomongo(self._fs, self._db)
         assert files_ids is not None
 
     def test_6loadmongolist(self):
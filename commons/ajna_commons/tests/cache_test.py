@@ -0,0 +1,140 @@
+import os
+import pickle
+import tempfile
+import time
+import unittest
+
+from ajna_commons.utils.cache import DiskCache, LRUCache, TwoLevelCache, \
+    dumps_value, loads_value
+
+
+class FakeRedis():
+    """Subconjunto de redis.StrictRedis em memória (sem expiração)."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def incr(self, key):
+        value = int(self.data.get(key, 0)) + 1
+        self.data[key] = str(value).encode()
+        return value
+
+    def expire(self, key, seconds):
+        pass
+
+
+class TestCache(unittest.TestCase):
+
+    def test_lru_max_items(self):
+        cache = LRUCache(max_items=2)
+        cache.set('a', b'1')
+        cache.set('b', b'2')
+        assert cache.get('a') == b'1'
+        cache.set('c', b'3')  # 'b' é o menos recente
+        assert cache.get('b') is None
+        assert cache.get('a') == b'1'
+        assert cache.get('c') == b'3'
+        assert cache.stats.evictions == 1
+        assert cache.stats.hits == 3
+        assert cache.stats.misses == 1
+
+    def test_lru_max_bytes(self):
+        cache = LRUCache(max_bytes=10)
+        cache.set('a', b'x' * 6)
+        cache.set('b', b'x' * 6)
+        assert 'a' not in cache
+        assert cache.nbytes == 6
+        cache.set('c', b'x' * 11)  # Maior que o orçamento: ignorado
+        assert 'c' not in cache
+        cache.pop('b')
+        assert cache.nbytes == 0
+
+    def test_lru_ttl(self):
+        cache = LRUCache(max_items=2, ttl=0.05)
+        cache.set('a', b'1')
+        assert cache.get('a') == b'1'
+        time.sleep(0.06)
+        assert cache.get('a') is None
+        assert cache.nbytes == 0
+        assert cache.stats.misses == 1
+
+    def test_lru_ttl_contains(self):
+        cache = LRUCache(max_items=2, ttl=0.05)
+        cache.set('a', b'1')
+        assert 'a' in cache
+        time.sleep(0.06)
+        assert 'a' not in cache
+        assert len(cache) == 0
+        assert cache.nbytes == 0
+
+    def test_disk_cache(self):
+        with tempfile.TemporaryDirectory() as path:
+            cache = DiskCache(path, max_bytes=10)
+            cache.set(('id', '0', None), b'x' * 6)
+            assert cache.get(('id', '0', None)) == b'x' * 6
+            cache.set(('id', '1', None), b'y' * 6)
+            assert cache.get(('id', '0', None)) is None
+            assert len(os.listdir(path)) == 1
+            # Nova instância reconstrói o índice a partir do diretório
+            cache2 = DiskCache(path, max_bytes=10)
+            assert cache2.nbytes == 6
+            assert cache2.get(('id', '1', None)) == b'y' * 6
+
+    def test_two_level_coherent(self):
+        redisdb = FakeRedis()
+        # Dois processos compartilhando o Redis
+        cache1 = TwoLevelCache(LRUCache(max_items=10), redisdb,
+                               coherent=True)
+        cache2 = TwoLevelCache(LRUCache(max_items=10), redisdb,
+                               coherent=True)
+        cache1.set('u', {'nome': 'antigo'})
+        assert cache2.get('u') == {'nome': 'antigo'}
+        assert 'u' in cache2.local
+        cache1.pop('u')
+        assert cache2.get('u') is None
+        assert 'u' not in cache2.local
+        cache1.set('u', {'nome': 'novo'})
+        assert cache2.get('u') == {'nome': 'novo'}
+        assert cache2.get('u') == {'nome': 'novo'}  # Acerto local
+        assert cache2.local.stats.hits == 1
+
+    def test_two_level_sem_coerencia(self):
+        redisdb = FakeRedis()
+        cache1 = TwoLevelCache(LRUCache(max_items=10), redisdb)
+        cache2 = TwoLevelCache(LRUCache(max_items=10), redisdb)
+        cache1.set('u', 'antigo')
+        assert cache2.get('u') == 'antigo'
+        cache1.pop('u')
+        # Cópia local do outro processo continua até expirar
+        assert cache2.get('u') == 'antigo'
+
+    def test_dumps_value(self):
+        for value in (b'\xff\x00', {'nome': 'a'}, [b'{}', {'Link': 'x'}]):
+            assert loads_value(dumps_value(value)) == value
+        assert loads_value(dumps_value((b'x', 1))) == [b'x', 1]
+        with self.assertRaises(TypeError):
+            dumps_value(object())
+
+    def test_two_level_sem_pickle(self):
+        redisdb = FakeRedis()
+        cache = TwoLevelCache(LRUCache(max_items=10), redisdb)
+        # Valor gravado por terceiros (ou versão antiga) não é desserializado
+        redisdb.set(cache.redis_key('u'), pickle.dumps({'nome': 'a'}))
+        assert cache.get('u') is None
+        assert cache.redis_errors == 1
+        cache.set('u', (b'corpo', {'Link': 'x'}))
+        cache.clear()
+        assert cache.get('u') == [b'corpo', {'Link': 'x'}]
+
+
+if __name__ == '__main__':
+    unittest.main()
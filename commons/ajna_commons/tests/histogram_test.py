@@ -0,0 +1,111 @@
+import io
+import os
+import unittest
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from ajna_commons.utils import ImgEnhance
+from bson import BSON, ObjectId
+
+from ajna_commons.utils.histogram import (apply_lut, autocontrast_lut,
+                                          compute_histogram, equalize_lut,
+                                          histogram_matches, map_histogram,
+                                          pack_histogram, unpack_histogram)
+from ajna_commons.utils.images import (HISTOGRAM_COLLECTION,
+                                       ImageBytesTansformations,
+                                       load_histogram, save_histogram)
+
+TEST_PATH = os.path.abspath(os.path.dirname(__file__))
+
+
+class FakeCollection():
+    """Subconjunto de pymongo Collection (find_one/replace_one por _id)."""
+
+    def __init__(self):
+        self.rows = {}
+
+    def find_one(self, filtro):
+        return self.rows.get(filtro['_id'])
+
+    def replace_one(self, filtro, row, upsert=False):
+        self.rows[filtro['_id']] = row
+
+
+class TestHistogram(unittest.TestCase):
+    def setUp(self):
+        random = np.random.RandomState(0)
+        array = random.normal(90, 30, (80, 120)).clip(0, 255)
+        self.gray = Image.fromarray(array.astype(np.uint8))
+        with open(os.path.join(TEST_PATH, 'stamp1.jpg'), 'rb') as image:
+            self.image_bytes = image.read()
+        self.rgb = Image.open(io.BytesIO(self.image_bytes)).convert('RGB')
+
+    def assertSameImage(self, image1, image2):
+        assert image1.mode == image2.mode
+        assert np.array_equal(np.asarray(image1), np.asarray(image2))
+
+    def test_luts_iguais_ao_pil(self):
+        for image in (self.gray, self.rgb):
+            histogram = compute_histogram(image)
+            assert histogram_matches(image, histogram)
+            self.assertSameImage(
+                apply_lut(image, equalize_lut(histogram)),
+                ImageOps.equalize(image))
+            for cutoff in (0, 1, 15, 49):
+                self.assertSameImage(
+                    apply_lut(image, autocontrast_lut(histogram, cutoff)),
+                    ImageOps.autocontrast(image, cutoff=cutoff))
+
+    def test_map_histogram(self):
+        histogram = self.gray.histogram()
+        lut = equalize_lut(histogram)
+        assert map_histogram(histogram, lut) == \
+            ImageOps.equalize(self.gray).histogram()
+
+    def test_histogram_matches(self):
+        histogram = compute_histogram(self.gray)
+        assert not histogram_matches(self.rgb, histogram)
+        assert not histogram_matches(self.gray.crop((0, 0, 10, 10)),
+                                     histogram)
+        assert not histogram_matches(self.gray, None)
+
+    def test_autocontrast_com_histograma(self):
+        histogram = compute_histogram(self.image_bytes)
+        image = Image.open(io.BytesIO(self.image_bytes))
+        for equalize in (False, True):
+            self.assertSameImage(
+                ImgEnhance.autocontrast(image, equalize=equalize,
+                                        histogram=histogram),
+                ImgEnhance.autocontrast(image, equalize=equalize))
+        self.assertSameImage(ImgEnhance.equalize(image, histogram),
+                             ImgEnhance.equalize(image))
+
+    def test_pipeline_com_histograma(self):
+        histogram = compute_histogram(self.image_bytes)
+        image = Image.open(io.BytesIO(self.image_bytes))
+        for chain in ('rotate90,equalize', 'equalize,equalize',
+                      'crop10,equalize'):
+            self.assertSameImage(
+                ImageBytesTansformations.transform_pil(image, chain,
+                                                       histogram),
+                ImageBytesTansformations.transform_pil(image, chain))
+
+    def test_pack_histogram(self):
+        histogram = compute_histogram(self.image_bytes)
+        packed = pack_histogram(histogram)
+        assert unpack_histogram(packed) == histogram
+        # Bem menor que a lista de inteiros em BSON
+        assert len(packed) < len(BSON.encode({'histogram': histogram})) / 3
+
+    def test_save_load_histogram(self):
+        db = {HISTOGRAM_COLLECTION: FakeCollection()}
+        _id = ObjectId()
+        assert load_histogram(db, _id) is None
+        histogram = compute_histogram(self.image_bytes)
+        save_histogram(db, str(_id), histogram)
+        assert load_histogram(db, _id) == histogram
+
+
+if __name__ == '__main__':
+    unittest.main()
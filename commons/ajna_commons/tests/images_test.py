@@ -1,12 +1,15 @@
 import datetime
+import io
 import os
 import unittest
 
 import gridfs
+from PIL import Image
 from pymongo import MongoClient
 
 from ajna_commons.models.bsonimage import BsonImage
-from ajna_commons.utils.images import get_imagens_recortadas
+from ajna_commons.utils.images import (get_imagens_recortadas,
+                                       ImageBytesTansformations)
 
 TEST_PATH = os.path.abspath(os.path.dirname(__file__))
 IMG_FOLDER = os.path.join(TEST_PATH)
@@ -28,8 +31,8 @@ class TestModel(unittest.TestCase):
         )
         self._db = MongoClient().unit_test
         self._fs = gridfs.GridFS(self._db)
-        self.file_id = self._bsonimage.tomongo(self._fs)
-        self.file_id2 = self._bsonimage2.tomongo(self._fs)
+        self.file_id = self._bsonimage.tomongo(self._fs, self._db)
+        self.file_id2 = self._bsonimage2.tomongo(self._fs, self._db)
 
     def tearDown(self):
         self._fs.delete(self.file_id)
@@ -62,5 +65,34 @@ class TestModel(unittest.TestCase):
         assert imagens == []
 
 
+class TestTransformations(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(IMG_FOLDER, 'stamp1.jpg'), 'rb') as image:
+            self.image_bytes = image.read()
+        self.size = Image.open(io.BytesIO(self.image_bytes)).size
+
+    def test_available(self):
+        available = ImageBytesTansformations.get_available_transformations()
+        assert sorted(available) == ['crop10', 'equalize',
+                                     'rotate270', 'rotate90']
+
+    def test_parse_chain(self):
+        chain = ImageBytesTansformations.parse_chain('rotate90, equalize')
+        assert chain == ('rotate90', 'equalize')
+        with self.assertRaises(ValueError):
+            ImageBytesTansformations.parse_chain(['rotate90', 'parse_chain'])
+
+    def test_pipeline(self):
+        result = ImageBytesTansformations.apply_pipeline(
+            self.image_bytes, 'rotate90,crop10')
+        width, height = Image.open(result).size
+        border = int(self.size[1] / 10)
+        assert (width, height) == (self.size[1] - 2 * border,
+                                   self.size[0] - 2 * border)
+        rotated = Image.open(
+            ImageBytesTansformations.rotate90(self.image_bytes))
+        assert rotated.size == (self.size[1], self.size[0])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,48 @@
+"""Medição de desempenho das funções de ImgEnhance em imagens grandes.
+
+Uso:
+   python ajna_commons/tests/imgenhance_loadtesting.py
+
+"""
+import os
+import time
+
+import numpy as np
+import PIL
+
+from ajna_commons.tests.imgenhance_test import (enhancedcontrast_cv2_legacy,
+                                                expand_tocolor_legacy)
+from ajna_commons.utils import ImgEnhance
+
+# Tamanhos típicos de imagens de escâner (largura, altura)
+TAMANHOS = [(1024, 768), (4096, 2048), (8192, 4096)]
+REPETICOES = 5
+
+
+def imagem_cinza(tamanho):
+    random = np.random.RandomState(0)
+    array = random.randint(0, 256, (tamanho[1], tamanho[0])).astype(np.uint8)
+    return PIL.Image.fromarray(array)
+
+
+def mede(funcao, *args):
+    s0 = time.time()
+    for _ in range(REPETICOES):
+        funcao(*args)
+    return (time.time() - s0) / REPETICOES
+
+
+if __name__ == '__main__':
+    print(os.uname())
+    print(time.strftime('%Y-%m-%d %H:%M'))
+    for tamanho in TAMANHOS:
+        pil_image = imagem_cinza(tamanho)
+        print('Imagem %dx%d' % tamanho)
+        legado = mede(expand_tocolor_legacy, pil_image, 1.2, 1.0, False)
+        lut = mede(ImgEnhance.expand_tocolor, pil_image, 1.2, 1.0, False)
+        print('  expand_tocolor original: %.4fs  LUT: %.4fs  (%.1fx)' %
+              (legado, lut, legado / lut))
+        legado = mede(enhancedcontrast_cv2_legacy, pil_image)
+        cinza = mede(ImgEnhance.enhancedcontrast_cv2, pil_image)
+        print('  enhancedcontrast_cv2 original: %.4fs  cinza: %.4fs  (%.1fx)' %
+              (legado, cinza, legado / cinza))
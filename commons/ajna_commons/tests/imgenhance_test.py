@@ -0,0 +1,134 @@
+import io
+import unittest
+
+import cv2
+import numpy as np
+import PIL
+from PIL import ImageOps
+
+from ajna_commons.utils import ImgEnhance
+from ajna_commons.utils.cache import LRUCache, TwoLevelCache
+
+
+def expand_tocolor_legacy(pil_image, alpha=1.2, beta=1.0, equalize=True):
+    """Implementação original (por imagem inteira), para comparação."""
+    if equalize:
+        pil_image = ImageOps.equalize(pil_image)
+    pil_image = pil_image.convert('L')
+    imgarray = np.asarray(pil_image)
+    gray = np.array((imgarray * 3. * alpha) ** beta, dtype=np.float32)
+    enhanced_B = gray.copy()
+    enhanced_B[enhanced_B > 254] = 254
+    enhanced_G = (gray - 250)
+    enhanced_G[enhanced_G > 254] = 254
+    enhanced_G[enhanced_G <= 40] = 40
+    enhanced_R = (gray - 510)
+    enhanced_R[enhanced_R <= 20] = 20
+    enhanced_R[enhanced_R > 254] = 254
+    enhanced_RGB = np.dstack((enhanced_R, enhanced_G, enhanced_B)
+                             ).astype(np.uint8)
+    return PIL.Image.fromarray(enhanced_RGB)
+
+
+def enhancedcontrast_cv2_legacy(pil_image):
+    """Implementação original (sempre via LAB, retorna BGR)."""
+    opencvImage = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
+    clahe = cv2.createCLAHE(clipLimit=3., tileGridSize=(8, 8))
+    lab = cv2.cvtColor(opencvImage, cv2.COLOR_BGR2LAB)
+    l, a, b = cv2.split(lab)
+    l2 = clahe.apply(l)
+    lab = cv2.merge((l2, a, b))
+    new_img = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+    return PIL.Image.fromarray(new_img)
+
+
+class TestImgEnhance(unittest.TestCase):
+    def setUp(self):
+        random = np.random.RandomState(0)
+        gradient = np.tile(np.arange(256, dtype=np.uint8), (64, 1))
+        noise = random.randint(0, 256, (64, 256)).astype(np.uint8)
+        self.pil_image = PIL.Image.fromarray(np.vstack((gradient, noise)))
+
+    def test_expand_tocolor_identico(self):
+        for alpha, beta, equalize in ((1.2, 1.0, True), (1.2, 1.0, False),
+                                      (0.7, 1.3, False), (2.5, 0.8, True)):
+            esperado = expand_tocolor_legacy(self.pil_image, alpha, beta,
+                                             equalize)
+            resultado = ImgEnhance.expand_tocolor(self.pil_image, alpha, beta,
+                                                  equalize)
+            assert resultado.mode == 'RGB'
+            assert np.array_equal(np.asarray(esperado),
+                                  np.asarray(resultado))
+
+    def test_expand_tocolor_lut_cache(self):
+        lut = ImgEnhance.expand_tocolor_lut(1.2, 1.0)
+        assert lut.shape == (256, 3)
+        assert lut is ImgEnhance.expand_tocolor_lut(1.2, 1.0)
+
+    def test_enhancedcontrast_cv2_cinza(self):
+        resultado = ImgEnhance.enhancedcontrast_cv2(self.pil_image)
+        assert resultado.mode == 'L'
+        assert resultado.size == self.pil_image.size
+        # RGB com canais iguais também é tratado como cinza
+        resultado_rgb = ImgEnhance.enhancedcontrast_cv2(
+            self.pil_image.convert('RGB'))
+        assert resultado_rgb.mode == 'L'
+        assert np.array_equal(np.asarray(resultado),
+                              np.asarray(resultado_rgb))
+
+    def test_enhancedcontrast_cv2_cor(self):
+        array = np.zeros((64, 64, 3), dtype=np.uint8)
+        array[:, :, 0] = np.tile(np.arange(64, dtype=np.uint8) * 4, (64, 1))
+        resultado = ImgEnhance.enhancedcontrast_cv2(
+            PIL.Image.fromarray(array))
+        assert resultado.mode == 'RGB'
+        resultado = np.asarray(resultado).astype(int)
+        # Canais na ordem correta: imagem continua vermelha
+        assert resultado[:, :, 0].sum() > resultado[:, :, 2].sum()
+
+    def test_get_clahe_cache(self):
+        clahe = ImgEnhance.get_clahe(2., (4, 4))
+        assert clahe is ImgEnhance.get_clahe(2., (4, 4))
+        assert clahe is not ImgEnhance.get_clahe(3., (8, 8))
+
+    def test_enhance_batch(self):
+        imagens = []
+        for nivel in range(0, 250, 25):
+            out = io.BytesIO()
+            PIL.Image.fromarray(
+                np.asarray(self.pil_image) // 2 + nivel // 2).save(out, 'JPEG')
+            imagens.append(out.getvalue())
+        imagens.append(b'nao e imagem')
+        esperado = [ImgEnhance.enhance_bytes(imagem, 'equalize')
+                    for imagem in imagens[:-1]] + [None]
+        resultado = list(ImgEnhance.enhance_batch(
+            imagens, 'equalize', processes=2, chunksize=3))
+        assert resultado == list(enumerate(esperado))
+        resultado = ImgEnhance.enhance_batch(
+            iter(imagens), 'equalize', processes=2, chunksize=2,
+            ordered=False, max_pending=2)
+        assert sorted(resultado, key=lambda r: r[0]) == \
+            list(enumerate(esperado))
+        with self.assertRaises(ValueError):
+            next(ImgEnhance.enhance_batch(imagens, 'inexistente'))
+
+    def test_cached_enhance(self):
+        cache = TwoLevelCache(LRUCache(max_items=2))
+        out = io.BytesIO()
+        self.pil_image.save(out, 'JPEG')
+        imagem = out.getvalue()
+        primeiro = ImgEnhance.cached_enhance(imagem, 'autocontrast',
+                                             cache=cache, cutoff=10)
+        segundo = ImgEnhance.cached_enhance(imagem, 'autocontrast',
+                                            cache=cache, cutoff=10)
+        assert primeiro == segundo
+        assert cache.local.stats.hits == 1
+        ImgEnhance.cached_enhance(imagem, 'autocontrast', cache=cache,
+                                  cutoff=5)
+        ImgEnhance.cached_enhance(imagem, 'equalize', cache=cache)
+        assert cache.local.stats.evictions == 1
+        assert cache.info()['items'] == 2
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import logging
+import os
+import queue
+import tempfile
+import threading
+import unittest
+
+from ajna_commons.flask import log as log_module
+from ajna_commons.flask.log import (BatchingFileHandler, BatchingQueueListener,
+                                    LazyLogArg, LazyQueueHandler)
+
+
+class ThreadName(LazyLogArg):
+    """Argumento de log que registra em qual thread foi formatado."""
+
+    def __str__(self):
+        return threading.current_thread().name
+
+
+class TestQueueLogging(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, 'access.log')
+        self.file_handler = BatchingFileHandler(self.filename, capacity=10)
+        self.file_handler.setFormatter(logging.Formatter('%(message)s'))
+        log_queue = queue.Queue(-1)
+        self.listener = BatchingQueueListener(log_queue, self.file_handler,
+                                              flush_interval=0.05)
+        self.logger = logging.getLogger('ajna.teste.queue')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.handler = LazyQueueHandler(log_queue)
+        self.logger.addHandler(self.handler)
+        self.listener.start()
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.file_handler.close()
+        self.tmpdir.cleanup()
+
+    def linhas(self):
+        with open(self.filename) as log_file:
+            return log_file.read().splitlines()
+
+    def test_formatacao_no_listener(self):
+        self.logger.info('thread %s', ThreadName())
+        self.listener.stop()
+        self.file_handler.flush()
+        linhas = self.linhas()
+        assert len(linhas) == 1
+        assert linhas[0] != 'thread ' + threading.current_thread().name
+
+    def test_args_mutaveis_formatados_na_chamada(self):
+        lista = [1]
+        self.logger.info('lista %s thread %s', lista,
+                         threading.current_thread().name)
+        lista.append(2)
+        self.listener.stop()
+        self.file_handler.flush()
+        assert self.linhas() == ['lista [1] thread %s' %
+                                 threading.current_thread().name]
+
+    def test_lote_e_intervalo(self):
+        for i in range(25):
+            self.logger.info('linha %d', i)
+        # Descarga por lote (10) ou por fila vazia (flush_interval)
+        self.listener.stop()
+        self.file_handler.flush()
+        assert self.linhas() == ['linha %d' % i for i in range(25)]
+
+    def test_erro_descarrega_na_hora(self):
+        handler = BatchingFileHandler(
+            os.path.join(self.tmpdir.name, 'error.log'), capacity=100)
+        record = logging.LogRecord('ajna', logging.ERROR, __file__, 1,
+                                   'erro', None, None)
+        handler.handle(record)
+        assert handler.pending == 0
+        handler.close()
+        self.listener.stop()
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'Requer os.fork')
+class TestQueueLoggingFork(unittest.TestCase):
+    """Modo fila do logger ajna em processo filho (ex: gunicorn --preload)."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, 'access.log')
+        self.handlers = log_module.activity_handler, log_module.error_handler
+        handler = BatchingFileHandler(self.filename)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        handler.setLevel(logging.INFO)
+        log_module.activity_handler = handler
+        log_module.error_handler = logging.NullHandler()
+        for original in self.handlers:
+            log_module.logger.removeHandler(original)
+        log_module.start_queue_logging(flush_interval=0.05)
+
+    def tearDown(self):
+        log_module.stop_queue_logging()
+        for handler in log_module.file_handlers():
+            log_module.logger.removeHandler(handler)
+        log_module.activity_handler.close()
+        log_module.activity_handler, log_module.error_handler = self.handlers
+        for original in self.handlers:
+            log_module.logger.addHandler(original)
+        self.tmpdir.cleanup()
+
+    def test_filho_grava(self):
+        log_module.logger.info('pai')
+        pid = os.fork()
+        if pid == 0:  # pragma: no cover (processo filho)
+            try:
+                log_module.logger.info('filho %s', 'após fork')
+                log_module.stop_queue_logging()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        log_module.stop_queue_logging()
+        with open(self.filename) as log_file:
+            linhas = log_file.read().splitlines()
+        self.assertEqual(sorted(linhas), ['filho após fork', 'pai'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import time
+import unittest
+
+from flask import Flask
+from flask_login import LoginManager
+
+from ajna_commons.flask import profiler
+from ajna_commons.flask.profiler import StackSampler
+
+
+def funcao_lenta():
+    time.sleep(0.1)
+
+
+class TestStackSampler(unittest.TestCase):
+
+    def test_sorteada(self):
+        sampler = StackSampler(rate=1, slow=10, interval=0.001)
+        try:
+            sampler.begin('teste')
+            funcao_lenta()
+            profile = sampler.end()
+        finally:
+            sampler.stop()
+        assert profile.as_dict()['reason'] == 'sampled'
+        assert profile.samples > 0
+        assert any(stack.endswith('profiler_test:funcao_lenta')
+                   for stack in profile.stacks)
+        assert 'profiler_test:funcao_lenta ' in sampler.collapsed()
+
+    def test_lenta_sempre_capturada(self):
+        sampler = StackSampler(rate=0, slow=0.02, interval=0.001)
+        try:
+            sampler.begin('rapida')
+            assert sampler.end() is None
+            sampler.begin('lenta')
+            funcao_lenta()
+            profile = sampler.end()
+        finally:
+            sampler.stop()
+        assert profile.as_dict()['reason'] == 'slow'
+        assert list(sampler.profiles) == [profile]
+
+    def test_espera_sem_amostragem(self):
+        sampler = StackSampler(rate=0, slow=1, interval=0.001)
+        assert sampler._next_wait() is None
+        sampler.begin()
+        # Nenhuma requisição a amostrar: dorme até a primeira ficar lenta
+        assert 0.9 < sampler._next_wait() <= 1
+        sampler.end()
+        sampler.rate = 1
+        sampler.begin()
+        assert sampler._next_wait() == 0.001
+        sampler.end()
+        sampler.stop()
+
+    def test_mantem_ultimos(self):
+        sampler = StackSampler(rate=1, keep=2, interval=0.001)
+        try:
+            for _ in range(3):
+                sampler.begin()
+                time.sleep(0.02)
+                sampler.end()
+        finally:
+            sampler.stop()
+        assert len(sampler.profiles) == 2
+
+
+class TestProfilerViews(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.secret_key = 'teste'
+        LoginManager(self.app).user_loader(lambda userid: None)
+        self.sampler = profiler.configure(
+            self.app, StackSampler(rate=1, interval=0.001))
+
+        @self.app.route('/lenta')
+        def lenta():
+            funcao_lenta()
+            return 'ok'
+
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.sampler.stop()
+
+    def test_exige_login(self):
+        assert self.client.get('/_profiler/').status_code == 401
+
+    def test_views(self):
+        self.app.config['LOGIN_DISABLED'] = True
+        self.client.get('/lenta')
+        perfis = self.client.get('/_profiler/').get_json()
+        assert len(perfis) == 1
+        assert perfis[0]['label'] == 'GET /lenta'
+        rv = self.client.get('/_profiler/%d' % perfis[0]['id'])
+        assert rv.mimetype == 'text/plain'
+        assert b'profiler_test:funcao_lenta ' in rv.data
+        assert self.client.get('/_profiler/0').status_code == 404
+        assert b'funcao_lenta' in self.client.get(
+            '/_profiler/collapsed').data
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import time
+import unittest
+import uuid
+
+from ajna_commons.flask.revocation import (BloomFilter, MemoryRevocationStore,
+                                           RedisRevocationStore)
+
+try:
+    import redis
+    redisdb = redis.StrictRedis.from_url('redis://localhost:6379',
+                                         socket_connect_timeout=0.5)
+    redisdb.ping()
+except Exception:
+    redisdb = None
+
+
+class FakeRedis():
+    """Subconjunto de redis.StrictRedis em memória (sem expiração)."""
+
+    def __init__(self):
+        self.keys = {}
+        self.zsets = {}
+
+    def set(self, key, value, ex=None):
+        self.keys[key] = value
+
+    def exists(self, key):
+        return int(key in self.keys)
+
+    def zadd(self, name, mapping):
+        self.zsets.setdefault(name, {}).update(mapping)
+
+    def zrangebyscore(self, name, low, high):
+        low, high = float(low), float(high)
+        return [member.encode() for member, score
+                in self.zsets.get(name, {}).items() if low <= score <= high]
+
+    def zremrangebyscore(self, name, low, high):
+        zset = self.zsets.get(name, {})
+        for member in [member.decode() for member in
+                       self.zrangebyscore(name, low, high)]:
+            del zset[member]
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline():
+
+    def __init__(self, redisdb):
+        self.redisdb = redisdb
+        self.calls = []
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            self.calls.append((getattr(self.redisdb, name), args, kwargs))
+        return call
+
+    def execute(self):
+        return [method(*args, **kwargs)
+                for method, args, kwargs in self.calls]
+
+
+class RedisFora():
+
+    def exists(self, key):
+        raise redis.exceptions.ConnectionError('fora')
+
+    def pipeline(self):
+        raise redis.exceptions.ConnectionError('fora')
+
+
+class TestRevocation(unittest.TestCase):
+
+    def test_memory_store(self):
+        store = MemoryRevocationStore()
+        store.add('a', time.time() + 60)
+        store.add('b', time.time() - 1)  # Token já expirado: mínimo 1s
+        assert 'a' in store
+        assert 'b' in store
+        assert 'c' not in store
+        # Simula passagem do tempo até a expiração de 'b'
+        store._revoked['b'] = time.time() - 1
+        store._heap = sorted((expires, jti) for jti, expires
+                             in store._revoked.items())
+        assert 'b' not in store
+        assert len(store) == 1
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        itens = [str(uuid.uuid4()) for _ in range(1000)]
+        for item in itens:
+            bloom.add(item)
+        assert all(item in bloom for item in itens)
+        falsos = sum(str(uuid.uuid4()) in bloom for _ in range(10000))
+        assert falsos < 300
+
+    def test_filtro_incremental(self):
+        fake = FakeRedis()
+        store = RedisRevocationStore(fake, bloom=True, refresh=1)
+        outro = RedisRevocationStore(fake, bloom=True, refresh=1)
+        store.add('a', time.time() + 60)
+        outro.refresh_filter()  # Primeira vez: reconstrução completa
+        assert 'a' in outro._filter
+        store.add('b', time.time() + 60)
+        assert 'b' not in outro._filter
+        rebuilt = outro._rebuilt
+        outro.refresh_filter()  # Somente revogações recentes
+        assert outro._rebuilt == rebuilt
+        assert 'b' in outro._filter
+        assert 'b' in outro
+        assert 'c' not in outro
+        outro.stop()
+
+    def test_redis_fora(self):
+        store = RedisRevocationStore(RedisFora())
+        store.add('a', time.time() + 60)  # Vale ao menos neste processo
+        assert 'a' in store
+        assert 'b' not in store  # fail open
+        assert store.redis_errors == 2
+        fechado = RedisRevocationStore(RedisFora(), fail_closed=True)
+        assert 'b' in fechado
+
+    @unittest.skipIf(redisdb is None, 'Redis não disponível')
+    def test_redis_store(self):
+        prefix = 'ajna:test:%s:' % uuid.uuid4()
+        store = RedisRevocationStore(redisdb, prefix=prefix, bloom=True)
+        outro = RedisRevocationStore(redisdb, prefix=prefix, bloom=True)
+        try:
+            assert 'a' not in store
+            store.add('a', time.time() + 60)
+            assert 'a' in store
+            assert 'a' in outro
+            assert 0 < redisdb.ttl(prefix + 'a') <= 60
+        finally:
+            store.stop()
+            outro.stop()
+            redisdb.delete(prefix + 'a', prefix + 'index', prefix + 'recent')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+"""Corpus aleatório e implementações originais de sanitiza, para comparação.
+
+Utilizado por sanitizar_test (equivalência) e sanitizar_loadtesting
+(desempenho).
+"""
+import random
+import unicodedata
+
+ALFABETOS = [
+    'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789',
+    ' \t\n\r\x0b\x0c\xa0\u2003\u3000',
+    '{}[]()$"\'\\;<>=?#~^`|*.,+&%@!_-:/',
+    'áàâãäéèêëíìîïóòôõöúùûüçñÁÀÂÃÄÉÈÊËÍÌÎÏÓÒÔÕÖÚÙÛÜÇÑßøæœ',
+    '\u0300\u0301\u0302\u0303\u0308\u0327\u0338\u20dd',
+    'ΑΒΓΔαβγδЖЗИЙжзийשלוםمرحبا中文字符日本語한국어',
+    '\ufb01\u2160\u00bd\u2075\uff21\u212b\u1e9b\u0130\u0131',
+    '\U0001f600\U0001f680\U00010348\x00\x7f\ufffd',
+]
+
+
+def corpus(tamanho=10000, semente=0, max_len=80):
+    """Lista de textos aleatórios misturando os alfabetos acima."""
+    gerador = random.Random(semente)
+    textos = ['', ' ', 'a']
+    while len(textos) < tamanho:
+        pesos = [gerador.random() for _ in ALFABETOS]
+        comprimento = gerador.randint(1, max_len)
+        textos.append(''.join(
+            gerador.choice(gerador.choices(ALFABETOS, weights=pesos)[0])
+            for _ in range(comprimento)))
+    return textos
+
+
+def unicode_sanitizar_legacy(text):
+    if not text:
+        return None
+    norm_txt = unicodedata.normalize('NFD', text)
+    shaved = ''.join(char for char in norm_txt
+                     if not unicodedata.combining(char))
+    if not shaved:
+        return None
+    return unicodedata.normalize('NFC', shaved)
+
+
+def mongo_sanitizar_legacy(text):
+    if not isinstance(text, str):
+        return text
+    LETRAS = u'abcdefghijklmnopqrstuvwxyz'
+    NUMEROS = u'0123456789'
+    SINAIS = u'*.,+&%@! _-:/'
+    secure = LETRAS + LETRAS.upper() + NUMEROS + SINAIS
+    if not text:
+        return None
+    norm_txt = unicodedata.normalize('NFD', text)
+    shaved = ''.join(char for char in norm_txt
+                     if char in secure)
+    if not shaved:
+        return None
+    return unicodedata.normalize('NFC', shaved)
+
+
+def sanitizar_legacy(text, norm_function=unicode_sanitizar_legacy):
+    if text is None or text == '':
+        return text
+    text = text.strip()
+    text = text.casefold()
+    text = norm_function(text)
+    if text is None or text == '':
+        return text
+    word_list = text.split()
+    text = ' '.join(word.strip() for word in word_list
+                    if len(word.strip()))
+    return text
@@ -0,0 +1,56 @@
+"""Medição de desempenho das funções de sanitiza (original x atual).
+
+Uso:
+   python ajna_commons/tests/sanitizar_loadtesting.py [número de textos]
+
+"""
+import os
+import random
+import sys
+import time
+
+from ajna_commons.tests.sanitizar_fuzz import (corpus, mongo_sanitizar_legacy,
+                                               sanitizar_legacy,
+                                               unicode_sanitizar_legacy)
+from ajna_commons.utils.sanitiza import (mongo_sanitizar, sanitizar,
+                                         sanitizar_coluna, sanitizar_lista,
+                                         unicode_sanitizar)
+
+TEXTOS = 1000000
+# Proporção de textos distintos: colunas de CSV repetem muitos valores
+DISTINTOS = 0.1
+
+
+def mede(funcao, textos):
+    s0 = time.time()
+    for texto in textos:
+        funcao(texto)
+    return time.time() - s0
+
+
+if __name__ == '__main__':
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else TEXTOS
+    print(os.uname())
+    print(time.strftime('%Y-%m-%d %H:%M'))
+    distintos = corpus(int(total * DISTINTOS), max_len=40)
+    gerador = random.Random(0)
+    textos = [gerador.choice(distintos) for _ in range(total)]
+    print('%d textos, %d distintos' % (len(textos), len(distintos)))
+    for nome, legado, atual in (
+            ('mongo_sanitizar', mongo_sanitizar_legacy, mongo_sanitizar),
+            ('unicode_sanitizar', unicode_sanitizar_legacy,
+             unicode_sanitizar),
+            ('sanitizar', sanitizar_legacy, sanitizar)):
+        tempo_legado = mede(legado, textos)
+        tempo_atual = mede(atual, textos)
+        print('%-18s original: %.2fs  atual: %.2fs  (%.1fx)' %
+              (nome, tempo_legado, tempo_atual, tempo_legado / tempo_atual))
+    s0 = time.time()
+    sanitizar_lista(list(textos))
+    tempo_lista = time.time() - s0
+    s0 = time.time()
+    sanitizar_coluna(textos)
+    tempo_coluna = time.time() - s0
+    print('%-18s lista: %.2fs  coluna: %.2fs  (%.1fx)' %
+          ('sanitizar_coluna', tempo_lista, tempo_coluna,
+           tempo_lista / tempo_coluna))
@@ -1,8 +1,30 @@
+import csv
+import os
+import tempfile
 import unittest
+import zipfile
 
+from ajna_commons.tests.sanitizar_fuzz import (corpus, mongo_sanitizar_legacy,
+                                               sanitizar_legacy,
+                                               unicode_sanitizar_legacy)
+from ajna_commons.utils import sanitiza
 from ajna_commons.utils.sanitiza import (ascii_sanitizar, mongo_sanitizar,
-                                         sanitizar,
-                                         sanitizar_lista, unicode_sanitizar)
+                                         ler_csv, sanitizar, sanitizar_coluna,
+                                         sanitizar_csv, sanitizar_lista,
+                                         unicode_sanitizar)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    import pandas
+except ImportError:
+    pandas = None
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
 
 
 class TestModel(unittest.TestCase):
@@ -36,6 +58,113 @@ class TestModel(unittest.TestCase):
         print(resultado)
         assert resultado == esperado
 
+    def test_fuzz_igual_original(self):
+        textos = corpus(20000)
+        textos.extend(texto * 3 for texto in corpus(200, semente=1))
+        for texto in textos:
+            assert mongo_sanitizar(texto) == mongo_sanitizar_legacy(texto)
+            assert unicode_sanitizar(texto) == unicode_sanitizar_legacy(texto)
+            assert sanitizar(texto) == sanitizar_legacy(texto)
+            assert sanitizar(texto, ascii_sanitizar) == \
+                sanitizar_legacy(texto, ascii_sanitizar)
+        # Segunda passada: resultados vindos do cache LRU
+        for texto in textos[:1000]:
+            assert sanitizar(texto) == sanitizar_legacy(texto)
+
+    def test_tabela_combinantes_limitada(self):
+        # Texto com muitos códigos distintos (CJK, emojis, planos altos)
+        texto = ''.join(chr(code) for code in range(0x3000, 0x30000, 7))
+        assert unicode_sanitizar(texto) == unicode_sanitizar_legacy(texto)
+        assert len(sanitiza._COMBINING) <= sanitiza._COMBINING_MAX_CODE
+        assert max(sanitiza._COMBINING) < sanitiza._COMBINING_MAX_CODE
+        assert unicode_sanitizar('a\u0301\u20d0b') == 'ab'
+
+
+class TestColuna(unittest.TestCase):
+    def setUp(self):
+        self.coluna = ['TESTE de SANitização   bagunçado.', 'Teste número 2',
+                       None, '', '   ', 'Teste número 2', 'ÁRVORE'] * 10
+        self.esperado = [sanitizar(valor) for valor in self.coluna]
+
+    def test_sanitizar_coluna_lista(self):
+        assert sanitizar_coluna(self.coluna) == self.esperado
+        assert sanitizar_coluna(self.coluna, ascii_sanitizar) == \
+            [sanitizar(valor, ascii_sanitizar) for valor in self.coluna]
+
+    def test_sanitizar_coluna_processos(self):
+        textos = corpus(2000)
+        import ajna_commons.utils.sanitiza as sanitiza
+        minimo = sanitiza.PARALELO_MINIMO
+        sanitiza.PARALELO_MINIMO = 100
+        try:
+            resultado = sanitizar_coluna(textos, processes=2, chunksize=300)
+        finally:
+            sanitiza.PARALELO_MINIMO = minimo
+        assert resultado == [sanitizar(texto) for texto in textos]
+
+    @unittest.skipIf(numpy is None, 'NumPy não instalado')
+    def test_sanitizar_coluna_numpy(self):
+        coluna = numpy.array(self.coluna, dtype=object)
+        resultado = sanitizar_coluna(coluna)
+        assert isinstance(resultado, numpy.ndarray)
+        assert list(resultado) == self.esperado
+
+    @unittest.skipIf(pandas is None, 'pandas não instalado')
+    def test_sanitizar_coluna_pandas(self):
+        serie = pandas.Series(self.coluna)
+        resultado = sanitizar_coluna(serie)
+        assert isinstance(resultado, pandas.Series)
+        for valor, esperado in zip(resultado, self.esperado):
+            nulo = esperado is None and pandas.isna(valor)
+            assert valor == esperado or nulo
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow não instalado')
+    def test_sanitizar_coluna_arrow(self):
+        array = pyarrow.array(self.coluna, type=pyarrow.string())
+        assert sanitizar_coluna(array).to_pylist() == self.esperado
+        chunked = pyarrow.chunked_array([self.coluna[:20], self.coluna[20:]])
+        assert sanitizar_coluna(chunked).to_pylist() == self.esperado
+
+
+class TestCSV(unittest.TestCase):
+    linhas = [['nome', 'descricao', 'codigo'],
+              ['  Ação  ', 'Cão   e  Gato', ' 001 '],
+              ['ÉLAN', 'Maçã', '002']]
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.origem = os.path.join(self.tmpdir.name, 'origem.csv')
+        with open(self.origem, 'w', encoding='latin1', newline='') as out:
+            csv.writer(out).writerows(self.linhas)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_sanitizar_csv(self):
+        destino = os.path.join(self.tmpdir.name, 'destino.csv')
+        resultado = sanitizar_csv(self.origem, destino,
+                                  colunas={'nome': 'ascii', 1: 'unicode'})
+        assert resultado['linhas'] == 3
+        assert list(ler_csv(destino)) == [
+            ['nome', 'descricao', 'codigo'],
+            ['acao', 'cao e gato', ' 001 '],
+            ['elan', 'maca', '002']]
+
+    def test_sanitizar_csv_zip(self):
+        origem = os.path.join(self.tmpdir.name, 'origem.zip')
+        with zipfile.ZipFile(origem, 'w') as pacote:
+            pacote.write(self.origem, 'origem.csv')
+        destino = os.path.join(self.tmpdir.name, 'destino.zip')
+        sanitizar_csv(origem, destino)
+        assert list(ler_csv(destino)) == [
+            ['nome', 'descricao', 'codigo'],
+            ['acao', 'cao e gato', '001'],
+            ['elan', 'maca', '002']]
+
+    def test_extensao_invalida(self):
+        with self.assertRaises(ValueError):
+            next(ler_csv('arquivo.xls'))
+
 
 if __name__ == '__main__':
     unittest.main()
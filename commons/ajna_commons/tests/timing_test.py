@@ -0,0 +1,90 @@
+import json
+import time
+import unittest
+
+from flask import Flask, Response
+
+from ajna_commons.flask.flask_log import access_record, log_access
+from ajna_commons.utils import timing
+
+
+class TestTiming(unittest.TestCase):
+
+    def tearDown(self):
+        timing.finish()
+
+    def test_metricas(self):
+        timing.start()
+        with timing.db_timer():
+            time.sleep(0.01)
+        with timing.db_timer(queries=0):
+            pass
+        timing.add_cache(True)
+        timing.add_cache(False)
+        timing.add_cache(False)
+        metrics = timing.finish().as_dict()
+        assert metrics['db_queries'] == 1
+        assert metrics['db_ms'] >= 10
+        assert metrics['duration_ms'] >= metrics['db_ms']
+        assert metrics['cache_hits'] == 1
+        assert metrics['cache_misses'] == 2
+        assert timing.current() is None
+
+    def test_sem_requisicao(self):
+        # Fora de requisição os registros são ignorados
+        with timing.db_timer():
+            pass
+        timing.add_cache(True)
+        assert timing.current() is None
+
+    def test_access_record(self):
+        app = Flask(__name__)
+        with app.test_request_context('/api/teste?x=1', method='POST',
+                                      environ_base={'HTTP_X_REAL_IP':
+                                                    '10.0.0.1'}):
+            timing.start()
+            timing.add_cache(True)
+            record = access_record(Response('abc', status=201), 'ivan',
+                                   api=True)
+            fields = json.loads(str(record))
+        assert fields['method'] == 'POST'
+        assert fields['path'] == '/api/teste'
+        assert fields['status'] == 201
+        assert fields['size'] == 3
+        assert fields['ip'] == '10.0.0.1'
+        assert fields['user'] == 'ivan'
+        assert fields['cache_hits'] == 1
+        assert fields['api'] is True
+        assert 'duration_ms' in fields
+
+    def test_log_access_stream(self):
+        registros = []
+
+        class Logger():
+            def info(self, msg, record):
+                registros.append(json.loads(str(record)))
+
+        app = Flask(__name__)
+
+        @app.route('/stream')
+        def stream():
+            timing.start()
+            return Response((parte for parte in ('[1', ',2', ']')),
+                            mimetype='application/json')
+
+        @app.after_request
+        def after_request(response):
+            log_access(Logger(), response, 'ivan')
+            return response
+
+        response = app.test_client().get('/stream')
+        assert response.data == b'[1,2]'
+        response.close()
+        assert len(registros) == 1
+        assert registros[0]['streamed'] is True
+        assert registros[0]['size'] == 5
+        assert 'duration_ms' in registros[0]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+
+from sqlalchemy import Column, String, create_engine
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+from werkzeug.security import generate_password_hash
+
+from ajna_commons.flask import user as user_module
+from ajna_commons.flask.user import DBUser, User
+
+Base = declarative_base()
+
+
+class Usuario(Base):
+    """Como nas aplicações, o modelo grava a senha criptografada."""
+    __tablename__ = 'usuarios'
+    cpf = Column(String(11), primary_key=True)
+    nome = Column(String(50))
+    _password = Column('password', String(200))
+
+    @property
+    def password(self):
+        return self._password
+
+    @password.setter
+    def password(self, password):
+        self._password = generate_password_hash(password)
+
+
+class TestUserCache(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.dbsession, self.alchemy_class = DBUser.dbsession, \
+            DBUser.alchemy_class
+        DBUser.dbsession = self.session
+        DBUser.alchemy_class = Usuario
+        user_module.user_cache.clear()
+        self.consultas = 0
+        get = user_module.UserDBComunication.get
+
+        def conta_get(comunicator, username):
+            self.consultas += 1
+            return get(comunicator, username)
+
+        self.get = get
+        user_module.UserDBComunication.get = conta_get
+
+    def tearDown(self):
+        user_module.UserDBComunication.get = self.get
+        DBUser.dbsession = self.dbsession
+        DBUser.alchemy_class = self.alchemy_class
+        user_module.user_cache.clear()
+
+    def test_cache(self):
+        DBUser.add('ajna', 'senha')
+        consultas = self.consultas
+        for _ in range(5):
+            assert User.get('ajna') is not None
+        assert self.consultas == consultas
+        assert DBUser.get('ajna', 'senha') is not None
+        assert DBUser.get('ajna', 'errada') is None
+        assert DBUser.cache_info()['hits'] >= 5
+
+    def test_cache_sem_senha(self):
+        DBUser.add('ajna', 'senha')
+        assert User.get('ajna') is not None
+        cached = user_module.user_cache.get(DBUser.cache_key('ajna'))
+        assert cached is not None
+        assert 'password' not in cached
+
+    def test_invalida_change_password(self):
+        DBUser.add('ajna', 'senha')
+        assert DBUser.get('ajna', 'senha') is not None
+        consultas = self.consultas
+        DBUser.change_password('ajna', 'nova')
+        assert DBUser.get('ajna', 'senha') is None
+        assert DBUser.get('ajna', 'nova') is not None
+        # Verificação de senha sempre lê o hash do BD
+        assert self.consultas == consultas + 2
+
+    def test_inexistente(self):
+        assert DBUser.get('ninguem') is None
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,39 +1,72 @@
+import io
+import os
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import lru_cache, partial
+from hashlib import md5
+
 import cv2
 import PIL
 import numpy as np
 from PIL import ImageOps
 
+from ajna_commons.utils.cache import LRUCache, TwoLevelCache
+from ajna_commons.utils.histogram import (apply_lut, autocontrast_lut,
+                                          equalize_lut, histogram_matches,
+                                          map_histogram)
+
+ENHANCE_CACHE_BYTES = int(os.environ.get('ENHANCE_CACHE_BYTES',
+                                         64 * 1024 * 1024))
+
+
+def _equalize(pil_image: PIL.Image, histogram: list = None):
+    """Retorna (imagem equalizada, histograma resultante ou None).
+
+    Se histogram (pré-calculado, ver utils.histogram) corresponder à
+    imagem, aplica a LUT diretamente, sem percorrer a imagem para
+    calcular o histograma.
+    """
+    if histogram_matches(pil_image, histogram):
+        lut = equalize_lut(histogram)
+        return apply_lut(pil_image, lut), map_histogram(histogram, lut)
+    return ImageOps.equalize(pil_image), None
+
 
 def autocontrast(pil_image: PIL.Image, cutoff: int = 15,
                  colorize=False, equalize=False,
-                 cv2=False) -> PIL.Image:
+                 cv2=False, histogram: list = None) -> PIL.Image:
     if equalize:
-        pil_image = ImageOps.equalize(pil_image)
+        pil_image, histogram = _equalize(pil_image, histogram)
     if cv2:
         pil_image = enhancedcontrast_cv2(pil_image)
     elif cutoff > 0.:
-        pil_image = ImageOps.autocontrast(pil_image, cutoff=cutoff)
+        if histogram_matches(pil_image, histogram):
+            pil_image = apply_lut(pil_image,
+                                  autocontrast_lut(histogram, cutoff))
+        else:
+            pil_image = ImageOps.autocontrast(pil_image, cutoff=cutoff)
     if colorize:
         pil_image = pil_image.convert('L')
         pil_image = ImageOps.colorize(pil_image, 'magenta', 'darkblue')
     return pil_image
 
 
-def equalize(pil_image: PIL.Image) -> PIL.Image:
-    return ImageOps.equalize(pil_image)
+def equalize(pil_image: PIL.Image, histogram: list = None) -> PIL.Image:
+    return _equalize(pil_image, histogram)[0]
 
 
-def expand_tocolor(pil_image: PIL.Image,
-                   alpha: float = 1.2,
-                   beta: float = 1.0,
-                   equalize: bool = True) -> PIL.Image:
-    if equalize:
-        pil_image = ImageOps.equalize(pil_image)
+@lru_cache(maxsize=32)
+def expand_tocolor_lut(alpha: float = 1.2, beta: float = 1.0) -> np.ndarray:
+    """Tabela (256, 3) RGB de expand_tocolor para cada nível de cinza.
 
-    pil_image = pil_image.convert('L')
-    imgarray = np.asarray(pil_image)
-    # gray = np.array((imgarray[:, :,  0] * 3. * alpha) ** beta, dtype=np.float32)
-    gray = np.array((imgarray * 3. * alpha) ** beta, dtype=np.float32)
+    Como a entrada é cinza de 8 bits, o mapeamento inteiro cabe em 256
+    entradas por canal. As operações são as mesmas (e nos mesmos tipos)
+    da versão que trabalhava sobre a imagem inteira, então o resultado é
+    idêntico. Cacheada por (alpha, beta); a tabela é somente leitura.
+    """
+    levels = np.arange(256, dtype=np.uint8)
+    gray = np.array((levels * 3. * alpha) ** beta, dtype=np.float32)
     enhanced_B = gray.copy()
     enhanced_B[enhanced_B > 254] = 254
     enhanced_G = (gray - 250)
@@ -42,18 +75,231 @@ def expand_tocolor(pil_image: PIL.Image,
     enhanced_R = (gray - 510)
     enhanced_R[enhanced_R <= 20] = 20
     enhanced_R[enhanced_R > 254] = 254
-    enhanced_RGB = np.dstack((enhanced_R, enhanced_G, enhanced_B)).astype(np.uint8)
+    lut = np.stack((enhanced_R, enhanced_G, enhanced_B),
+                   axis=-1).astype(np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+
+def expand_tocolor(pil_image: PIL.Image,
+                   alpha: float = 1.2,
+                   beta: float = 1.0,
+                   equalize: bool = True,
+                   histogram: list = None) -> PIL.Image:
+    if equalize:
+        pil_image, _ = _equalize(pil_image, histogram)
+
+    pil_image = pil_image.convert('L')
+    imgarray = np.asarray(pil_image)
+    lut = expand_tocolor_lut(alpha, beta)
+    enhanced_RGB = np.empty(imgarray.shape + (3,), dtype=np.uint8)
+    np.take(lut, imgarray, axis=0, out=enhanced_RGB)
     enhanced_color = PIL.Image.fromarray(enhanced_RGB)
     return enhanced_color
 
 
-def enhancedcontrast_cv2(pil_image: PIL.Image) -> PIL.Image:
-    opencvImage = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
-    # CLAHE (Contrast Limited Adaptive Histogram Equalization)
-    clahe = cv2.createCLAHE(clipLimit=3., tileGridSize=(8, 8))
-    lab = cv2.cvtColor(opencvImage, cv2.COLOR_BGR2LAB)  # convert from BGR to LAB color space
+_clahe_local = threading.local()
+
+
+def get_clahe(clip_limit: float = 3., tile_grid_size: tuple = (8, 8)):
+    """Retorna objeto CLAHE do OpenCV cacheado por (clip_limit, tile).
+
+    O cache é por thread, pois o objeto guarda buffers internos e não deve
+    ser compartilhado entre threads.
+    """
+    cache = getattr(_clahe_local, 'cache', None)
+    if cache is None:
+        cache = _clahe_local.cache = {}
+    key = (clip_limit, tuple(tile_grid_size))
+    clahe = cache.get(key)
+    if clahe is None:
+        clahe = cv2.createCLAHE(clipLimit=clip_limit,
+                                tileGridSize=tuple(tile_grid_size))
+        cache[key] = clahe
+    return clahe
+
+
+def grayscale_array(pil_image: PIL.Image):
+    """Retorna array 2D se a imagem for (efetivamente) cinza, senão None.
+
+    Imagens 'L' são cinza; imagens RGB são consideradas cinza se os três
+    canais forem iguais (caso comum em imagens de escâner gravadas em RGB).
+    """
+    if pil_image.mode == 'L':
+        return np.asarray(pil_image)
+    if pil_image.mode == 'RGB':
+        array = np.asarray(pil_image)
+        red = array[:, :, 0]
+        if np.array_equal(red, array[:, :, 1]) and \
+                np.array_equal(red, array[:, :, 2]):
+            return np.ascontiguousarray(red)
+    return None
+
+
+def enhancedcontrast_cv2(pil_image: PIL.Image,
+                         clip_limit: float = 3.,
+                         tile_grid_size: tuple = (8, 8)) -> PIL.Image:
+    """CLAHE (Contrast Limited Adaptive Histogram Equalization).
+
+    Imagens cinza recebem CLAHE diretamente no único canal (retorna imagem
+    'L'). Imagens coloridas recebem CLAHE no canal L do espaço LAB e
+    voltam para RGB.
+    """
+    clahe = get_clahe(clip_limit, tile_grid_size)
+    gray = grayscale_array(pil_image)
+    if gray is not None:
+        return PIL.Image.fromarray(clahe.apply(gray))
+    if pil_image.mode != 'RGB':
+        pil_image = pil_image.convert('RGB')
+    lab = cv2.cvtColor(np.asarray(pil_image), cv2.COLOR_RGB2LAB)
     l, a, b = cv2.split(lab)  # split on 3 different channels
     l2 = clahe.apply(l)  # apply CLAHE to the L-channel
     lab = cv2.merge((l2, a, b))  # merge channels
-    new_img = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)  # convert from LAB to BGR
+    new_img = cv2.cvtColor(lab, cv2.COLOR_LAB2RGB)  # convert from LAB to RGB
     return PIL.Image.fromarray(new_img)
+
+
+# Perfis de realce nomeados, utilizáveis em enhance_bytes/enhance_batch
+PROFILES = {
+    'autocontrast': autocontrast,
+    'colorize': partial(autocontrast, colorize=True),
+    'cv2': partial(autocontrast, cv2=True),
+    'equalize': equalize,
+    'expand_tocolor': expand_tocolor,
+}
+
+
+def enhance_bytes(image_bytes: bytes, profile: str = 'autocontrast') -> bytes:
+    """Decodifica imagem, aplica perfil de realce e codifica em JPEG."""
+    pil_image = PIL.Image.open(io.BytesIO(image_bytes))
+    pil_image = PROFILES[profile](pil_image)
+    out = io.BytesIO()
+    pil_image.save(out, 'JPEG')
+    return out.getvalue()
+
+
+def _enhance_chunk(chunk, profile):
+    """Executado nos processos de enhance_batch. None se imagem inválida."""
+    result = []
+    for image_bytes in chunk:
+        try:
+            result.append(enhance_bytes(image_bytes, profile))
+        except (OSError, TypeError, ValueError):
+            result.append(None)
+    return result
+
+
+def _chunks(iterable, chunksize, loader=None):
+    chunk = []
+    for item in iterable:
+        chunk.append(loader(item) if loader else item)
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def enhance_batch(images, profile: str = 'autocontrast', processes=None,
+                  chunksize: int = 16, ordered: bool = True,
+                  loader=None, max_pending=None):
+    """Aplica perfil de realce a muitas imagens, usando todos os núcleos.
+
+    Decodificação, realce e codificação rodam em um pool de processos,
+    com envio em blocos de chunksize imagens. No máximo max_pending blocos
+    (padrão: 2 por processo) ficam em andamento, então a memória não cresce
+    com o tamanho da entrada.
+
+    Args:
+        images: iterável de imagens em bytes, ou de ids se loader for passado
+        profile: nome do perfil em PROFILES
+        processes: número de processos (padrão: número de CPUs)
+        chunksize: imagens por tarefa enviada ao pool
+        ordered: se True, resultados na ordem da entrada; se False, à medida
+            que ficam prontos
+        loader: função id -> bytes, executada neste processo
+            (ex: functools.partial(images.mongo_image, db))
+
+    Yields:
+        (índice na entrada, imagem realçada em bytes JPEG ou None)
+
+    """
+    if profile not in PROFILES:
+        raise ValueError('Perfil %s inválido. Disponíveis: %s' %
+                         (profile, sorted(PROFILES)))
+    processes = processes or os.cpu_count() or 1
+    if max_pending is None:
+        max_pending = 2 * processes
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        pending = deque() if ordered else {}
+
+        def drain():
+            if ordered:
+                start, future = pending.popleft()
+                done = [(start, future)]
+            else:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                done = [(pending.pop(future), future) for future in finished]
+            for start, future in done:
+                for index, result in enumerate(future.result(), start):
+                    yield index, result
+
+        start = 0
+        for chunk in _chunks(images, chunksize, loader):
+            future = executor.submit(_enhance_chunk, chunk, profile)
+            if ordered:
+                pending.append((start, future))
+            else:
+                pending[future] = start
+            start += len(chunk)
+            while len(pending) >= max_pending:
+                yield from drain()
+        while pending:
+            yield from drain()
+
+
+# Funções memoizáveis por cached_enhance
+FUNCTIONS = {
+    'autocontrast': autocontrast,
+    'enhancedcontrast_cv2': enhancedcontrast_cv2,
+    'equalize': equalize,
+    'expand_tocolor': expand_tocolor,
+}
+
+# Para compartilhar entre processos, atribuir enhance_cache.redisdb
+# (ex: ajna_commons.flask.conf.redisdb)
+enhance_cache = TwoLevelCache(LRUCache(max_bytes=ENHANCE_CACHE_BYTES),
+                              prefix='ajna:enhance:')
+
+
+def cached_enhance(image_bytes: bytes, function: str = 'autocontrast',
+                   digest: str = None, cache=enhance_cache, **params) -> bytes:
+    """Versão memoizada das funções de realce, retornando JPEG em bytes.
+
+    A chave é (digest do conteúdo, função, parâmetros). Em um acerto, a
+    imagem não é decodificada nem realçada. Se o digest do conteúdo já for
+    conhecido (ex: campo md5 do GridFS), pode ser passado em digest para
+    evitar o cálculo. Estatísticas em cache.info().
+
+    Ex: cached_enhance(image, 'autocontrast', cutoff=10, colorize=True)
+
+    Um histograma pré-calculado pode ser passado em params (histogram=...);
+    ele não faz parte da chave, pois é derivado do próprio conteúdo.
+    """
+    if function not in FUNCTIONS:
+        raise ValueError('Função %s inválida. Disponíveis: %s' %
+                         (function, sorted(FUNCTIONS)))
+    if digest is None:
+        digest = md5(image_bytes).hexdigest()
+    key = (digest, function, tuple(sorted(
+        (name, value) for name, value in params.items()
+        if name != 'histogram')))
+    result = cache.get(key)
+    if result is None:
+        pil_image = PIL.Image.open(io.BytesIO(image_bytes))
+        pil_image = FUNCTIONS[function](pil_image, **params)
+        out = io.BytesIO()
+        pil_image.save(out, 'JPEG')
+        result = out.getvalue()
+        cache.set(key, result)
+    return result
@@ -1,40 +1,467 @@
+import base64
+import operator
+import os
+import threading
+import time
 from collections import OrderedDict
+from datetime import datetime
+from decimal import Decimal
+from functools import lru_cache
+from operator import itemgetter
 
 from dateutil import parser
-from flask import current_app, jsonify
+from flask import (Response, current_app, json, jsonify, request,
+                   stream_with_context)
 from ruamel import yaml
-from sqlalchemy import select, and_
+from sqlalchemy import (Table, UniqueConstraint, and_, bindparam, func, or_,
+                        select)
+from sqlalchemy import inspect as sa_inspect
 from sqlalchemy.engine import RowProxy
 from sqlalchemy.orm.attributes import InstrumentedAttribute
 
+from ajna_commons.utils import timing
+from ajna_commons.utils.cache import CacheStats, LRUCache, TwoLevelCache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Linhas buscadas do cursor (e serializadas) por vez nas respostas em stream
+STREAM_CHUNK_ROWS = 1000
+NDJSON_MIMETYPE = 'application/x-ndjson'
+# Paginação por chave (keyset): colunas de ordenação e tamanho máximo
+KEYSET_COLUMNS = ('last_modified', 'id')
+PAGE_SIZE_MAX = 5000
+PAGE_ARGS = ('page_size', 'cursor')
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+# Sufixos de parâmetro de consulta para filtros de intervalo (ex: id__gte=5)
+RANGE_OPERATORS = OrderedDict([('__gte', operator.ge),
+                               ('__lte', operator.le),
+                               ('__gt', operator.gt),
+                               ('__lt', operator.lt)])
+# Política para filtros sem coluna indexada: 'allow', 'warn' ou 'refuse'
+# (app.config['API_FULLSCAN']); app.config['API_EXPLAIN'] = True confere
+# também o plano do banco (MySQL e SQLite)
+FULLSCAN_POLICIES = ('allow', 'warn', 'refuse')
+# Statements com bindparams por (tabela, campos) e sua compilação por dialeto
+STATEMENT_CACHE_ITEMS = 512
+statement_cache = LRUCache(max_items=STATEMENT_CACHE_ITEMS)
+compiled_cache = LRUCache(max_items=STATEMENT_CACHE_ITEMS)
+# Cache de respostas de get_datamodificacao_gt e get_filtro, ativado por
+# app.config['API_RESULT_CACHE'] = True. A versão da tabela (max de
+# last_modified) é consultada no máximo a cada RESULT_VERSION_TTL segundos.
+# Para compartilhar entre processos, atribuir result_cache.redisdb
+# (ex: ajna_commons.flask.conf.redisdb)
+RESULT_CACHE_BYTES = int(os.environ.get('API_RESULT_CACHE_BYTES',
+                                        64 * 1024 * 1024))
+RESULT_VERSION_TTL = float(os.environ.get('API_RESULT_VERSION_TTL', 5))
+
 
 def exclude_from_dict(dict, exclude: list = None):
     if exclude:
         for key in exclude:
-            if dict.get(key):
-                dict.pop(key)
+            dict.pop(key, None)
+
+
+@lru_cache(maxsize=1024)
+def _dump_plan(keys: tuple, exclude: tuple) -> tuple:
+    # str(): nomes de colunas podem ser subclasses de str (quoted_name)
+    return tuple((ind, str(key)) for ind, key in enumerate(keys)
+                 if not key.startswith('_') and key not in exclude)
+
+
+def dump_plan(keys, exclude: list = None) -> tuple:
+    """Pares (posição, nome) das colunas a serializar.
+
+    Calculado uma vez por combinação de colunas e exclude: descarta nomes
+    iniciados por '_' e os nomes em exclude.
+    """
+    return _dump_plan(tuple(keys), tuple(exclude) if exclude else ())
 
 
 def dump_rowproxy(rowproxy: RowProxy, exclude: list = None):
-    dump = dict([(k, v) for k, v in rowproxy.items() if not k.startswith('_')])
-    exclude_from_dict(dump, exclude)
-    return dump
+    plan = dump_plan(rowproxy.keys(), exclude)
+    return {key: rowproxy[ind] for ind, key in plan}
+
+
+def _empty_tuple(row):
+    return ()
+
+
+def dump_rows(rows, exclude: list = None, as_tuple=False):
+    """Gerador que serializa linhas de um resultado com um único plano.
+
+    Args:
+        rows: iterável de RowProxy (todas com as mesmas colunas)
+        exclude: nomes de colunas a omitir
+        as_tuple: se True, gera tuplas de valores na ordem de
+            dump_columns em vez de dicionários
+
+    """
+    plan = None
+    for row in rows:
+        if plan is None:
+            plan = dump_plan(row.keys(), exclude)
+            if plan:
+                getter = itemgetter(*[ind for ind, _ in plan])
+            else:  # Todas as colunas excluídas
+                getter = _empty_tuple
+            single = len(plan) == 1
+        if as_tuple:
+            yield (getter(row), ) if single else getter(row)
+        else:
+            yield {key: row[ind] for ind, key in plan}
+
+
+def dump_columns(keys, exclude: list = None) -> list:
+    """Nomes das colunas na ordem gerada por dump_rows(as_tuple=True)."""
+    return [key for _, key in dump_plan(keys, exclude)]
 
 
 def dump_model(model, exclude: list = None):
-    dump = dict([(k, v) for k, v in vars(model).items() if not k.startswith('_')])
-    print(dump)
-    exclude_from_dict(dump, exclude)
-    return dump
+    attrs = vars(model)
+    plan = dump_plan(attrs, exclude)
+    values = list(attrs.values())
+    return {key: values[ind] for ind, key in plan}
+
+
+def _orjson_default(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError
+
+
+def json_dumps(obj) -> str:
+    """Serializa com orjson se configurado (app.config['API_ORJSON']).
+
+    orjson grava datas no formato ISO 8601, enquanto jsonify usa o formato
+    HTTP, por isso o uso é opcional. Sem orjson instalado usa flask.json.
+    """
+    if orjson is not None and current_app.config.get('API_ORJSON'):
+        return orjson.dumps(obj, default=_orjson_default).decode('utf-8')
+    return json.dumps(obj)
+
+
+def json_response(obj, status=200, headers=None):
+    """Equivalente a jsonify que usa orjson se configurado."""
+    if orjson is not None and current_app.config.get('API_ORJSON'):
+        response = Response(orjson.dumps(obj, default=_orjson_default),
+                            mimetype='application/json')
+    else:
+        response = jsonify(obj)
+    return response, status, headers or {}
+
+
+def encode_cursor(row, names=KEYSET_COLUMNS) -> str:
+    """Token opaco de continuação a partir da última linha de uma página."""
+    values = {}
+    for name in names:
+        value = getattr(row, name)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        values[name] = value
+    return base64.urlsafe_b64encode(
+        json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(token: str) -> dict:
+    """Valores das colunas de ordenação contidos no token.
+
+    Raises:
+        ValueError: token inválido
+
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+    except Exception as err:
+        raise ValueError('Cursor inválido: %s' % err)
+    if not isinstance(values, dict):
+        raise ValueError('Cursor inválido')
+    if values.get('last_modified'):
+        values['last_modified'] = parser.parse(values['last_modified'])
+    return values
+
+
+def keyset_columns(source) -> list:
+    """Pares (nome, coluna) de KEYSET_COLUMNS existentes na Table/modelo."""
+    if isinstance(source, Table):
+        columns = [(name, source.c[name]) for name in KEYSET_COLUMNS
+                   if name in source.c]
+    else:
+        columns = [(name, getattr(source, name)) for name in KEYSET_COLUMNS
+                   if hasattr(source, name)]
+    if not columns:
+        raise ValueError('%s não possui colunas para paginação %s' %
+                         (source, KEYSET_COLUMNS))
+    return columns
+
+
+def _nullable(column) -> bool:
+    if isinstance(column, InstrumentedAttribute):
+        column = column.property.columns[0]
+    return bool(getattr(column, 'nullable', False))
+
+
+def _greater(column, value):
+    """column > value, com NULL antes de qualquer valor (ver keyset_order)."""
+    if not _nullable(column):
+        return column > value
+    return or_(and_(value.is_(None), column.isnot(None)), column > value)
+
+
+def _equal(column, value):
+    """column == value, com NULL igual a NULL."""
+    if not _nullable(column):
+        return column == value
+    return or_(column == value, and_(column.is_(None), value.is_(None)))
+
+
+def keyset_order(columns) -> list:
+    """Ordenação das colunas de paginação, com NULL antes dos valores.
+
+    Colunas que aceitam NULL (ex: last_modified de registros antigos) são
+    precedidas de "coluna IS NOT NULL", de forma que a ordem (e a condição
+    de keyset_condition) não depende de como cada BD ordena NULLs.
+    """
+    order = []
+    for _, column in columns:
+        if _nullable(column):
+            order.append(column.isnot(None))
+        order.append(column)
+    return order
+
+
+def keyset_condition(columns, values):
+    """Condição "linha > cursor" na ordem das colunas.
+
+    Ex: (last_modified, id) > (lm, oid) vira
+    last_modified > lm OR (last_modified == lm AND id > oid).
+    Em colunas que aceitam NULL as comparações tratam NULL como menor que
+    qualquer valor e igual a NULL. values deve conter bindparams ou
+    literais (ver _bound).
+    """
+    condicoes = []
+    for ind, (name, column) in enumerate(columns):
+        anteriores = [_equal(col, values[nome])
+                      for nome, col in columns[:ind]]
+        condicoes.append(and_(*anteriores, _greater(column, values[name])))
+    return or_(*condicoes)
+
+
+def _bound(columns, cursor=None):
+    """Valores do cursor como bindparams tipados (cursor=None: sem valor)."""
+    return {name: bindparam('cursor_' + name,
+                            None if cursor is None else cursor[name],
+                            type_=column.type)
+            for name, column in columns}
+
+
+def check_cursor(cursor: dict, source):
+    """Confere se o cursor tem valores simples para as colunas de source.
+
+    Raises:
+        ValueError: cursor inválido para source
+
+    """
+    for name, _ in keyset_columns(source):
+        if name not in cursor:
+            raise ValueError('Cursor inválido: falta %s' % name)
+        if not isinstance(cursor[name], (str, int, float, datetime,
+                                         type(None))):
+            raise ValueError('Cursor inválido: %s' % name)
+
+
+def page_args(uri_query=None, page_size=None, cursor=None, source=None):
+    """Separa parâmetros de paginação (page_size, cursor) da consulta.
+
+    Se não forem passados explicitamente, são lidos de uri_query (que
+    costuma ser request.args). Retorna (uri_query sem eles, page_size,
+    cursor decodificado ou None). Se source (Table ou modelo) for
+    passado, o cursor é conferido com check_cursor.
+
+    Raises:
+        ValueError: page_size ou cursor inválidos
+
+    """
+    if uri_query is not None:
+        uri_query = dict(uri_query.items())
+        if page_size is None:
+            page_size = uri_query.get('page_size')
+        if cursor is None:
+            cursor = uri_query.get('cursor')
+        for key in PAGE_ARGS:
+            uri_query.pop(key, None)
+    if page_size is not None:
+        page_size = int(page_size)
+        if page_size <= 0:
+            raise ValueError('page_size deve ser positivo')
+        page_size = min(page_size, PAGE_SIZE_MAX)
+    elif cursor:
+        page_size = PAGE_SIZE_MAX
+    if cursor:
+        cursor = decode_cursor(cursor)
+        if source is not None:
+            check_cursor(cursor, source)
+    return uri_query, page_size, cursor or None
+
+
+def paginate_select(s, table, page_size, cursor):
+    """Aplica ordenação, condição de cursor e limite a um select."""
+    if not page_size:
+        return s
+    columns = keyset_columns(table)
+    if cursor:
+        s = s.where(keyset_condition(columns, _bound(columns, cursor)))
+    return s.order_by(*keyset_order(columns)).limit(page_size)
+
+
+def paginate_query(query, model, page_size, cursor):
+    """Aplica ordenação, condição de cursor e limite a uma Query ORM."""
+    if not page_size:
+        return query
+    columns = keyset_columns(model)
+    if cursor:
+        query = query.filter(keyset_condition(columns,
+                                              _bound(columns, cursor)))
+    return query.order_by(*keyset_order(columns)).limit(page_size)
+
+
+def page_headers(rows, source, page_size):
+    """Cabeçalho com o cursor da próxima página, se a página veio cheia."""
+    if not page_size or len(rows) < page_size:
+        return {}
+    names = [name for name, _ in keyset_columns(source)]
+    return {NEXT_CURSOR_HEADER: encode_cursor(rows[-1], names)}
+
+
+def cached_statement(key, build):
+    """Retorna statement da chave, chamando build() somente na primeira vez.
+
+    Os statements devem usar bindparams para os valores, de forma que o
+    mesmo objeto (e sua compilação em compiled_cache) sirva a todos os
+    pedidos com os mesmos campos.
+    """
+    statement = statement_cache.get(key)
+    if statement is None:
+        statement = build()
+        statement_cache.set(key, statement)
+    return statement
+
+
+def execute_cached(conn, statement, params, **options):
+    """Executa statement reaproveitando a compilação de compiled_cache."""
+    with timing.db_timer():
+        return conn.execution_options(compiled_cache=compiled_cache,
+                                      **options).execute(statement, params)
+
+
+def paginate_bound(s, table, page_size, cursor):
+    """Como paginate_select, mas com bindparams (ver page_params)."""
+    if not page_size:
+        return s
+    columns = keyset_columns(table)
+    if cursor:
+        s = s.where(keyset_condition(columns, _bound(columns)))
+    return s.order_by(*keyset_order(columns)).limit(
+        bindparam('page_size'))
+
+
+def page_params(table, page_size, cursor) -> dict:
+    """Valores dos bindparams de paginate_bound."""
+    params = {}
+    if page_size:
+        params['page_size'] = page_size
+    if cursor:
+        for name, _ in keyset_columns(table):
+            params['cursor_' + name] = cursor[name]
+    return params
+
+
+def _sizeof_result(value):
+    return len(value[0])
+
+
+result_cache = TwoLevelCache(LRUCache(max_bytes=RESULT_CACHE_BYTES,
+                                      sizeof=_sizeof_result),
+                             prefix='ajna:api:')
+version_stats = CacheStats()
+_table_versions = {}
+_table_versions_lock = threading.Lock()
+
+
+def table_version(engine, table) -> str:
+    """Versão da tabela: max(last_modified), guardado por RESULT_VERSION_TTL.
+
+    Exclusões de linhas não alteram a versão; o cache só é invalidado por
+    inclusões e alterações (que atualizam last_modified).
+    """
+    key = (engine.url.host, engine.url.database, table.name)
+    now = time.time()
+    with _table_versions_lock:
+        expires, version = _table_versions.get(key, (0, None))
+    if expires > now:
+        version_stats.hits += 1
+        return version
+    version_stats.misses += 1
+    with engine.connect() as conn, timing.db_timer():
+        version = conn.execute(
+            select([func.max(table.c.last_modified)])).scalar()
+    version = str(version)
+    with _table_versions_lock:
+        _table_versions[key] = (now + RESULT_VERSION_TTL, version)
+    return version
+
+
+def cached_result(table, key, consulta):
+    """Resposta de consulta() guardada em result_cache.
+
+    Args:
+        table: Table consultada (precisa de last_modified)
+        key: tupla que identifica a consulta normalizada
+        consulta: função que retorna a resposta (response, status[, headers])
+
+    Somente respostas 200 são guardadas (corpo e cabeçalhos).
+    """
+    if not current_app.config.get('API_RESULT_CACHE') or \
+            'last_modified' not in table.c:
+        return consulta()
+    engine = current_app.config['sql']
+    key = (engine.url.host, engine.url.database, table.name,
+           table_version(engine, table)) + key
+    cached = result_cache.get(key)
+    timing.add_cache(cached is not None)
+    if cached is not None:
+        body, headers = cached
+        return Response(body, mimetype='application/json'), 200, headers
+    resposta = consulta()
+    if resposta[1] == 200:
+        headers = resposta[2] if len(resposta) > 2 else {}
+        result_cache.set(key, (resposta[0].get_data(), headers))
+    return resposta
+
+
+def result_cache_info() -> dict:
+    """Taxas de acerto do cache de respostas e do cache de versões."""
+    info = result_cache.info()
+    info['versions'] = version_stats.as_dict()
+    return info
+
+
+def _normalize(values) -> tuple:
+    if not values:
+        return ()
+    return tuple(sorted((key, str(value)) for key, value in values.items()))
 
 
 def select_one_from_class(table, campo, valor):
     engine = current_app.config['sql']
     try:
-        with engine.begin() as conn:
-            s = select([table]).where(
-                campo == valor)
-            result = conn.execute(s).fetchone()
+        s = cached_statement(
+            (table, 'one', str(campo)),
+            lambda: select([table]).where(campo == bindparam('valor')))
+        with engine.connect() as conn:
+            result = execute_cached(conn, s, {'valor': valor}).fetchone()
         if result:
             return jsonify(dump_rowproxy(result)), 200
         else:
@@ -44,112 +471,450 @@ def select_one_from_class(table, campo, valor):
         return jsonify({'msg': 'Erro inesperado: %s' % str(err)}), 400
 
 
-def select_many_from_class(table, campo, valor):
+def select_many_from_class(table, campo, valor, page_size=None, cursor=None):
     engine = current_app.config['sql']
     try:
-        with engine.begin() as conn:
-            s = select([table]).where(
-                campo == valor)
-            print(campo, valor)
-            result = conn.execute(s)
+        _, page_size, cursor = page_args(None, page_size, cursor, table)
+    except ValueError as err:
+        return jsonify({'msg': 'Erro no parâmetro: %s' % str(err)}), 400
+    try:
+        s = cached_statement(
+            (table, 'many', str(campo), bool(page_size), bool(cursor)),
+            lambda: paginate_bound(
+                select([table]).where(campo == bindparam('valor')),
+                table, page_size, cursor))
+        params = page_params(table, page_size, cursor)
+        params['valor'] = valor
+        with engine.connect() as conn:
+            result = execute_cached(conn, s, params)
             if result:
-                resultados = [dump_rowproxy(row) for row in result]
+                with timing.db_timer(queries=0):
+                    rows = result.fetchall()
+                resultados = list(dump_rows(rows))
                 if resultados and len(resultados) > 0:
-                    return jsonify(resultados), 200
+                    return json_response(
+                        resultados, 200, page_headers(rows, table, page_size))
             return jsonify({'msg': '%s Não encontrado' % table.name}), 404
     except Exception as err:
         current_app.logger.error(err, exc_info=True)
         return jsonify({'msg': 'Erro inesperado: %s' % str(err)}), 400
 
 
-def return_many_from_resultproxy(result):
+def return_many_from_resultproxy(result, table=None, page_size=None):
     resultados = None
     if result:
-        resultados = [dump_rowproxy(row) for row in result]
+        with timing.db_timer(queries=0):
+            rows = result.fetchall()
+        resultados = list(dump_rows(rows))
     if resultados and len(resultados) > 0:
-        print(len(resultados))
-        return jsonify(resultados), 200
+        return json_response(resultados, 200,
+                             page_headers(rows, table, page_size))
+    else:
+        return jsonify({'msg': 'Não encontrado'}), 404
+
+
+def ndjson_requested():
+    """True se o cliente pediu NDJSON (Accept ou ?formato=ndjson)."""
+    if request.args.get('formato') == 'ndjson':
+        return True
+    return request.accept_mimetypes.best_match(
+        ['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def _stream_json(first, chunks, dump, ndjson):
+    """Gerador de texto JSON (array ou NDJSON), um lote de linhas por vez."""
+    if ndjson:
+        yield json_dumps(dump(first)) + '\n'
+        for chunk in chunks:
+            yield ''.join(json_dumps(dump(row)) + '\n' for row in chunk)
     else:
+        yield '[' + json_dumps(dump(first))
+        for chunk in chunks:
+            yield ''.join(',' + json_dumps(dump(row)) for row in chunk)
+        yield ']'
+
+
+def stream_response(first, chunks, dump, ndjson=None, close=None):
+    """Response que serializa as linhas à medida que são lidas do cursor.
+
+    Args:
+        first: primeira linha (None = 404)
+        chunks: iterável de listas com as linhas restantes
+        dump: função que converte uma linha em dict
+        ndjson: True para NDJSON, False para array JSON, None = conforme
+            pedido pelo cliente (ver ndjson_requested)
+        close: função chamada ao fim do stream (ex: fechar conexão)
+
+    close é chamada uma única vez: ao fim do envio ou, se o corpo não
+    chegar a ser percorrido (ex: cliente desconectou antes do primeiro
+    lote), quando o servidor WSGI fecha a resposta (call_on_close).
+    """
+    if first is None:
+        if close:
+            close()
         return jsonify({'msg': 'Não encontrado'}), 404
+    if ndjson is None:
+        ndjson = ndjson_requested()
+    closed = []
+
+    def close_once():
+        if close and not closed:
+            closed.append(True)
+            close()
+
+    def generate():
+        try:
+            yield from _stream_json(first, chunks, dump, ndjson)
+        finally:
+            close_once()
+
+    mimetype = NDJSON_MIMETYPE if ndjson else 'application/json'
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.call_on_close(close_once)
+    return response, 200
+
+
+def _fetch_chunks(result, size=STREAM_CHUNK_ROWS):
+    while True:
+        with timing.db_timer(queries=0):
+            chunk = result.fetchmany(size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def stream_many_from_select(engine, s, ndjson=None, params=None):
+    """Executa select com cursor no servidor e devolve Response em stream.
+
+    A conexão permanece aberta até o fim do envio da resposta (ou até o
+    fechamento da resposta, ver stream_response).
+    """
+    conn = engine.connect()
+    try:
+        result = execute_cached(conn, s, params or {}, stream_results=True)
+        first = result.fetchone()
+    except Exception:
+        conn.close()
+        raise
+    if first is not None:
+        first = dump_rowproxy(first)
+    chunks = (dump_rows(chunk) for chunk in _fetch_chunks(result))
+    return stream_response(first, chunks, _identity, ndjson,
+                           close=conn.close)
+
+
+def _identity(item):
+    return item
+
+
+def _dump_alchemy(item):
+    return item.dump(explode=False)
 
 
-def get_datamodificacao_gt(table, datamodificacao):
+def stream_many_from_query(query, ndjson=None):
+    """Devolve Response em stream de uma Query ORM (usa yield_per)."""
+    rows = iter(query.yield_per(STREAM_CHUNK_ROWS))
+    first = next(rows, None)
+
+    def chunks():
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= STREAM_CHUNK_ROWS:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    return stream_response(first, chunks(), _dump_alchemy, ndjson)
+
+
+def get_datamodificacao_gt(table, datamodificacao, stream=False,
+                           page_size=None, cursor=None):
     engine = current_app.config['sql']
     try:
         datamodificacao = parser.parse(datamodificacao)
-        print(datamodificacao)
+        _, page_size, cursor = page_args(None, page_size, cursor, table)
     except Exception as err:
         current_app.logger.error(err, exc_info=True)
         return jsonify({'msg': 'Erro no parâmetro: %s' % str(err)}), 400
     try:
-        with engine.begin() as conn:
-            s = select([table]).where(
-                table.c.last_modified >= datamodificacao)
-            result = conn.execute(s)
-            return return_many_from_resultproxy(result)
+        s = cached_statement(
+            (table, 'datamodificacao', bool(page_size), bool(cursor)),
+            lambda: paginate_bound(
+                select([table]).where(
+                    table.c.last_modified >= bindparam('datamodificacao')),
+                table, page_size, cursor))
+        params = page_params(table, page_size, cursor)
+        params['datamodificacao'] = datamodificacao
+        if stream and not page_size:
+            return stream_many_from_select(engine, s, params=params)
+
+        def consulta():
+            with engine.connect() as conn:
+                result = execute_cached(conn, s, params)
+                return return_many_from_resultproxy(result, table, page_size)
+
+        return cached_result(
+            table, ('datamodificacao', datamodificacao.isoformat(),
+                    page_size, _normalize(cursor)), consulta)
     except Exception as err:
         current_app.logger.error(err, exc_info=True)
         return jsonify({'msg': 'Erro inesperado: %s' % str(err)}), 400
 
 
-def get_filtro(table, uri_query):
+def _table_of(source):
+    if isinstance(source, Table):
+        return source
+    return source.__table__
+
+
+@lru_cache(maxsize=256)
+def indexed_columns(table: Table) -> frozenset:
+    """Nomes das colunas que iniciam algum índice (inclusive chave primária).
+
+    Somente a primeira coluna de um índice composto permite busca pelo
+    índice sem as demais.
+    """
+    names = set()
+    primary = list(table.primary_key.columns)
+    if primary:
+        names.add(primary[0].name)
+    for index in table.indexes:
+        columns = list(index.columns)
+        if columns:
+            names.add(columns[0].name)
+    for constraint in table.constraints:
+        columns = list(constraint.columns)
+        if columns and isinstance(constraint, UniqueConstraint):
+            names.add(columns[0].name)
+    return frozenset(names)
+
+
+def _is_string(column):
+    try:
+        return column.type.python_type is str
+    except (AttributeError, NotImplementedError):
+        return False
+
+
+def _filter_column(source, campo):
+    """Expressão do campo e coluna correspondente da tabela (ou None).
+
+    Em modelos ORM, campo é o nome do atributo Python, que pode diferir do
+    nome da coluna. Synonyms levam à coluna do atributo alvo; demais
+    atributos ORM (ex: hybrid property) são aceitos, sem coluna.
+    """
+    if isinstance(source, Table):
+        if campo not in source.c:
+            raise KeyError('Campo %s não existe em %s' % (campo, source.name))
+        return source.c[campo], source.c[campo]
+    mapper = sa_inspect(source)
+    alvo = mapper.synonyms[campo].name if campo in mapper.synonyms else campo
+    if alvo in mapper.column_attrs:
+        return getattr(source, campo), mapper.column_attrs[alvo].columns[0]
+    if campo not in mapper.all_orm_descriptors:
+        raise KeyError('Campo %s não existe em %s' %
+                       (campo, source.__name__))
+    return getattr(source, campo), None
+
+
+def plan_filtro(source, uri_query: dict, prefix=True, bind=False):
+    """Monta condições planas e o plano de um filtro por parâmetros.
+
+    Para cada campo: sufixo de RANGE_OPERATORS vira intervalo, valor str
+    em coluna texto vira prefixo (LIKE 'valor%', que usa índice) se prefix,
+    e os demais viram igualdade (sem LIKE em colunas não texto, que impediria
+    o uso do índice).
+
+    Args:
+        source: Table ou modelo ORM
+        uri_query: dicionário {campo[__sufixo]: valor}
+        prefix: se False, usa igualdade também para colunas texto
+        bind: se True, as condições usam bindparams p0, p1... no lugar dos
+            valores (ver filtro_params)
+
+    Returns:
+        (lista de condições, lista de (campo, predicado, indexado))
+
+    """
+    table = _table_of(source)
+    indexed = indexed_columns(table)
+    condicoes = []
+    plano = []
+    for ind, (campo, valor) in enumerate(uri_query.items()):
+        comparacao = None
+        for sufixo, op in RANGE_OPERATORS.items():
+            if campo.endswith(sufixo):
+                campo = campo[:-len(sufixo)]
+                comparacao = op
+                break
+        expression, column = _filter_column(source, campo)
+        if comparacao is not None:
+            predicado = 'range'
+        elif prefix and isinstance(valor, str) and \
+                _is_string(expression if column is None else column):
+            predicado = 'prefix'
+        else:
+            predicado = 'eq'
+        indexado = column is not None and \
+            table.c.contains_column(column) and column.name in indexed
+        plano.append((campo, predicado, indexado))
+        if bind:
+            valor = bindparam('p%d' % ind)
+        elif predicado == 'prefix':
+            valor = valor + '%'
+        if comparacao is not None:
+            condicoes.append(comparacao(expression, valor))
+        elif predicado == 'prefix':
+            condicoes.append(expression.like(valor))
+        else:
+            condicoes.append(expression == valor)
+    return condicoes, plano
+
+
+def filtro_params(uri_query: dict, plano) -> dict:
+    """Valores dos bindparams de plan_filtro(bind=True)."""
+    return {'p%d' % ind: valor + '%' if predicado == 'prefix' else valor
+            for ind, (valor, (_, predicado, _)) in
+            enumerate(zip(uri_query.values(), plano))}
+
+
+def explain_fullscan(connection, statement, params=None):
+    """True se o banco planeja varrer a tabela inteira (MySQL e SQLite).
+
+    Retorna None para outros bancos.
+    """
+    dialect = connection.dialect
+    compiled = statement.compile(dialect=dialect)
+    params = compiled.construct_params(params)
+    if compiled.positional:
+        params = tuple(params[key] for key in compiled.positiontup)
+    if dialect.name == 'sqlite':
+        rows = connection.execute('EXPLAIN QUERY PLAN ' + str(compiled),
+                                  params).fetchall()
+        return any(row[-1].startswith('SCAN') and 'INDEX' not in row[-1]
+                   for row in rows)
+    if dialect.name == 'mysql':
+        rows = connection.execute('EXPLAIN ' + str(compiled),
+                                  params).fetchall()
+        return any(row['type'] == 'ALL' for row in rows)
+    return None
+
+
+def check_plan(connection, statement, source, plano, params=None):
+    """Aplica política API_FULLSCAN e registra tempo de planejamento.
+
+    Raises:
+        ValueError: consulta recusada por não usar índice
+
+    """
+    s0 = time.time()
+    policy = current_app.config.get('API_FULLSCAN', 'warn')
+    if policy not in FULLSCAN_POLICIES:
+        raise ValueError('API_FULLSCAN deve ser um de %s' %
+                         (FULLSCAN_POLICIES, ))
+    fullscan = bool(plano) and not any(indexado for _, _, indexado in plano)
+    if current_app.config.get('API_EXPLAIN'):
+        explain = explain_fullscan(connection, statement, params)
+        if explain is not None:
+            fullscan = explain
+    name = _table_of(source).name
+    current_app.logger.info('Plano %s %s: %s (%.1f ms)',
+                            name, plano, 'fullscan' if fullscan else 'índice',
+                            (time.time() - s0) * 1000)
+    if fullscan and policy != 'allow':
+        msg = 'Consulta em %s sem índice: %s' % (name, plano)
+        if policy == 'refuse':
+            raise ValueError(msg)
+        current_app.logger.warning(msg)
+
+
+def get_filtro(table, uri_query, page_size=None, cursor=None):
     engine = current_app.config['sql']
     try:
-        with engine.begin() as conn:
-            lista_condicoes = [table.c[campo] == valor
-                               for campo, valor in uri_query.items()]
-            print(uri_query.items())
-            print(lista_condicoes)
+        uri_query, page_size, cursor = page_args(uri_query, page_size,
+                                                 cursor, table)
+    except ValueError as err:
+        return jsonify({'msg': 'Erro no parâmetro: %s' % str(err)}), 400
+    try:
+        def build():
+            lista_condicoes, plano = plan_filtro(table, uri_query,
+                                                 prefix=False, bind=True)
             s = select([table]).where(and_(*lista_condicoes))
-            result = conn.execute(s)
-            return return_many_from_resultproxy(result)
+            return s, paginate_bound(s, table, page_size, cursor), plano
+
+        s, s_page, plano = cached_statement(
+            (table, 'filtro', tuple(uri_query), bool(page_size),
+             bool(cursor)), build)
+        params = filtro_params(uri_query, plano)
+
+        def consulta():
+            with engine.connect() as conn:
+                check_plan(conn, s, table, plano, params)
+                params.update(page_params(table, page_size, cursor))
+                result = execute_cached(conn, s_page, params)
+                return return_many_from_resultproxy(result, table, page_size)
+
+        return cached_result(
+            table, ('filtro', _normalize(uri_query), page_size,
+                    _normalize(cursor)), consulta)
     except Exception as err:
         current_app.logger.error(err, exc_info=True)
         return jsonify({'msg': 'Erro inesperado: %s' % str(err)}), 400
 
 
-def return_many_from_alchemy(result):
+def return_many_from_alchemy(result, model=None, page_size=None):
     resultados = None
     if result:
         resultados = [item.dump(explode=False) for item in result]
     if resultados and len(resultados) > 0:
-        print(len(resultados))
-        return jsonify(resultados), 200
+        return json_response(resultados, 200,
+                             page_headers(result, model, page_size))
     else:
         return jsonify({'msg': 'Não encontrado'}), 404
 
 
-def get_datamodificacao_gt_alchemy(model, datamodificacao):
+def get_datamodificacao_gt_alchemy(model, datamodificacao, stream=False,
+                                   page_size=None, cursor=None):
     db_session = current_app.config['db_session']
     try:
         datamodificacao = parser.parse(datamodificacao)
+        _, page_size, cursor = page_args(None, page_size, cursor, model)
     except Exception as err:
         current_app.logger.error(err, exc_info=True)
         return jsonify({'msg': 'Erro no parâmetro: %s' % str(err)}), 400
     try:
-        result = db_session.query(model).filter(
-            model.last_modified >= datamodificacao).all()
-        return return_many_from_alchemy(result)
+        query = db_session.query(model).filter(
+            model.last_modified >= datamodificacao)
+        if stream and not page_size:
+            return stream_many_from_query(query)
+        query = paginate_query(query, model, page_size, cursor)
+        with timing.db_timer():
+            result = query.all()
+        return return_many_from_alchemy(result, model, page_size)
     except Exception as err:
         current_app.logger.error(err, exc_info=True)
         return jsonify({'msg': 'Erro inesperado: %s' % str(err)}), 400
 
 
-def get_filtro_alchemy(model, uri_query):
+def get_filtro_alchemy(model, uri_query, page_size=None, cursor=None):
     db_session = current_app.config['db_session']
+    try:
+        uri_query, page_size, cursor = page_args(uri_query, page_size,
+                                                 cursor, model)
+    except ValueError as err:
+        return jsonify({'msg': 'Erro no parâmetro: %s' % str(err)}), 400
     try:
         if uri_query is None or not isinstance(uri_query, dict):
             raise KeyError('Necessário passar os argumentos da consulta!')
-        filtro = and_()
-        for campo, valor in uri_query.items():
-            if isinstance(valor, str):
-                filtro = and_(getattr(model, campo).like(valor + '%'), filtro)
-            else:
-                filtro = and_(getattr(model, campo) == valor, filtro)
-        # print(dict(uri_query))
-        # print('*********', filtro)
-        result = db_session.query(model).filter(filtro).all()
-        return return_many_from_alchemy(result)
+        lista_condicoes, plano = plan_filtro(model, uri_query)
+        query = db_session.query(model).filter(and_(*lista_condicoes))
+        check_plan(db_session.connection(), query.statement, model, plano)
+        query = paginate_query(query, model, page_size, cursor)
+        with timing.db_timer():
+            result = query.all()
+        return return_many_from_alchemy(result, model, page_size)
     except Exception as err:
         current_app.logger.error(err, exc_info=True)
         return jsonify({'msg': 'Erro inesperado: %s' % str(err)}), 400
@@ -157,7 +922,9 @@ def get_filtro_alchemy(model, uri_query):
 
 def select_one_campo_alchemy(session, model, campo, oid):
     try:
-        result = session.query(model).filter(campo == oid).one_or_none()
+        with timing.db_timer():
+            result = session.query(model).filter(
+                campo == oid).one_or_none()
         if result:
             return jsonify(result.dump()), 200
         else:
@@ -167,11 +934,21 @@ def select_one_campo_alchemy(session, model, campo, oid):
         return jsonify({'msg': 'Erro inesperado: %s' % str(err)}), 400
 
 
-def select_many_campo_alchemy(session, model, campo, valor):
+def select_many_campo_alchemy(session, model, campo, valor,
+                              page_size=None, cursor=None):
     try:
-        result = session.query(model).filter(campo == valor).all()
+        _, page_size, cursor = page_args(None, page_size, cursor, model)
+    except ValueError as err:
+        return jsonify({'msg': 'Erro no parâmetro: %s' % str(err)}), 400
+    try:
+        query = session.query(model).filter(campo == valor)
+        query = paginate_query(query, model, page_size, cursor)
+        with timing.db_timer():
+            result = query.all()
         if result:
-            return jsonify([item.dump(explode=False) for item in result]), 200
+            return json_response(
+                [item.dump(explode=False) for item in result], 200,
+                page_headers(result, model, page_size))
         else:
             return jsonify({'msg': '%s Não encontrado' % model.__name__}), 404
     except Exception as err:
@@ -188,30 +965,99 @@ TYPES = {
 }
 
 
-def yaml_from_model(model):  # pragma: no cover
-    def setup_yaml():
-        """https://stackoverflow.com/a/8661021."""
+def _represent_dict_order(self, data):
+    """https://stackoverflow.com/a/8661021."""
+    return self.represent_mapping('tag:yaml.org,2002:map', data.items())
 
-        def represent_dict_order(self, data):
-            return self.represent_mapping('tag:yaml.org,2002:map', data.items())
 
-        yaml.add_representer(OrderedDict, represent_dict_order)
+class SchemaRegistry():
+    """Esquemas (YAML OpenAPI e JSON-Schema) de modelos SQLAlchemy.
 
-    setup_yaml()
-    yaml_dict = OrderedDict()
-    for c in dir(model):
-        if not c.startswith('_'):
-            attr = getattr(model, c)
-            if isinstance(attr, InstrumentedAttribute):
+    Os atributos de cada modelo são lidos uma única vez do mapper (em ordem
+    alfabética, como na versão anterior baseada em dir) e as saídas ficam
+    guardadas. Modelos registrados só são processados no primeiro uso.
+
+    """
+
+    def __init__(self):
+        """Registro vazio."""
+        self.models = OrderedDict()
+        self._properties = {}
+        self._yaml = {}
+        self._json = {}
+        self._yaml_ready = False
+        self._lock = threading.Lock()
+
+    def register(self, *models):
+        """Registra modelos para specs() (sem processá-los agora)."""
+        for model in models:
+            self.models[model.__name__] = model
+
+    def properties(self, model) -> OrderedDict:
+        """Tipo de cada atributo mapeado do modelo."""
+        properties = self._properties.get(model)
+        if properties is None:
+            properties = OrderedDict()
+            for c in sorted(sa_inspect(model).attrs.keys()):
+                if c.startswith('_'):
+                    continue
+                attr = getattr(model, c)
+                if not isinstance(attr, InstrumentedAttribute):
+                    continue
                 try:
-                    yaml_dict[c] = dict(TYPES[attr.type.python_type.__name__])
+                    properties[c] = dict(
+                        TYPES[attr.type.python_type.__name__])
                 except (AttributeError, NotImplementedError):
                     if c == 'id':
-                        yaml_dict[c] = {'type': 'integer'}
+                        properties[c] = {'type': 'integer'}
                     else:
-                        yaml_dict[c] = {'type': 'string'}
-    # print(yaml_dict)
-    yaml_complete = OrderedDict()
-    yaml_complete['type'] = 'object'
-    yaml_complete['properties'] = yaml_dict
-    return yaml.dump({model.__name__: yaml_complete}, default_flow_style=False)
+                        properties[c] = {'type': 'string'}
+            self._properties[model] = properties
+        return properties
+
+    def _schema(self, model) -> OrderedDict:
+        schema = OrderedDict()
+        schema['type'] = 'object'
+        schema['properties'] = self.properties(model)
+        return schema
+
+    def yaml(self, model) -> str:
+        """Esquema OpenAPI do modelo em YAML."""
+        result = self._yaml.get(model)
+        if result is None:
+            with self._lock:
+                if not self._yaml_ready:
+                    yaml.add_representer(OrderedDict, _represent_dict_order)
+                    self._yaml_ready = True
+            result = yaml.dump({model.__name__: self._schema(model)},
+                               default_flow_style=False)
+            self._yaml[model] = result
+        return result
+
+    def json_schema(self, model) -> dict:
+        """Esquema do modelo em JSON-Schema."""
+        result = self._json.get(model)
+        if result is None:
+            result = OrderedDict()
+            result['$schema'] = 'http://json-schema.org/draft-07/schema#'
+            result['title'] = model.__name__
+            result.update(self._schema(model))
+            self._json[model] = result
+        return result
+
+    def specs(self, kind='json') -> OrderedDict:
+        """Esquemas de todos os modelos registrados ('json' ou 'yaml')."""
+        build = self.yaml if kind == 'yaml' else self.json_schema
+        return OrderedDict((name, build(model))
+                           for name, model in self.models.items())
+
+
+schema_registry = SchemaRegistry()
+
+
+def yaml_from_model(model):  # pragma: no cover
+    return schema_registry.yaml(model)
+
+
+def json_schema_from_model(model):
+    return schema_registry.json_schema(model)
@@ -0,0 +1,460 @@
+"""Caches limitados em memória e em disco, com estatísticas de uso.
+
+LRUCache: cache em memória com despejo LRU (menos recentemente usado),
+limitado por número de itens e/ou total de bytes, com expiração opcional.
+
+DiskCache: cache de bytes em diretório local, com gravação atômica
+(arquivo temporário + rename) e despejo LRU por orçamento de bytes.
+
+TwoLevelCache: LRUCache local com segundo nível opcional no Redis,
+compartilhado entre processos.
+
+Todos são thread-safe e registram acertos, faltas e despejos em CacheStats.
+
+"""
+import base64
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from redis.exceptions import RedisError
+except ImportError:
+    RedisError = OSError
+
+
+def digest_key(key):
+    """Digest hexadecimal de uma chave com repr estável (tuplas, str...)."""
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+
+def _sizeof(value):
+    """Tamanho padrão de um valor: len() se existir, senão 1."""
+    try:
+        return len(value)
+    except TypeError:
+        return 1
+
+
+class CacheStats():
+    """Contadores de uso de um cache."""
+
+    def __init__(self):
+        """Zera contadores."""
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def hit_ratio(self):
+        """Proporção de acertos sobre o total de consultas."""
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.
+        return self.hits / total
+
+    def as_dict(self):
+        """Retorna contadores em dicionário (para endpoints de estatística)."""
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hit_ratio, 4)}
+
+
+class LRUCache():
+    """Cache em memória com despejo LRU.
+
+    Args:
+        max_items: número máximo de entradas (None = sem limite)
+        max_bytes: soma máxima de sizeof(valor) (None = sem limite)
+        sizeof: função que calcula o "tamanho" de um valor
+        ttl: segundos até a expiração de cada entrada (None = sem expiração)
+
+    Um valor maior que max_bytes sozinho não é armazenado. Entradas
+    expiradas são removidas quando consultadas (get as conta como falta;
+    `key in cache` retorna False).
+
+    """
+
+    def __init__(self, max_items=None, max_bytes=None, sizeof=_sizeof,
+                 ttl=None):
+        """Configura limites."""
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self.nbytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._live(key) is not None
+
+    def __setitem__(self, key, value):
+        # Interface de dicionário usada por ex. em compiled_cache do SQLAlchemy
+        self.set(key, value)
+
+    def _live(self, key):
+        """Entrada da chave, removendo-a se expirada (chamar com _lock)."""
+        item = self._data.get(key)
+        if item is not None and item[2] is not None and \
+                item[2] <= time.time():
+            del self._data[key]
+            self.nbytes -= item[1]
+            return None
+        return item
+
+    def get(self, key, default=None):
+        """Retorna valor e o marca como mais recente, ou default."""
+        with self._lock:
+            item = self._live(key)
+            if item is None:
+                self.stats.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.stats.hits += 1
+            return item[0]
+
+    def set(self, key, value):
+        """Armazena valor, despejando os menos recentes se necessário."""
+        size = self.sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        expires = None if self.ttl is None else time.time() + self.ttl
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self._data[key] = (value, size, expires)
+            self.nbytes += size
+            self._evict()
+
+    def _over_limit(self):
+        if self.max_items is not None and len(self._data) > self.max_items:
+            return True
+        return self.max_bytes is not None and self.nbytes > self.max_bytes
+
+    def _evict(self):
+        while self._data and self._over_limit():
+            _, (_, size, _) = self._data.popitem(last=False)
+            self.nbytes -= size
+            self.stats.evictions += 1
+
+    def pop(self, key, default=None):
+        """Remove entrada (invalidação explícita)."""
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None:
+                return default
+            self.nbytes -= item[1]
+            return item[0]
+
+    def clear(self):
+        """Esvazia o cache (estatísticas são mantidas)."""
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def info(self):
+        """Estatísticas e ocupação do cache."""
+        info = self.stats.as_dict()
+        info.update({'items': len(self._data),
+                     'bytes': self.nbytes,
+                     'max_items': self.max_items,
+                     'max_bytes': self.max_bytes,
+                     'ttl': self.ttl})
+        return info
+
+
+class DiskCache():
+    """Cache de bytes em diretório local com despejo LRU por bytes.
+
+    As chaves podem ser qualquer objeto com repr estável (ex: tuplas de
+    str/int); o nome do arquivo é um digest da chave. A gravação é feita em
+    arquivo temporário no mesmo diretório e depois renomeada, de forma que
+    leitores (inclusive outros processos) nunca vejam arquivos incompletos.
+    A ordem LRU é reconstruída na inicialização pelo horário de modificação
+    dos arquivos já existentes.
+
+    """
+
+    SUFFIX = '.cache'
+
+    def __init__(self, path, max_bytes):
+        """Cria diretório se necessário e indexa arquivos existentes."""
+        self.path = path
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+        self.nbytes = 0
+        self._index = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.is_file() and entry.name.endswith(self.SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._index[name] = size
+            self.nbytes += size
+        with self._lock:
+            self._evict()
+
+    @staticmethod
+    def filename(key):
+        """Nome de arquivo correspondente a uma chave."""
+        return digest_key(key) + DiskCache.SUFFIX
+
+    def get(self, key):
+        """Retorna conteúdo em bytes ou None."""
+        name = self.filename(key)
+        try:
+            with open(os.path.join(self.path, name), 'rb') as cache_file:
+                content = cache_file.read()
+        except FileNotFoundError:
+            with self._lock:
+                self.stats.misses += 1
+                size = self._index.pop(name, None)
+                if size is not None:  # Removido por outro processo
+                    self.nbytes -= size
+            return None
+        with self._lock:
+            self.stats.hits += 1
+            if name in self._index:
+                self._index.move_to_end(name)
+            else:  # Gravado por outro processo
+                self._index[name] = len(content)
+                self.nbytes += len(content)
+        return content
+
+    def set(self, key, content: bytes):
+        """Grava conteúdo atomicamente e despeja os mais antigos."""
+        size = len(content)
+        if size > self.max_bytes:
+            return
+        name = self.filename(key)
+        fd, tmp_name = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                tmp_file.write(content)
+            os.replace(tmp_name, os.path.join(self.path, name))
+        except OSError:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            raise
+        with self._lock:
+            old = self._index.pop(name, None)
+            if old is not None:
+                self.nbytes -= old
+            self._index[name] = size
+            self.nbytes += size
+            self._evict()
+
+    def _evict(self):
+        while self._index and self.nbytes > self.max_bytes:
+            name, size = self._index.popitem(last=False)
+            self.nbytes -= size
+            self.stats.evictions += 1
+            try:
+                os.remove(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
+
+    def info(self):
+        """Estatísticas e ocupação do cache."""
+        info = self.stats.as_dict()
+        info.update({'items': len(self._index),
+                     'bytes': self.nbytes,
+                     'max_bytes': self.max_bytes,
+                     'path': self.path})
+        return info
+
+
+def _json_default(value):
+    if isinstance(value, bytes):
+        return {'__bytes__': base64.b64encode(value).decode('ascii')}
+    raise TypeError('Valor não serializável no cache: %r' % type(value))
+
+
+def _json_object(value):
+    if len(value) == 1 and '__bytes__' in value:
+        return base64.b64decode(value['__bytes__'])
+    return value
+
+
+def dumps_value(value) -> bytes:
+    """Serializa valor para o Redis: bytes puros ou JSON.
+
+    Somente bytes e tipos JSON (bytes podem estar aninhados) são aceitos;
+    tuplas voltam como listas. Não usa pickle: quem grava no Redis não
+    consegue executar código na aplicação.
+    """
+    if isinstance(value, bytes):
+        return b'b' + value
+    return b'j' + json.dumps(value, default=_json_default).encode('utf-8')
+
+
+def loads_value(payload: bytes):
+    """Inverso de dumps_value. Levanta ValueError se payload inválido."""
+    if payload[:1] == b'b':
+        return payload[1:]
+    if payload[:1] == b'j':
+        return json.loads(payload[1:].decode('utf-8'),
+                          object_hook=_json_object)
+    raise ValueError('Valor de cache em formato desconhecido')
+
+
+class TwoLevelCache():
+    """LRUCache local com segundo nível opcional no Redis.
+
+    Leituras consultam primeiro a memória local e depois o Redis (acertos
+    no Redis são promovidos para a memória). Gravações vão para os dois.
+    Valores são serializados no Redis com dumps_value (bytes ou JSON),
+    com expiração ttl. Falhas de comunicação com o Redis e valores
+    ilegíveis não interrompem a aplicação: são contados em redis_errors e
+    tratados como falta no cache.
+
+    pop remove a chave da memória local somente do próprio processo. Com
+    coherent=True (e redisdb), pop também incrementa no Redis uma versão
+    da chave, que é conferida a cada acerto local: cópias locais de outros
+    processos com versão diferente são descartadas. O custo é uma leitura
+    curta no Redis por acerto, de forma que o acerto local deixa de
+    poupar a ida ao Redis; usar somente quando valores obsoletos não podem
+    ser servidos. Se uma defasagem curta é aceitável, preferir local com
+    ttl curto (ex: user_cache).
+
+    Args:
+        local: LRUCache do processo
+        redisdb: cliente redis.StrictRedis (None = somente local)
+        prefix: prefixo das chaves no Redis
+        ttl: expiração em segundos das chaves no Redis
+        coherent: confere versão da chave no Redis a cada acerto local
+
+    """
+
+    def __init__(self, local: LRUCache, redisdb=None, prefix='ajna:cache:',
+                 ttl=3600, coherent=False):
+        """Configura níveis."""
+        self.local = local
+        self.redisdb = redisdb
+        self.prefix = prefix
+        self.ttl = ttl
+        self.coherent = coherent
+        self.redis_stats = CacheStats()
+        self.redis_errors = 0
+
+    def redis_key(self, key):
+        """Chave no Redis: prefixo + digest da chave."""
+        return self.prefix + digest_key(key)
+
+    def version_key(self, key):
+        """Chave no Redis da versão (contador de invalidações) da chave."""
+        return self.prefix + 'v:' + digest_key(key)
+
+    @property
+    def _versioned(self):
+        return self.coherent and self.redisdb is not None
+
+    def _version(self, key):
+        """Versão atual da chave no Redis (None se nunca invalidada)."""
+        return self.redisdb.get(self.version_key(key))
+
+    def get(self, key, default=None):
+        """Retorna valor da memória local ou do Redis, ou default."""
+        if not self._versioned:
+            value = self.local.get(key)
+            if value is not None or self.redisdb is None:
+                return default if value is None else value
+            return self._get_redis(key, default)
+        entry = self.local.get(key)
+        try:
+            version = self._version(key)
+        except RedisError:
+            # Sem Redis não há como garantir que a cópia local vale
+            self.redis_errors += 1
+            return default
+        if entry is not None:
+            if entry[0] == version:
+                return entry[1]
+            # Cópia local obsoleta: contabilizada como falta
+            self.local.pop(key)
+            self.local.stats.hits -= 1
+            self.local.stats.misses += 1
+        return self._get_redis(key, default, version)
+
+    def _get_redis(self, key, default, version=None):
+        try:
+            payload = self.redisdb.get(self.redis_key(key))
+        except RedisError:
+            self.redis_errors += 1
+            return default
+        if payload is None:
+            self.redis_stats.misses += 1
+            return default
+        try:
+            value = loads_value(payload)
+        except ValueError:
+            self.redis_errors += 1
+            self.redis_stats.misses += 1
+            return default
+        self.redis_stats.hits += 1
+        self._set_local(key, value, version)
+        return value
+
+    def _set_local(self, key, value, version):
+        if self._versioned:
+            self.local.set(key, (version, value))
+        else:
+            self.local.set(key, value)
+
+    def set(self, key, value):
+        """Grava valor na memória local e no Redis."""
+        if self.redisdb is None:
+            self.local.set(key, value)
+            return
+        payload = dumps_value(value)
+        try:
+            version = self._version(key) if self._versioned else None
+            self._set_local(key, value, version)
+            self.redisdb.set(self.redis_key(key), payload, ex=self.ttl)
+        except RedisError:
+            self.redis_errors += 1
+
+    def pop(self, key):
+        """Invalida chave nos dois níveis (ver coherent)."""
+        self.local.pop(key)
+        if self.redisdb is not None:
+            try:
+                self.redisdb.delete(self.redis_key(key))
+                if self.coherent:
+                    version_key = self.version_key(key)
+                    self.redisdb.incr(version_key)
+                    self.redisdb.expire(version_key, self.ttl)
+            except RedisError:
+                self.redis_errors += 1
+
+    def clear(self):
+        """Esvazia somente o nível local."""
+        self.local.clear()
+
+    def info(self):
+        """Estatísticas dos dois níveis."""
+        info = self.local.info()
+        info['redis'] = None
+        if self.redisdb is not None:
+            info['redis'] = self.redis_stats.as_dict()
+            info['redis']['errors'] = self.redis_errors
+            info['coherent'] = self.coherent
+        return info
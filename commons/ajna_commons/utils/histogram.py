@@ -0,0 +1,132 @@
+"""Histogramas de imagens e tabelas de conversão (LUT) derivadas deles.
+
+ImageOps.autocontrast e ImageOps.equalize calculam o histograma da imagem
+inteira a cada chamada. Como o histograma de uma imagem não muda, ele é
+calculado uma vez na ingestão e gravado, compactado (pack_histogram), em
+coleção própria (ver utils.images.save_histogram), fora dos documentos de
+fs.files. Com ele, as LUTs são derivadas aqui pelos mesmos algoritmos do
+PIL e aplicadas diretamente com Image.point.
+
+O histograma tem 256 posições por banda (256 para 'L', 768 para 'RGB').
+Para que o resultado seja idêntico ao do PIL ele é guardado completo
+(sem agrupar posições): compactado ocupa tipicamente poucas centenas de
+bytes.
+
+"""
+import io
+import struct
+import zlib
+
+from PIL import Image
+
+HISTOGRAM_MODES = ('L', 'RGB')
+
+
+def compute_histogram(image) -> list:
+    """Histograma de uma imagem PIL ou em bytes. None se modo não suportado.
+
+    Imagens no modo 'P' são convertidas para RGB, como em ImageOps.equalize.
+    """
+    if isinstance(image, bytes):
+        image = Image.open(io.BytesIO(image))
+    if image.mode == 'P':
+        image = image.convert('RGB')
+    if image.mode not in HISTOGRAM_MODES:
+        return None
+    return image.histogram()
+
+
+def pack_histogram(histogram) -> bytes:
+    """Histograma em bytes: inteiros de 32 bits comprimidos com zlib."""
+    return zlib.compress(struct.pack('<%dI' % len(histogram), *histogram))
+
+
+def unpack_histogram(data: bytes) -> list:
+    """Inverso de pack_histogram."""
+    raw = zlib.decompress(data)
+    return list(struct.unpack('<%dI' % (len(raw) // 4), raw))
+
+
+def histogram_matches(pil_image, histogram) -> bool:
+    """Confere se histogram pode ser da imagem (modo e número de pixels)."""
+    if not histogram or pil_image.mode not in HISTOGRAM_MODES:
+        return False
+    if len(histogram) != 256 * len(pil_image.getbands()):
+        return False
+    width, height = pil_image.size
+    return sum(histogram[:256]) == width * height
+
+
+def equalize_lut(histogram) -> list:
+    """LUT de ImageOps.equalize calculada a partir do histograma."""
+    lut = []
+    for b in range(0, len(histogram), 256):
+        histo = [_f for _f in histogram[b:b + 256] if _f]
+        if len(histo) <= 1:
+            lut.extend(list(range(256)))
+        else:
+            step = (sum(histo) - histo[-1]) // 255
+            if not step:
+                lut.extend(list(range(256)))
+            else:
+                n = step // 2
+                for i in range(256):
+                    lut.append(n // step)
+                    n = n + histogram[i + b]
+    return lut
+
+
+def _cut(h, cut, indices):
+    for ix in indices:
+        if cut > h[ix]:
+            cut = cut - h[ix]
+            h[ix] = 0
+        else:
+            h[ix] -= cut
+            cut = 0
+        if cut <= 0:
+            break
+
+
+def autocontrast_lut(histogram, cutoff=0) -> list:
+    """LUT de ImageOps.autocontrast calculada a partir do histograma."""
+    lut = []
+    for layer in range(0, len(histogram), 256):
+        h = list(histogram[layer:layer + 256])
+        if cutoff:
+            n = sum(h)
+            _cut(h, int(n * cutoff // 100), range(256))
+            _cut(h, int(n * cutoff // 100), range(255, -1, -1))
+        lo = next((ix for ix in range(256) if h[ix]), 255)
+        hi = next((ix for ix in range(255, -1, -1) if h[ix]), 0)
+        if hi <= lo:
+            lut.extend(list(range(256)))
+        else:
+            scale = 255.0 / (hi - lo)
+            offset = -lo * scale
+            for ix in range(256):
+                ix = int(ix * scale + offset)
+                lut.append(min(max(ix, 0), 255))
+    return lut
+
+
+def map_histogram(histogram, lut) -> list:
+    """Histograma resultante de aplicar lut a uma imagem com histogram.
+
+    Valores da LUT fora de 0-255 são saturados, como em Image.point.
+    """
+    if len(lut) == 256:
+        lut = lut * (len(histogram) // 256)
+    result = [0] * len(histogram)
+    for b in range(0, len(histogram), 256):
+        for i in range(256):
+            level = min(max(lut[b + i], 0), 255)
+            result[b + level] += histogram[b + i]
+    return result
+
+
+def apply_lut(pil_image, lut):
+    """Aplica LUT como ImageOps (RGB com LUT de 256 usa a mesma por banda)."""
+    if pil_image.mode == 'RGB' and len(lut) == 256:
+        lut = lut + lut + lut
+    return pil_image.point(lut)
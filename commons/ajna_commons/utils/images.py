@@ -1,9 +1,23 @@
 """Funções para tratamento de imagens."""
 import io
+import os
 from PIL import Image, ImageDraw, ImageOps
 from ajna_commons.flask.log import logger
+from ajna_commons.utils import timing
+from ajna_commons.utils.cache import LRUCache
+from ajna_commons.utils.histogram import (apply_lut, compute_histogram,
+                                          equalize_lut, histogram_matches,
+                                          map_histogram, pack_histogram,
+                                          unpack_histogram)
+from bson.binary import Binary
 from bson.objectid import ObjectId
 from gridfs import GridFS
+from gridfs.errors import NoFile
+
+TRANSFORMATION_CACHE_BYTES = int(os.environ.get('TRANSFORMATION_CACHE_BYTES',
+                                                32 * 1024 * 1024))
+# Coleção dos histogramas das imagens do GridFS (_id igual ao de fs.files)
+HISTOGRAM_COLLECTION = 'fs.histograms'
 
 
 def bytes_toPIL(img: io.BytesIO) -> Image:
@@ -52,9 +66,10 @@ def mongo_image(db, image_id, bboxes=False):
     """Lê imagem do Banco MongoDB. Retorna None se ID não encontrado."""
     fs = GridFS(db)
     _id = ObjectId(image_id)
-    if fs.exists(_id):
-        grid_out = fs.get(_id)
-        image = grid_out.read()
+    with timing.db_timer():
+        grid_out = fs.get(_id) if fs.exists(_id) else None
+        image = grid_out.read() if grid_out else None
+    if grid_out is not None:
         if bboxes:
             predictions = grid_out.metadata.get('predictions')
             if predictions:
@@ -124,6 +139,16 @@ def generate_batch(db, filtro, projection=None, batch_size=32,
 
 
 class ImageBytesTansformations:
+    """Transformações de imagens serializadas em bytes.
+
+    Cada transformação pública (rotate90, equalize, ...) recebe bytes e
+    retorna io.BytesIO com JPEG. Para encadear várias transformações, usar
+    apply_pipeline, que decodifica a imagem uma só vez, aplica a cadeia na
+    imagem PIL e codifica JPEG uma única vez no final (ao invés de uma
+    decodificação e uma compressão com perdas por transformação).
+
+    Os métodos com "_" no nome não são listados como transformações.
+    """
 
     @classmethod
     def get_tranformation(cls, name):
@@ -134,26 +159,148 @@ class ImageBytesTansformations:
         return [method for method in dir(cls) if '_' not in method]
 
     @classmethod
-    def rotate90(cls, image_bytes):
-        pil_img = Image.open(io.BytesIO(image_bytes))
-        pil_img = pil_img.transpose(Image.ROTATE_90)
-        return PIL_tobytes(pil_img)
+    def parse_chain(cls, chain) -> tuple:
+        """Valida cadeia de transformações.
+
+        Aceita string separada por vírgulas ('rotate90,equalize') ou lista
+        de nomes. Retorna tupla de nomes (utilizável como chave de cache).
+        Levanta ValueError se algum nome não for transformação disponível.
+        """
+        if isinstance(chain, str):
+            chain = chain.split(',')
+        chain = tuple(name.strip() for name in chain if name.strip())
+        available = cls.get_available_transformations()
+        for name in chain:
+            if name not in available:
+                raise ValueError('Transformação %s inválida. Disponíveis: %s'
+                                 % (name, available))
+        return chain
+
+    # Transformações que não alteram o histograma da imagem
+    HISTOGRAM_INVARIANT = ('rotate90', 'rotate270')
 
     @classmethod
-    def rotate270(cls, image_bytes):
-        pil_img = Image.open(io.BytesIO(image_bytes))
-        pil_img = pil_img.transpose(Image.ROTATE_270)
-        return PIL_tobytes(pil_img)
+    def transform_pil(cls, pil_img: Image, chain,
+                      histogram: list = None) -> Image:
+        """Aplica cadeia de transformações a uma imagem PIL.
+
+        Se o histograma da imagem original for passado (pré-calculado, ver
+        utils.histogram), equalize aplica a LUT diretamente, sem percorrer
+        a imagem, enquanto o histograma continuar válido na cadeia.
+        """
+        for name in cls.parse_chain(chain):
+            if name == 'equalize' and histogram_matches(pil_img, histogram):
+                lut = equalize_lut(histogram)
+                pil_img = apply_lut(pil_img, lut)
+                histogram = map_histogram(histogram, lut)
+                continue
+            pil_img = getattr(cls, '_' + name)(pil_img)
+            if name not in cls.HISTOGRAM_INVARIANT:
+                histogram = None
+        return pil_img
 
     @classmethod
-    def equalize(cls, image_bytes):
+    def apply_pipeline(cls, image_bytes, chain,
+                       histogram: list = None) -> io.BytesIO:
+        """Decodifica uma vez, aplica a cadeia e codifica JPEG uma vez."""
         pil_img = Image.open(io.BytesIO(image_bytes))
-        pil_img = ImageOps.equalize(pil_img)
-        return PIL_tobytes(pil_img)
+        return PIL_tobytes(cls.transform_pil(pil_img, chain, histogram))
+
+    @staticmethod
+    def _rotate90(pil_img):
+        return pil_img.transpose(Image.ROTATE_90)
+
+    @staticmethod
+    def _rotate270(pil_img):
+        return pil_img.transpose(Image.ROTATE_270)
+
+    @staticmethod
+    def _equalize(pil_img):
+        return ImageOps.equalize(pil_img)
+
+    @staticmethod
+    def _crop10(pil_img):
+        return ImageOps.crop(pil_img, int(pil_img.size[0] / 10))
 
+    @classmethod
+    def rotate90(cls, image_bytes):
+        return cls.apply_pipeline(image_bytes, ('rotate90',))
+
+    @classmethod
+    def rotate270(cls, image_bytes):
+        return cls.apply_pipeline(image_bytes, ('rotate270',))
+
+    @classmethod
+    def equalize(cls, image_bytes, histogram=None):
+        return cls.apply_pipeline(image_bytes, ('equalize',), histogram)
 
     @classmethod
     def crop10(cls, image_bytes):
-        pil_img = Image.open(io.BytesIO(image_bytes))
-        pil_img = ImageOps.crop(pil_img, int(pil_img.size[0] / 10))
-        return PIL_tobytes(pil_img)
+        return cls.apply_pipeline(image_bytes, ('crop10',))
+
+
+transformation_cache = LRUCache(max_bytes=TRANSFORMATION_CACHE_BYTES)
+
+
+def mongo_image_transformed(db, image_id, chain, cache=transformation_cache):
+    """Lê imagem do Banco MongoDB e aplica cadeia de transformações.
+
+    O resultado (bytes JPEG) é guardado em cache, chave (image_id, cadeia).
+    Retorna None se ID não encontrado. Levanta ValueError se cadeia inválida.
+    """
+    chain = ImageBytesTansformations.parse_chain(chain)
+    key = (str(image_id), chain)
+    image = cache.get(key)
+    timing.add_cache(image is not None)
+    if image is None:
+        with timing.db_timer():
+            fs = GridFS(db)
+            _id = ObjectId(image_id)
+            if not fs.exists(_id):
+                return None
+            grid_out = fs.get(_id)
+            content = grid_out.read()
+            histogram = None
+            if 'equalize' in chain:
+                histogram = load_histogram(db, _id)
+        image = ImageBytesTansformations.apply_pipeline(
+            content, chain, histogram).read()
+        cache.set(key, image)
+    return image
+
+
+def save_histogram(db, image_id, histogram):
+    """Grava histograma compactado da imagem em HISTOGRAM_COLLECTION."""
+    _id = ObjectId(image_id)
+    db[HISTOGRAM_COLLECTION].replace_one(
+        {'_id': _id}, {'_id': _id, 'histogram': Binary(pack_histogram(
+            histogram))}, upsert=True)
+
+
+def load_histogram(db, image_id):
+    """Histograma da imagem gravado por save_histogram, ou None."""
+    row = db[HISTOGRAM_COLLECTION].find_one({'_id': ObjectId(image_id)})
+    if row is None:
+        return None
+    return unpack_histogram(row['histogram'])
+
+
+def precompute_histogram(db, image_id, overwrite=False):
+    """Calcula histograma da imagem e grava em HISTOGRAM_COLLECTION.
+
+    Para imagens inseridas antes do cálculo na ingestão
+    (ver BsonImage.tomongo). Retorna o histograma ou None.
+    """
+    _id = ObjectId(image_id)
+    if not overwrite:
+        histogram = load_histogram(db, _id)
+        if histogram:
+            return histogram
+    try:
+        histogram = compute_histogram(GridFS(db).get(_id).read())
+    except (OSError, NoFile) as err:
+        logger.info('Erro ao calcular histograma de %s: %s', _id, err)
+        return None
+    if histogram:
+        save_histogram(db, _id, histogram)
+    return histogram
@@ -1,5 +1,63 @@
-"""Funções para normalização e limpeza de texto e listas de textos."""
+"""Funções para normalização e limpeza de texto e listas de textos.
+
+As tabelas de conversão (str.translate) são montadas uma vez, na carga do
+módulo ou sob demanda, e reutilizadas em todas as chamadas.
+"""
+import csv
+import io
+import logging
+import os
+import time
 import unicodedata
+import zipfile
+from functools import lru_cache, partial
+from multiprocessing import Pool
+
+from ajna_commons.conf import ENCODE
+
+# Mesmo logger de ajna_commons.flask.log, sem importá-lo (aquele módulo
+# cria arquivos e handlers de log ao ser importado)
+logger = logging.getLogger('ajna')
+
+LETRAS = u'abcdefghijklmnopqrstuvwxyz'
+NUMEROS = u'0123456789'
+SINAIS = u'*.,+&%@! _-:/'
+SECURE = frozenset(LETRAS + LETRAS.upper() + NUMEROS + SINAIS)
+# Todos os caracteres de SECURE são ASCII: após remover os não-ASCII,
+# basta apagar os ASCII que não estão em SECURE.
+_MONGO_DELETE = str.maketrans('', '', ''.join(
+    chr(code) for code in range(128) if chr(code) not in SECURE))
+
+# Textos até este tamanho passam pelo cache LRU de sanitizar
+CACHED_MAX_LEN = 64
+# Mínimo de valores distintos para sanitizar_coluna usar processos
+PARALELO_MINIMO = 50000
+# Extensões aceitas por sanitizar_csv (subconjunto de conf.ALLOWED_EXTENSIONS)
+CSV_EXTENSIONS = ('csv', 'txt', 'zip')
+
+
+# Códigos guardados em _COMBINING: latinos, gregos, cirílicos, marcas
+# combinantes (U+0300-U+036F) e demais alfabetos até U+2FFF
+_COMBINING_MAX_CODE = 0x3000
+
+
+class _CombiningTable(dict):
+    """Tabela str.translate que apaga marcas combinantes (diacríticos).
+
+    Preenchida sob demanda: cada código é classificado com
+    unicodedata.combining apenas na primeira vez em que aparece. Somente
+    códigos abaixo de _COMBINING_MAX_CODE são guardados, de forma que a
+    tabela não passa desse número de entradas com qualquer entrada.
+    """
+
+    def __missing__(self, code):
+        value = None if unicodedata.combining(chr(code)) else code
+        if code < _COMBINING_MAX_CODE:
+            self[code] = value
+        return value
+
+
+_COMBINING = _CombiningTable()
 
 
 def ascii_sanitizar(text):
@@ -22,30 +80,28 @@ def unicode_sanitizar(text):
     if not text:
         return None
     norm_txt = unicodedata.normalize('NFD', text)
-    shaved = ''.join(char for char in norm_txt
-                     if not unicodedata.combining(char))
+    shaved = norm_txt.translate(_COMBINING)
     if not shaved:
         return None
     return unicodedata.normalize('NFC', shaved)
 
 
 def mongo_sanitizar(text: str):
-    """Remove todo caractere que pode ser usado em ataque MongoDB injection."""
+    """Remove todo caractere que pode ser usado em ataque MongoDB injection.
+
+    Mantém apenas os caracteres de SECURE. Como todos são ASCII, o
+    resultado já está em NFC.
+    """
     if not isinstance(text, str):
         return text
-    LETRAS = u'abcdefghijklmnopqrstuvwxyz'
-    NUMEROS = u'0123456789'
-    SINAIS = u'*.,+&%@! _-:/'
-    secure = LETRAS + LETRAS.upper() + NUMEROS + SINAIS
     if not text:
         return None
-
     norm_txt = unicodedata.normalize('NFD', text)
-    shaved = ''.join(char for char in norm_txt
-                     if char in secure)
+    shaved = norm_txt.encode('ascii', 'ignore').decode('ascii') \
+        .translate(_MONGO_DELETE)
     if not shaved:
         return None
-    return unicodedata.normalize('NFC', shaved)
+    return shaved
 
 
 def sanitizar(text: str, norm_function=unicode_sanitizar)-> str:
@@ -59,15 +115,23 @@ def sanitizar(text: str, norm_function=unicode_sanitizar)-> str:
     """
     if text is None or text == '':
         return text
+    if len(text) <= CACHED_MAX_LEN:
+        return _sanitizar_cached(text, norm_function)
+    return _sanitizar(text, norm_function)
+
+
+def _sanitizar(text: str, norm_function) -> str:
     text = text.strip()
     text = text.casefold()
     text = norm_function(text)
     if text is None or text == '':
         return text
-    word_list = text.split()
-    text = ' '.join(word.strip() for word in word_list
-                    if len(word.strip()))
-    return text
+    # split() sem argumentos já descarta espaços extras e palavras vazias
+    return ' '.join(text.split())
+
+
+# Valores repetidos (ex: colunas de CSV) são comuns: cache para textos curtos
+_sanitizar_cached = lru_cache(maxsize=2 ** 16)(_sanitizar)
 
 
 def sanitizar_lista(lista, norm_function=unicode_sanitizar):
@@ -87,3 +151,212 @@ def sanitizar_lista(lista, norm_function=unicode_sanitizar):
             raise TypeError('Tipo não suportado (tipos suportados, list(str)' +
                             'ou list(list(str). Ver documentação.')
     return lista
+
+
+def _sanitizar_distintos(valores, norm_function=unicode_sanitizar) -> list:
+    """Sanitiza lista de valores distintos (não-str são mantidos)."""
+    return [_sanitizar(valor, norm_function)
+            if isinstance(valor, str) and valor != '' else valor
+            for valor in valores]
+
+
+def _sanitizar_mapa(distintos, norm_function, processes=None,
+                    chunksize=10000) -> dict:
+    """Retorna dicionário valor original: valor sanitizado."""
+    distintos = list(distintos)
+    if processes and len(distintos) >= PARALELO_MINIMO:
+        blocos = [distintos[i:i + chunksize]
+                  for i in range(0, len(distintos), chunksize)]
+        with Pool(processes) as pool:
+            resultados = pool.map(partial(_sanitizar_distintos,
+                                          norm_function=norm_function),
+                                  blocos)
+        sanitizados = [valor for bloco in resultados for valor in bloco]
+    else:
+        sanitizados = _sanitizar_distintos(distintos, norm_function)
+    return dict(zip(distintos, sanitizados))
+
+
+def sanitizar_coluna(coluna, norm_function=unicode_sanitizar,
+                     processes=None, chunksize=10000):
+    """Sanitiza uma coluna inteira, processando cada valor distinto uma vez.
+
+    Aceita pandas.Series, array NumPy (dtype object), pyarrow.Array /
+    ChunkedArray de strings ou qualquer sequência (retorna lista).
+    Retorna coluna do mesmo tipo, sem alterar a original.
+    Valores que não são str (None, NaN, números) são mantidos.
+
+    Em colunas de importação (ex: Mercante) os valores se repetem muito;
+    como apenas os valores distintos são normalizados, o custo cai na mesma
+    proporção. Se processes for informado e houver ao menos PARALELO_MINIMO
+    valores distintos, a normalização é dividida em blocos de chunksize
+    entre processes processos (norm_function deve ser de módulo).
+    """
+    if hasattr(coluna, 'unique') and hasattr(coluna, 'map'):  # pandas
+        mapa = _sanitizar_mapa(coluna.unique(), norm_function,
+                               processes, chunksize)
+        return coluna.map(mapa)
+    if hasattr(coluna, 'chunks'):  # pyarrow.ChunkedArray
+        import pyarrow
+        return pyarrow.chunked_array(
+            [sanitizar_coluna(chunk, norm_function, processes, chunksize)
+             for chunk in coluna.chunks], type=coluna.type)
+    if hasattr(coluna, 'dictionary_encode'):  # pyarrow.Array
+        import pyarrow
+        codificada = coluna.dictionary_encode()
+        mapa = _sanitizar_mapa(codificada.dictionary.to_pylist(),
+                               norm_function, processes, chunksize)
+        dicionario = pyarrow.array(list(mapa.values()), type=coluna.type)
+        return dicionario.take(codificada.indices)
+    mapa = _sanitizar_mapa(dict.fromkeys(coluna), norm_function,
+                           processes, chunksize)
+    if hasattr(coluna, 'dtype'):  # NumPy
+        import numpy
+        return numpy.frompyfunc(mapa.__getitem__, 1, 1)(coluna)
+    return [mapa[valor] for valor in coluna]
+
+
+def sanitizar_tabela(tabela, colunas=None, norm_function=unicode_sanitizar,
+                     processes=None):
+    """Sanitiza colunas de um pandas.DataFrame com sanitizar_coluna.
+
+    Se colunas não for informado, sanitiza as colunas de dtype object ou
+    string. Retorna o próprio DataFrame (alterado).
+    """
+    if colunas is None:
+        colunas = [nome for nome, dtype in tabela.dtypes.items()
+                   if dtype == object or str(dtype) in ('string', 'str')]
+    for nome in colunas:
+        tabela[nome] = sanitizar_coluna(tabela[nome], norm_function,
+                                        processes)
+    return tabela
+
+
+def _extensao(caminho):
+    return os.path.splitext(caminho)[1][1:].lower()
+
+
+def ler_csv(caminho, encoding=ENCODE, delimiter=','):
+    """Gerador de linhas (listas de str) de um CSV, ou de um CSV zipado.
+
+    No caso de .zip, lê o primeiro arquivo .csv ou .txt do pacote. O
+    arquivo é lido linha a linha, sem ser carregado inteiro na memória.
+    """
+    extensao = _extensao(caminho)
+    if extensao not in CSV_EXTENSIONS:
+        raise ValueError('Extensão %s não suportada. Suportadas: %s' %
+                         (extensao, CSV_EXTENSIONS))
+    if extensao == 'zip':
+        with zipfile.ZipFile(caminho) as pacote:
+            nomes = [nome for nome in pacote.namelist()
+                     if _extensao(nome) in ('csv', 'txt')]
+            if not nomes:
+                raise ValueError('Nenhum CSV encontrado em %s' % caminho)
+            with pacote.open(nomes[0]) as binario:
+                texto = io.TextIOWrapper(binario, encoding=encoding,
+                                         newline='')
+                yield from csv.reader(texto, delimiter=delimiter)
+    else:
+        with open(caminho, encoding=encoding, newline='') as texto:
+            yield from csv.reader(texto, delimiter=delimiter)
+
+
+NORM_FUNCTIONS = {'unicode': unicode_sanitizar, 'ascii': ascii_sanitizar}
+
+
+def sanitizar_linhas(linhas, colunas=None, cabecalho=True):
+    """Gerador que sanitiza as colunas configuradas de cada linha.
+
+    Args:
+        linhas: iterável de listas de str (ex: ler_csv)
+        colunas: dicionário {nome ou índice da coluna: função}, sendo
+            função 'unicode', 'ascii' ou função de normalização
+            (ver sanitizar). None = todas as colunas com unicode_sanitizar
+        cabecalho: se True, a primeira linha é repassada sem alteração e
+            usada para traduzir nomes de colunas em índices
+
+    """
+    linhas = iter(linhas)
+    plano = None
+    if cabecalho:
+        try:
+            primeira = next(linhas)
+        except StopIteration:
+            return
+        yield primeira
+    if colunas is not None:
+        plano = []
+        for coluna, funcao in colunas.items():
+            if not isinstance(coluna, int):
+                if not cabecalho or coluna not in primeira:
+                    raise KeyError('Coluna %s não encontrada' % coluna)
+                coluna = primeira.index(coluna)
+            plano.append((coluna, NORM_FUNCTIONS.get(funcao, funcao)))
+    for linha in linhas:
+        if plano is None:
+            linha = [sanitizar(valor) for valor in linha]
+        else:
+            for coluna, funcao in plano:
+                if coluna < len(linha):
+                    linha[coluna] = sanitizar(linha[coluna], funcao)
+        yield linha
+
+
+def escrever_csv(linhas, destino, encoding=ENCODE, delimiter=','):
+    """Grava linhas incrementalmente em CSV (ou .zip com um CSV dentro).
+
+    Retorna número de linhas gravadas.
+    """
+    total = 0
+    if _extensao(destino) == 'zip':
+        nome = os.path.splitext(os.path.basename(destino))[0]
+        if _extensao(nome) not in ('csv', 'txt'):
+            nome = nome + '.csv'
+        with zipfile.ZipFile(destino, 'w', zipfile.ZIP_DEFLATED) as pacote:
+            with pacote.open(nome, 'w') as binario:
+                texto = io.TextIOWrapper(binario, encoding=encoding,
+                                         newline='')
+                writer = csv.writer(texto, delimiter=delimiter)
+                for linha in linhas:
+                    writer.writerow(linha)
+                    total += 1
+                texto.flush()
+                texto.detach()
+    else:
+        with open(destino, 'w', encoding=encoding, newline='') as texto:
+            writer = csv.writer(texto, delimiter=delimiter)
+            for linha in linhas:
+                writer.writerow(linha)
+                total += 1
+    return total
+
+
+def _medir_vazao(linhas, relatorio):
+    """Repassa linhas, registrando no log a vazão a cada relatorio linhas."""
+    s0 = time.time()
+    for contador, linha in enumerate(linhas, 1):
+        yield linha
+        if relatorio and contador % relatorio == 0:
+            logger.info('sanitizar_csv: %d linhas, %.0f linhas/s',
+                        contador, contador / (time.time() - s0 or 1e-9))
+
+
+def sanitizar_csv(origem, destino, colunas=None, cabecalho=True,
+                  encoding=ENCODE, delimiter=',', relatorio=100000):
+    """Lê, sanitiza e grava um CSV linha a linha, com memória constante.
+
+    Ver ler_csv, sanitizar_linhas e escrever_csv. A vazão é registrada no
+    log a cada relatorio linhas.
+    Retorna dicionário com linhas, segundos e linhas_por_segundo.
+    """
+    s0 = time.time()
+    linhas = ler_csv(origem, encoding, delimiter)
+    linhas = sanitizar_linhas(linhas, colunas, cabecalho)
+    total = escrever_csv(_medir_vazao(linhas, relatorio), destino,
+                         encoding, delimiter)
+    segundos = time.time() - s0
+    resultado = {'linhas': total,
+                 'segundos': round(segundos, 3),
+                 'linhas_por_segundo': round(total / (segundos or 1e-9))}
+    logger.info('sanitizar_csv %s: %s', origem, resultado)
+    return resultado
@@ -0,0 +1,90 @@
+"""Métricas da requisição em andamento (tempo de BD, acertos de cache).
+
+O contexto é por thread (threading.local), de forma que funções auxiliares
+(api_utils, user, images...) registram métricas sem depender do Flask: se
+não houver requisição em andamento (ex: scripts), os registros são
+ignorados.
+
+Uso:
+    timing.start()          # no início da requisição
+    with timing.db_timer():
+        ...consulta ao BD...
+    timing.add_cache(hit)
+    metrics = timing.finish()   # no fim da requisição
+
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+_local = threading.local()
+
+
+class RequestMetrics():
+    """Métricas acumuladas de uma requisição."""
+
+    def __init__(self):
+        """Zera contadores e marca início."""
+        self.start = time.perf_counter()
+        self.db_time = 0.
+        self.db_queries = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def duration(self):
+        """Segundos desde o início da requisição."""
+        return time.perf_counter() - self.start
+
+    def as_dict(self):
+        """Métricas em dicionário, com tempos em milissegundos."""
+        return {'duration_ms': round(self.duration() * 1000, 2),
+                'db_ms': round(self.db_time * 1000, 2),
+                'db_queries': self.db_queries,
+                'cache_hits': self.cache_hits,
+                'cache_misses': self.cache_misses}
+
+
+def start() -> RequestMetrics:
+    """Inicia métricas da requisição da thread atual."""
+    _local.metrics = RequestMetrics()
+    return _local.metrics
+
+
+def current() -> RequestMetrics:
+    """Métricas da requisição em andamento, ou None."""
+    return getattr(_local, 'metrics', None)
+
+
+def finish() -> RequestMetrics:
+    """Encerra e retorna métricas da requisição (None se não iniciadas)."""
+    metrics = current()
+    _local.metrics = None
+    return metrics
+
+
+def add_db_time(seconds, queries=1):
+    """Soma tempo de BD à requisição em andamento."""
+    metrics = current()
+    if metrics is not None:
+        metrics.db_time += seconds
+        metrics.db_queries += queries
+
+
+def add_cache(hit: bool):
+    """Registra acerto ou falta de cache na requisição em andamento."""
+    metrics = current()
+    if metrics is not None:
+        if hit:
+            metrics.cache_hits += 1
+        else:
+            metrics.cache_misses += 1
+
+
+@contextmanager
+def db_timer(queries=1):
+    """Mede o bloco como tempo de BD."""
+    s0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_db_time(time.perf_counter() - s0, queries)
@@ -1,60 +1,312 @@
 import io
 import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import falcon
 import numpy as np
 import random
 import bson
+import click
+import gridfs
 from PIL import Image
 from wsgiref import simple_server
 
 from pymongo import MongoClient
 from gridfs import GridFS
 
+from ajna_commons.utils.cache import DiskCache, LRUCache
+from ajna_commons.utils.images import ImageBytesTansformations
+
+CACHE_DIR = os.environ.get('IMGSERVER_CACHE_DIR',
+                           os.path.join(tempfile.gettempdir(),
+                                        'imgserver_cache'))
+CACHE_MEMORY_BYTES = int(os.environ.get('IMGSERVER_CACHE_MEMORY',
+                                        64 * 1024 * 1024))
+CACHE_DISK_BYTES = int(os.environ.get('IMGSERVER_CACHE_DISK',
+                                      1024 * 1024 * 1024))
+BATCH_MAX_IDS = int(os.environ.get('IMGSERVER_BATCH_MAX_IDS', 100))
+READ_WORKERS = int(os.environ.get('IMGSERVER_READ_WORKERS', 8))
+RANDOM_POOL_SIZE = int(os.environ.get('IMGSERVER_RANDOM_POOL_SIZE', 1000))
+RANDOM_POOL_TTL = int(os.environ.get('IMGSERVER_RANDOM_POOL_TTL', 600))
 
 db = MongoClient(host='localhost')['test']
 fs = GridFS(db)
 
-lista_ids = [
-    linha['_id'] for linha in
-    db['fs.files'].find(
-        {'metadata.contentType': 'image/jpeg'}, {'_id': 1}
-    ).limit(1000)
-]
 
+class RandomImagePool(object):
+    """Amostra de _ids para servir imagem aleatória quando id não é passado.
+
+    Nada é consultado na inicialização. A amostra é obtida via $sample no
+    primeiro uso e renovada em thread de segundo plano quando passa de ttl
+    segundos; enquanto isso, a amostra anterior continua sendo servida.
+    """
+
+    def __init__(self, collection, filtro, size=RANDOM_POOL_SIZE,
+                 ttl=RANDOM_POOL_TTL):
+        self.collection = collection
+        self.filtro = filtro
+        self.size = size
+        self.ttl = ttl
+        self.ids = []
+        self.loaded_at = 0.
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def sample(self, size):
+        return [row['_id'] for row in self.collection.aggregate([
+            {'$match': self.filtro},
+            {'$sample': {'size': size}},
+            {'$project': {'_id': 1}}
+        ])]
+
+    def refresh(self):
+        try:
+            ids = self.sample(self.size)
+            with self._lock:
+                self.ids = ids
+                self.loaded_at = time.time()
+        except Exception as err:
+            print('Erro ao renovar amostra de imagens: %s' % err)
+        finally:
+            self._refreshing = False
+
+    def refresh_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self.refresh, daemon=True).start()
+
+    def choice(self):
+        """Retorna um _id aleatório (None se não houver imagens)."""
+        ids = self.ids
+        if time.time() - self.loaded_at > self.ttl:
+            self.refresh_background()
+        if ids:
+            return random.choice(ids)
+        # Amostra ainda não carregada: sorteia um só diretamente no BD
+        ids = self.sample(1)
+        return ids[0] if ids else None
+
+
+random_pool = RandomImagePool(db['fs.files'],
+                              {'metadata.contentType': 'image/jpeg'})
+
+
+class RenderTimeHistogram(object):
+    """Histograma de tempos de renderização, em milissegundos."""
+    BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.total_ms = 0.
+        self._lock = threading.Lock()
+
+    def add(self, ms):
+        index = len(self.BUCKETS)
+        for i, limit in enumerate(self.BUCKETS):
+            if ms <= limit:
+                index = i
+                break
+        with self._lock:
+            self.counts[index] += 1
+            self.total_ms += ms
+
+    def as_dict(self):
+        labels = ['<=%dms' % limit for limit in self.BUCKETS]
+        labels.append('>%dms' % self.BUCKETS[-1])
+        count = sum(self.counts)
+        return {'count': count,
+                'mean_ms': round(self.total_ms / count, 2) if count else 0.,
+                'buckets': dict(zip(labels, self.counts))}
+
+
+class RenderCache(object):
+    """Cache de imagens renderizadas (recortes/cadeias de transformações).
 
-def recorta_imagem(grid_out, mini):
+    Dois níveis: memória (LRU por bytes) e disco (LRU por bytes, gravação
+    atômica, compartilhado entre processos). Acertos no disco são
+    promovidos para a memória.
+    """
+
+    def __init__(self, memory_bytes=CACHE_MEMORY_BYTES,
+                 disk_path=CACHE_DIR, disk_bytes=CACHE_DISK_BYTES):
+        self.memory = LRUCache(max_bytes=memory_bytes)
+        self.disk = DiskCache(disk_path, disk_bytes)
+        self.render_times = RenderTimeHistogram()
+
+    def get(self, key):
+        image = self.memory.get(key)
+        if image is None:
+            image = self.disk.get(key)
+            if image is not None:
+                self.memory.set(key, image)
+        return image
+
+    def set(self, key, image):
+        self.memory.set(key, image)
+        self.disk.set(key, image)
+
+    def info(self):
+        hits = self.memory.stats.hits + self.disk.stats.hits
+        total = hits + self.disk.stats.misses
+        return {'hit_ratio': round(hits / total, 4) if total else 0.,
+                'memory': self.memory.info(),
+                'disk': self.disk.info(),
+                'render_times': self.render_times.as_dict()}
+
+
+render_cache = RenderCache()
+read_executor = ThreadPoolExecutor(max_workers=READ_WORKERS)
+
+
+def get_bbox(grid_out, mini):
     preds = grid_out.metadata.get('predictions')
+    bboxes = []
     if preds:
         bboxes = [pred.get('bbox') for pred in preds]
     n = int(mini)
     if len(bboxes) >= n + 1 and bboxes[n]:
-        coords = bboxes[n]
-        pil_image = Image.open(io.BytesIO(grid_out.read()))
-        pil_image = pil_image.crop((coords[1], coords[0], coords[3], coords[2]))
-        image_bytes = io.BytesIO()
-        pil_image.save(image_bytes, 'JPEG')
-        image_bytes.seek(0)
-        return image_bytes.read()
+        return bboxes[n]
     print('Não achou bbox...')
     return None
 
 
-def mongo_image(image_id, mini=None):
-    """Lê imagem do Banco MongoDB. Retorna None se ID não encontrado."""
+def render_image(grid_out, mini=None, transform=None, size=None):
+    """Aplica recorte (mini), transformações (transform) e miniatura (size).
+
+    A imagem é decodificada uma vez e codificada em JPEG uma vez no final,
+    qualquer que seja a combinação de parâmetros.
+    """
+    coords = None
+    if mini is not None:
+        coords = get_bbox(grid_out, mini)
+        if coords is None:
+            return None
+    pil_image = Image.open(io.BytesIO(grid_out.read()))
+    if coords is not None:
+        pil_image = pil_image.crop((coords[1], coords[0],
+                                    coords[3], coords[2]))
+    if transform:
+        pil_image = ImageBytesTansformations.transform_pil(pil_image,
+                                                           transform)
+    if size is not None:
+        pil_image.thumbnail((int(size), int(size)))
+    image_bytes = io.BytesIO()
+    pil_image.save(image_bytes, 'JPEG')
+    return image_bytes.getvalue()
+
+
+def render_and_cache(grid_out, mini=None, transform=None, size=None):
+    """Renderiza imagem e grava em render_cache.
+
+    Chave do cache: (id, mini, transform, size).
+
+    Sem nenhum parâmetro de renderização retorna o original, sem cache.
+    """
+    if mini is None and transform is None and size is None:
+        return grid_out.read()
+    s0 = time.time()
+    image = render_image(grid_out, mini, transform, size)
+    render_cache.render_times.add((time.time() - s0) * 1000)
+    if image is not None:
+        render_cache.set((str(grid_out._id), mini, transform, size), image)
+    return image
+
+
+def mongo_image(image_id, mini=None, transform=None, size=None):
+    """Lê imagem do Banco MongoDB. Retorna None se ID não encontrado.
+
+    Imagens renderizadas (com mini, transform e/ou size) são guardadas em
+    render_cache.
+    """
     try:
         _id = bson.ObjectId(image_id)
-        if fs.exists(_id):
+        if mini is not None or transform is not None or size is not None:
+            image = render_cache.get((str(_id), mini, transform, size))
+            if image is not None:
+                return image
+        try:
             grid_out = fs.get(_id)
-            if mini is None:
-                image = grid_out.read()
-            else:
-                image = recorta_imagem(grid_out, mini)
-            return image
+        except gridfs.errors.NoFile:
+            return None
+        return render_and_cache(grid_out, mini, transform, size)
     except bson.errors.InvalidId as err:
         print(err)
     return None
 
 
+def _safe_render(grid_out, mini, transform, size):
+    """render_and_cache que retorna (imagem, erro) em vez de levantar."""
+    try:
+        return render_and_cache(grid_out, mini, transform, size), None
+    except Exception as err:
+        print('Erro ao ler imagem %s: %s' % (grid_out._id, err))
+        return None, 'Erro ao ler imagem: %s' % err
+
+
+def mongo_images(image_ids, mini=None, transform=None, size=None,
+                 errors=None):
+    """Lê várias imagens do Banco MongoDB de uma só vez.
+
+    Consulta os metadados de todos os ids não cacheados com um único $in
+    e lê/renderiza os arquivos em paralelo (read_executor).
+    Retorna OrderedDict id: bytes, na ordem de image_ids (None se id
+    inválido, não encontrado ou ilegível). Se errors (dict) for passado,
+    recebe id: mensagem dos ids sem imagem; uma imagem com erro não
+    interrompe as demais.
+    """
+    if errors is None:
+        errors = {}
+    result = OrderedDict()
+    pendentes = []
+    rendered = mini is not None or transform is not None or size is not None
+    for image_id in image_ids:
+        try:
+            _id = bson.ObjectId(image_id)
+        except bson.errors.InvalidId as err:
+            result[str(image_id)] = None
+            errors[str(image_id)] = 'id inválido: %s' % err
+            continue
+        image = None
+        if rendered:
+            image = render_cache.get((str(_id), mini, transform, size))
+        result[str(_id)] = image
+        if image is None:
+            pendentes.append(_id)
+    if pendentes:
+        grid_outs = [gridfs.GridOut(db.fs, file_document=document)
+                     for document in
+                     db['fs.files'].find({'_id': {'$in': pendentes}})]
+        images = read_executor.map(
+            lambda grid_out: _safe_render(grid_out, mini, transform, size),
+            grid_outs)
+        for grid_out, (image, error) in zip(grid_outs, images):
+            result[str(grid_out._id)] = image
+            if error:
+                errors[str(grid_out._id)] = error
+        for _id in pendentes:
+            if result[str(_id)] is None and str(_id) not in errors:
+                errors[str(_id)] = 'não encontrado'
+    return result
+
+
+def get_transform_param(req):
+    """Lê cadeia de transformações (ex: transform=rotate90,equalize)."""
+    transform = req.get_param('transform')
+    if transform is None:
+        return None
+    try:
+        return ImageBytesTansformations.parse_chain(transform) or None
+    except ValueError as err:
+        raise falcon.HTTPBadRequest(title='Transformação inválida',
+                                    description=str(err))
+
+
 class ImageResource(object):
     def __init__(self, image_loader):
         self.image_loader = image_loader
@@ -65,25 +317,138 @@ class ImageResource(object):
         resp.content_type = falcon.MEDIA_JPEG
         _id = req.get_param('id')
         mini = req.get_param('mini')
+        transform = get_transform_param(req)
+        size = req.get_param_as_int('size', min_value=1)
         if _id is None:
-            _id = lista_ids[random.randint(0, 100)]
+            _id = random_pool.choice()
+            if _id is None:
+                raise falcon.HTTPNotFound()
         # print('_id', _id)
         # print('mini', mini)
-        resp.data = self.image_loader(_id, mini)
+        resp.data = self.image_loader(_id, mini, transform, size)
         if resp.data is None:
             print("Retornando None...")
 
 
+class BatchImageResource(object):
+    """Várias imagens numa só requisição, empacotadas em BSON.
+
+    GET /imgs?ids=id1,id2,...&mini=n&size=s&transform=t1,t2
+    POST /imgs com JSON {"ids": [...]} (mesmos demais parâmetros na URL)
+
+    Resposta: documento BSON {id: bytes da imagem ou null}; se algum id
+    ficou sem imagem, a chave "_errors" traz {id: mensagem}.
+    """
+
+    def __init__(self, images_loader):
+        self.images_loader = images_loader
+
+    def load(self, req, resp, ids):
+        if not ids:
+            raise falcon.HTTPBadRequest(title='Parâmetro ids obrigatório')
+        if not isinstance(ids, list) or \
+                not all(isinstance(_id, str) for _id in ids):
+            raise falcon.HTTPBadRequest(
+                title='Parâmetro ids inválido',
+                description='ids deve ser uma lista de strings')
+        if len(ids) > BATCH_MAX_IDS:
+            raise falcon.HTTPBadRequest(
+                title='Excesso de ids',
+                description='Máximo de %d ids por requisição' % BATCH_MAX_IDS)
+        mini = req.get_param('mini')
+        transform = get_transform_param(req)
+        size = req.get_param_as_int('size', min_value=1)
+        errors = {}
+        images = self.images_loader(ids, mini, transform, size, errors)
+        if errors:
+            images['_errors'] = errors
+        resp.content_type = 'application/bson'
+        resp.data = bytes(bson.BSON.encode(images))
+
+    def on_get(self, req, resp):
+        # ids=a,b e ids=a&ids=b (o Falcon não separa vírgulas por padrão)
+        ids = [_id for value in req.get_param_as_list('ids', default=[])
+               for _id in value.split(',') if _id]
+        self.load(req, resp, ids)
+
+    def on_post(self, req, resp):
+        media = req.media or {}
+        if not isinstance(media, dict):
+            raise falcon.HTTPBadRequest(title='Esperado objeto JSON')
+        self.load(req, resp, media.get('ids'))
+
+
+class StatsResource(object):
+    def __init__(self, cache):
+        self.cache = cache
+
+    def on_get(self, req, resp):
+        """Estatísticas do cache de renderização."""
+        resp.media = self.cache.info()
+
+
+def warmup(ids, minis=None):
+    """Pré-renderiza recortes das imagens ids no render_cache.
+
+    Se minis não for informado, renderiza todos os bbox de cada imagem.
+    Retorna número de recortes renderizados.
+    """
+    total = 0
+    for image_id in ids:
+        try:
+            _id = bson.ObjectId(image_id)
+        except bson.errors.InvalidId as err:
+            print(err)
+            continue
+        indices = minis
+        if indices is None:
+            row = db['fs.files'].find_one(
+                {'_id': _id}, {'metadata.predictions': 1})
+            if row is None:
+                continue
+            preds = row.get('metadata', {}).get('predictions') or []
+            indices = range(len(preds))
+        for mini in indices:
+            if mongo_image(_id, str(mini)) is not None:
+                total += 1
+    return total
+
+
 # falcon.API instances are callable WSGI apps
 app = falcon.API()
 
 # Resources are represented by long-lived class instances
 images = ImageResource(mongo_image)
+batch_images = BatchImageResource(mongo_images)
+stats = StatsResource(render_cache)
 
 
 # things will handle all requests to the '/things' URL path
 app.add_route('/img', images)
+app.add_route('/imgs', batch_images)
+app.add_route('/stats', stats)
+
+
+@click.group(invoke_without_command=True)
+@click.pass_context
+def cli(ctx):
+    """Sem comando, inicia o servidor."""
+    if ctx.invoked_subcommand is None:
+        httpd = simple_server.make_server('127.0.0.1', 8000, app)
+        httpd.serve_forever()
+
+
+@cli.command(name='warmup')
+@click.argument('ids_file', type=click.File('r'))
+@click.option('--mini', multiple=True, type=int,
+              help='Índice(s) do recorte. Padrão: todos os bbox')
+def warmup_command(ids_file, mini):
+    """Pré-renderiza recortes para os _id listados (um por linha)."""
+    ids = [line.strip() for line in ids_file if line.strip()]
+    total = warmup(ids, list(mini) or None)
+    print('%d recortes renderizados.' % total)
+    print(json.dumps(render_cache.info(), indent=2))
+
 
 if __name__ == '__main__':
-    httpd = simple_server.make_server('127.0.0.1', 8000, app)
-    httpd.serve_forever()
+    cli()
@@ -0,0 +1,115 @@
+import time
+import unittest
+from collections import OrderedDict
+
+import bson
+import falcon
+from falcon import testing
+
+from imgserver import BatchImageResource, RandomImagePool
+
+
+class FakeLoader():
+    """Substitui mongo_images, registrando os ids recebidos."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, ids, mini, transform, size, errors):
+        self.calls.append(list(ids))
+        result = OrderedDict()
+        for _id in ids:
+            if _id == 'ruim':
+                result[_id] = None
+                errors[_id] = 'id inválido'
+            else:
+                result[_id] = _id.encode()
+        return result
+
+
+class FakeCollection():
+    """Subconjunto de Collection: aggregate com $sample."""
+
+    def __init__(self, ids):
+        self.ids = ids
+        self.sizes = []
+
+    def aggregate(self, pipeline):
+        size = pipeline[1]['$sample']['size']
+        self.sizes.append(size)
+        return [{'_id': _id} for _id in self.ids[:size]]
+
+
+class TestBatchImageResource(unittest.TestCase):
+
+    def setUp(self):
+        self.loader = FakeLoader()
+        app = falcon.App()
+        app.add_route('/imgs', BatchImageResource(self.loader))
+        self.client = testing.TestClient(app)
+
+    def decode(self, result):
+        self.assertEqual(result.status, falcon.HTTP_200)
+        return bson.BSON(result.content).decode()
+
+    def test_get_virgulas(self):
+        result = self.client.simulate_get('/imgs', query_string='ids=a,b')
+        self.assertEqual(self.decode(result), {'a': b'a', 'b': b'b'})
+        self.assertEqual(self.loader.calls, [['a', 'b']])
+
+    def test_get_repetido(self):
+        result = self.client.simulate_get('/imgs',
+                                          query_string='ids=a&ids=b,c')
+        self.assertEqual(self.decode(result),
+                         {'a': b'a', 'b': b'b', 'c': b'c'})
+
+    def test_get_sem_ids(self):
+        result = self.client.simulate_get('/imgs')
+        self.assertEqual(result.status, falcon.HTTP_400)
+
+    def test_post(self):
+        result = self.client.simulate_post('/imgs',
+                                           json={'ids': ['a', 'ruim']})
+        self.assertEqual(self.decode(result),
+                         {'a': b'a', 'ruim': None,
+                          '_errors': {'ruim': 'id inválido'}})
+
+    def test_post_invalido(self):
+        for body in ({'ids': 'a'}, {'ids': [1]}, ['a']):
+            result = self.client.simulate_post('/imgs', json=body)
+            self.assertEqual(result.status, falcon.HTTP_400)
+        self.assertEqual(self.loader.calls, [])
+
+
+class TestRandomImagePool(unittest.TestCase):
+
+    def test_sem_amostra_sorteia_um(self):
+        collection = FakeCollection(['a', 'b'])
+        pool = RandomImagePool(collection, {}, size=2, ttl=60)
+        pool.refresh_background = lambda: None
+        self.assertEqual(pool.choice(), 'a')
+        self.assertEqual(collection.sizes, [1])
+
+    def test_usa_amostra(self):
+        collection = FakeCollection(['a', 'b'])
+        pool = RandomImagePool(collection, {}, size=2, ttl=60)
+        pool.refresh()
+        self.assertIn(pool.choice(), ('a', 'b'))
+        self.assertEqual(collection.sizes, [2])
+
+    def test_renova_em_segundo_plano(self):
+        collection = FakeCollection(['a'])
+        pool = RandomImagePool(collection, {}, size=1, ttl=60)
+        pool.ids = ['velho']
+        pool.loaded_at = time.time() - 120
+        self.assertEqual(pool.choice(), 'velho')
+        for _ in range(100):
+            if pool.ids == ['a']:
+                break
+            time.sleep(0.01)
+        self.assertEqual(pool.ids, ['a'])
+
+    def test_vazio(self):
+        pool = RandomImagePool(FakeCollection([]), {}, ttl=60)
+        pool.refresh()
+        self.assertIsNone(pool.choice())